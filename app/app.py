@@ -22,7 +22,7 @@ print(f"Parent directory: {parent_dir}")
 print(f"sys.path: {sys.path}")
 
 # Now import preprocess
-from preprocess import DataPreprocessor
+from preprocess import DataPreprocessor, ARTIFACT_NAME
 
 
 
@@ -113,7 +113,9 @@ class StreamlitApp:
         for i, feature in enumerate(self.feature_names):
             if feature in cat_features:
                 cat_indices.append(i)
-                df[feature] = df[feature].astype(str)
+                # Columns encoded through the category dictionaries are passed to CatBoost as they are
+                if df[feature].dtype.name != 'category':
+                    df[feature] = df[feature].astype(str)
             else:
                 if feature in df.columns and df[feature].dtype == 'object':
                     df[feature] = df[feature].astype(str)
@@ -141,15 +143,16 @@ class StreamlitApp:
                     with log_container.container():
                         st.text(message)
 
-            preprocessor = DataPreprocessor(
+            # The preprocessing options come from the artifact, like the fitted encoders
+            self.preprocessor = preprocessor = DataPreprocessor(
                 output_path=current_dir / "data" / "processed",  # Updated path
-                remove_outliers=False,
-                fillna=True,
                 save_as_pickle=False,
                 callback=logging_callback
             )
 
-            processed_df = preprocessor.preprocess_test(df_test=df)
+            # Fitted encoders saved by preprocess.py, no refit on every upload
+            artifact_path = parent_dir / "data" / "processed" / ARTIFACT_NAME
+            processed_df = preprocessor.preprocess_test(df_test=df, artifact_path=artifact_path)
 
             if st.session_state.debug_mode:
                 st.write("Preprocessing Statistics:")
@@ -235,8 +238,8 @@ class StreamlitApp:
         try:
             with st.expander("Preprocessing Details", expanded=st.session_state.debug_mode):
                 processed_df = self.preprocess_test_data(df)
-            preprocess = DataPreprocessor()
-            cat_features = preprocess.determine_categorical_features(processed_df)
+            # Same preprocessor, hence the same category dictionaries, as preprocess_test_data
+            cat_features = self.preprocessor.determine_categorical_features(processed_df)
             processed_df, cat_indices = self.prepare_features(processed_df, cat_features)
             
             if st.session_state.debug_mode:
@@ -0,0 +1,185 @@
+"""
+Scaling benchmark of DataPreprocessor on synthetic data.
+
+For every size, a train and a test CSV are generated once (and reused across runs), then
+load_data and preprocess are timed with the stage profiler disabled, and the per-stage profile
+comes from a second, profiled run of preprocess. Results are written as
+JSON to benchmarks/results/, one file per run, so scaling curves can be tracked and two runs
+can be compared:
+
+    python -m benchmarks.bench_preprocess
+    python -m benchmarks.bench_preprocess --sizes 100k 1M 10M 50M --n-jobs -1
+    python -m benchmarks.bench_preprocess --compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import write_csv
+from preprocess import DataPreprocessor, PIPELINE_SOURCES
+from utils.preprocess_cache import code_version
+from utils.profiling import peak_rss_mb
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+DATA_DIR = BENCHMARK_DIR / "data"
+RESULTS_DIR = BENCHMARK_DIR / "results"
+# The larger sizes (10M, 50M) need tens of GB of RAM and are opt-in through --sizes
+DEFAULT_SIZES = ["100k", "1M"]
+TEST_FRACTION = 0.25
+REGRESSION_THRESHOLD = 1.2
+
+logger = logging.getLogger(__name__)
+
+
+def parse_size(size: str) -> int:
+    """'100k' -> 100000, '10M' -> 10000000."""
+    multipliers = {"k": 10 ** 3, "m": 10 ** 6}
+    size = size.strip().lower()
+    if size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def dataset(n_rows: int, seed: int) -> tuple:
+    """Paths of the synthetic train and test CSVs for `n_rows`, generated on first use."""
+    train_path = DATA_DIR / f"train_{n_rows}_{seed}.csv"
+    test_path = DATA_DIR / f"test_{n_rows}_{seed}.csv"
+    if not train_path.exists():
+        logger.info(f"Generating {n_rows} synthetic training rows")
+        write_csv(train_path, n_rows, seed=seed)
+    if not test_path.exists():
+        write_csv(test_path, max(int(n_rows * TEST_FRACTION), 1), seed=seed + 1000)
+    return train_path, test_path
+
+
+def run_size(n_rows: int, seed: int, options: dict) -> dict:
+    """Time load_data and preprocess on `n_rows` training rows, then profile the stages of preprocess."""
+    train_path, test_path = dataset(n_rows, seed)
+    preprocessor = DataPreprocessor(output_path=BENCHMARK_DIR / "output", **options)
+
+    start = time.perf_counter()
+    df_train, df_test = preprocessor.load_data(train_path, test_path)
+    load_wall = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preprocessor.preprocess(df_train, df_test)
+    preprocess_wall = time.perf_counter() - start
+    peak_rss = peak_rss_mb()
+
+    # The profiler's bookkeeping stays out of the timings above
+    profiled = DataPreprocessor(output_path=BENCHMARK_DIR / "output", profile=True, **options)
+    profiled.preprocess(*profiled.load_data(train_path, test_path))
+
+    return {
+        "rows": n_rows,
+        "status": "ok",
+        "load_wall_s": load_wall,
+        "preprocess_wall_s": preprocess_wall,
+        "total_wall_s": load_wall + preprocess_wall,
+        "rows_per_s": n_rows / (load_wall + preprocess_wall),
+        "peak_rss_mb": peak_rss,
+        "stages": profiled.profiler.report()["summary"],
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=BENCHMARK_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(sizes: list, seed: int, options: dict) -> dict:
+    results = {
+        "git_revision": git_revision(),
+        "code_version": code_version(PIPELINE_SOURCES),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "options": options,
+        "seed": seed,
+        "results": [],
+    }
+    for size in sizes:
+        n_rows = parse_size(size)
+        # Every size runs in its own process, so peak RSS and memory failures stay per size
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_preprocess", "--single", str(n_rows),
+             "--seed", str(seed), "--options", json.dumps(options)],
+            capture_output=True, text=True, cwd=BENCHMARK_DIR.parent)
+        if result.returncode == 0:
+            size_result = json.loads(result.stdout.strip().splitlines()[-1])
+            logger.info(f"{n_rows} rows: {size_result['total_wall_s']:.2f}s, peak RSS {size_result['peak_rss_mb']} MB")
+        else:
+            size_result = {"rows": n_rows, "status": "failed", "error": result.stderr.strip().splitlines()[-1:]}
+            logger.warning(f"{n_rows} rows failed: {size_result['error']}")
+        results["results"].append(size_result)
+    return results
+
+
+def compare(baseline_path: Path, candidate_path: Path, threshold: float = REGRESSION_THRESHOLD) -> bool:
+    """Print the time ratios of two result files; returns False if any size or stage regressed."""
+    baseline, candidate = (json.loads(Path(path).read_text()) for path in (baseline_path, candidate_path))
+    baseline_by_rows = {result["rows"]: result for result in baseline["results"] if result["status"] == "ok"}
+    ok = True
+
+    for result in candidate["results"]:
+        reference = baseline_by_rows.get(result["rows"])
+        if reference is None or result["status"] != "ok":
+            continue
+        ratio = result["total_wall_s"] / reference["total_wall_s"]
+        flag = " REGRESSION" if ratio > threshold else ""
+        ok &= ratio <= threshold
+        print(f"{result['rows']:>10} rows  total {reference['total_wall_s']:8.2f}s -> {result['total_wall_s']:8.2f}s "
+              f"({ratio:.2f}x){flag}")
+
+        reference_stages = {stage["stage"]: stage for stage in reference["stages"]}
+        for stage in result["stages"]:
+            before = reference_stages.get(stage["stage"])
+            if before is None or before["wall_s"] == 0:
+                continue
+            stage_ratio = stage["wall_s"] / before["wall_s"]
+            if stage_ratio > threshold:
+                print(f"{'':>16}{stage['stage']}: {before['wall_s']:.3f}s -> {stage['wall_s']:.3f}s ({stage_ratio:.2f}x)")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark DataPreprocessor on synthetic data.")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="Training set sizes (default: 100k 1M), e.g. 100k 1M 10M 50M")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--n-jobs", type=int, default=1, help="Processes for the per-fold feature generation")
+    parser.add_argument("--output", type=str, default=None, help="Result file (default: benchmarks/results/<time>_<rev>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two result files")
+    parser.add_argument("--single", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--options", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        # Worker mode: one size, result as the last line of stdout
+        logging.disable(logging.WARNING)
+        print(json.dumps(run_size(args.single, args.seed, json.loads(args.options)), default=float))
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.compare:
+        sys.exit(0 if compare(*args.compare) else 1)
+
+    options = {"fillna": True, "n_jobs": args.n_jobs}
+    results = run_benchmarks(args.sizes, args.seed, options)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{time.strftime('%Y%m%d_%H%M%S')}_{results['git_revision']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2, default=float))
+    logger.info(f"Saved benchmark results to {output}")
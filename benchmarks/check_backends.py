@@ -0,0 +1,133 @@
+"""
+Check that the partitioned backends of DataPreprocessor give the outputs of the pandas path.
+
+The pandas path (load_data, preprocess and save_data with columnar=True) and the out-of-core
+pipeline run on the same synthetic benchmark dataset, the latter with its shard tasks on the
+chosen backend. Every saved table and fold must be identical; the check exits with status 1
+otherwise:
+
+    python -m benchmarks.check_backends                       # dask LocalCluster, or the stand-in without dask
+    python -m benchmarks.check_backends --backend processes --n-workers 4
+    python -m benchmarks.check_backends --backend standin --size 100k
+
+The "standin" backend runs the DaskExecutor code path on a local process pool behind the
+subset of the dask Client API it uses, for machines without dask.distributed (an optional
+dependency). tests/test_executors.py runs the same comparison on a small dataset.
+"""
+import argparse
+import logging
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from benchmarks.bench_preprocess import BENCHMARK_DIR, dataset, parse_size
+from preprocess import DataPreprocessor
+from utils.columnar import load_processed
+from utils.executors import Client, DaskExecutor, SerialExecutor, ProcessExecutor, LOCAL_SCHEDULER
+from utils.fold_store import FoldStore
+from utils.out_of_core import OutOfCorePipeline, N_FOLDS
+from utils.shards import ShardStore
+
+DEFAULT_SIZE = "20k"
+DEFAULT_SHARDS = 8
+OUTPUT_DIR = BENCHMARK_DIR / "output" / "backends"
+TABLES = ["cleaned_data_Maor", "X_train", "X_test", "y_train", "y_test", "df_TEST_DoNotTouch"]
+
+logger = logging.getLogger(__name__)
+
+
+class LocalClusterStandIn:
+    """The submit, scatter and gather methods of a dask Client, on a local process pool."""
+
+    def __init__(self, n_workers: int):
+        self.pool = ProcessPoolExecutor(max_workers=n_workers)
+
+    def scatter(self, data: list, broadcast: bool = False, hash: bool = True) -> list:
+        return list(data)
+
+    def submit(self, func, *args, pure: bool = True):
+        return self.pool.submit(func, *args)
+
+    def gather(self, futures: list) -> list:
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def make_backend(backend: str, n_workers: int):
+    if backend == "serial":
+        return SerialExecutor()
+    if backend == "processes":
+        return ProcessExecutor(n_workers)
+    if backend == "dask":
+        return DaskExecutor(LOCAL_SCHEDULER, n_workers=n_workers)
+    if backend == "standin":
+        return DaskExecutor(client=LocalClusterStandIn(n_workers))
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+def differences(expected, actual) -> str:
+    """The assertion message of two different frames or series, "" when they are identical."""
+    assert_equal = pd.testing.assert_frame_equal if isinstance(expected, pd.DataFrame) else pd.testing.assert_series_equal
+    try:
+        assert_equal(expected, actual, check_exact=True)
+    except AssertionError as error:
+        return str(error)
+    return ""
+
+
+def compare_outputs(expected_dir, actual_dir) -> list:
+    """The tables and folds that differ between two output directories, with their differences."""
+    mismatches = [f"{name}: {difference}" for name in TABLES
+                  if (difference := differences(load_processed(expected_dir, name), load_processed(actual_dir, name)))]
+
+    expected_folds, actual_folds = FoldStore(expected_dir), FoldStore(actual_dir)
+    for fold in range(N_FOLDS):
+        for part, (expected, actual) in enumerate(zip(expected_folds.load_fold(fold), actual_folds.load_fold(fold))):
+            if difference := differences(expected, actual):
+                mismatches.append(f"fold {fold} part {part}: {difference}")
+    return mismatches
+
+
+def compare_backend(train_path, test_path, output_dir, backend: str, n_workers: int, n_shards: int,
+                    options: dict) -> list:
+    """The mismatches of the outputs of `backend` with the pandas path on the raw CSVs, written under `output_dir`."""
+    pandas_preprocessor = DataPreprocessor(output_path=output_dir / "pandas", columnar=True, **options)
+    pandas_preprocessor.save_data(*pandas_preprocessor.preprocess(*pandas_preprocessor.load_data(train_path, test_path)))
+
+    partitioned = DataPreprocessor(output_path=output_dir / backend, columnar=True, **options)
+    store = ShardStore(output_dir / backend / "shards", n_shards)
+    with make_backend(backend, n_workers) as executor:
+        OutOfCorePipeline(partitioned, store, executor).run(train_path, test_path)
+    return compare_outputs(output_dir / "pandas", output_dir / backend)
+
+
+def check_backend(n_rows: int, seed: int, backend: str, n_workers: int, n_shards: int, options: dict) -> list:
+    train_path, test_path = dataset(n_rows, seed)
+    shutil.rmtree(OUTPUT_DIR, ignore_errors=True)
+    return compare_backend(train_path, test_path, OUTPUT_DIR, backend, n_workers, n_shards, options)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the partitioned backends with the pandas path.")
+    parser.add_argument("--size", default=DEFAULT_SIZE, help="Training set size, e.g. 20k or 1M")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--backend", choices=["serial", "processes", "dask", "standin"],
+                        default="dask" if Client is not None else "standin", help="Executor of the shard tasks")
+    parser.add_argument("--n-workers", type=int, default=2, help="Worker processes of the backend")
+    parser.add_argument("--n-shards", type=int, default=DEFAULT_SHARDS, help="Number of user_id shards")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("preprocess").setLevel(logging.ERROR)
+
+    mismatches = check_backend(parse_size(args.size), args.seed, args.backend, args.n_workers, args.n_shards,
+                               {"fillna": True})
+    for mismatch in mismatches:
+        logger.error(mismatch)
+    if mismatches:
+        sys.exit(1)
+    logger.info(f"The {args.backend} backend matches the pandas path on {args.size} rows")
@@ -0,0 +1,70 @@
+"""
+Peak-memory ceiling check of DataPreprocessor.preprocess in copy-on-write mode.
+
+preprocess runs on a synthetic benchmark dataset (generated once, shared with bench_preprocess)
+while tracemalloc records the peak of the memory allocated by the pipeline (numpy and pandas
+buffers included). The peak, outputs included, must stay below CEILING_RATIO times the memory of
+the loaded input frames; the check exits with status 1 otherwise. tests/test_copy_on_write.py
+runs the same check on a small frame:
+
+    python -m benchmarks.check_memory
+    python -m benchmarks.check_memory --size 1M --ceiling 25
+    python -m benchmarks.check_memory --no-copy-on-write   # the deep-copy mode, for comparison
+"""
+import argparse
+import logging
+import sys
+import tracemalloc
+
+from benchmarks.bench_preprocess import BENCHMARK_DIR, dataset, parse_size
+from preprocess import DataPreprocessor
+from utils.profiling import frame_memory_mb
+
+DEFAULT_SIZE = "100k"
+# Peak allocation of preprocess over the memory of its input frames. With fillna, the outputs
+# alone (five folds plus the final train and test sets) account for about 20 times the input;
+# copy-on-write measures 21-23 times from 10k rows up, the deep-copy mode about 35 times.
+CEILING_RATIO = 25.0
+
+logger = logging.getLogger(__name__)
+
+
+def measure_peak(n_rows: int, seed: int, options: dict) -> dict:
+    """Peak memory allocated by preprocess on `n_rows` training rows, in MB and relative to its input."""
+    train_path, test_path = dataset(n_rows, seed)
+    return {"rows": n_rows, **preprocess_peak(train_path, test_path, BENCHMARK_DIR / "output", options)}
+
+
+def preprocess_peak(train_path, test_path, output_path, options: dict) -> dict:
+    """Peak memory allocated by preprocess on the loaded CSVs, in MB and relative to the loaded frames."""
+    preprocessor = DataPreprocessor(output_path=output_path, **options)
+    df_train, df_test = preprocessor.load_data(train_path, test_path)
+    input_mb = frame_memory_mb(df_train) + frame_memory_mb(df_test)
+
+    tracemalloc.start()
+    try:
+        preprocessor.preprocess(df_train, df_test)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+    return {"input_mb": input_mb, "peak_mb": peak_mb, "ratio": peak_mb / input_mb}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the peak memory of DataPreprocessor.preprocess.")
+    parser.add_argument("--size", default=DEFAULT_SIZE, help="Training set size, e.g. 100k or 1M")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--ceiling", type=float, default=CEILING_RATIO, help="Maximum peak memory over input memory")
+    parser.add_argument("--no-copy-on-write", action="store_true", help="Flag to measure the deep-copy mode instead")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("preprocess").setLevel(logging.WARNING)
+
+    options = {"fillna": True, "copy_on_write": not args.no_copy_on_write}
+    result = measure_peak(parse_size(args.size), args.seed, options)
+    logger.info(f"{result['rows']} rows: input {result['input_mb']:.1f} MB, peak {result['peak_mb']:.1f} MB "
+                f"({result['ratio']:.1f}x, ceiling {args.ceiling:.1f}x)")
+    if result["ratio"] > args.ceiling:
+        logger.error(f"Peak memory {result['ratio']:.1f}x the input exceeds the ceiling of {args.ceiling:.1f}x")
+        sys.exit(1)
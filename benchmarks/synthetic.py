@@ -0,0 +1,136 @@
+"""
+Synthetic click data with the raw schema of data/raw/train_dataset_full.csv.
+
+The generated sessions reproduce the structure the preprocessing relies on:
+    - user attributes (user_group_id, gender, age_level, user_depth, city_development_index)
+      are constant per user, so deterministic_fill can recover them from user_id,
+    - campaigns map to a single webpage, and all webpages except 13787 to a single campaign,
+    - campaign 396664 / webpage 51181 always have product_category_1 == 1,
+    - user_group_id is 0 for age_level 0, and age_level (+ 6 for women) otherwise,
+    - product_category_2 is mostly missing, and every column has scattered missing values
+      plus a few completely empty rows,
+    - about 7% of the sessions are clicks, with campaign, product and user effects.
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+RAW_COLUMNS = [
+    "session_id", "DateTime", "user_id", "product", "campaign_id", "webpage_id", "product_category_1",
+    "product_category_2", "user_group_id", "gender", "age_level", "user_depth", "city_development_index",
+    "var_1", "is_click",
+]
+
+CAMPAIGN_WEBPAGE = {
+    359520: 13787, 405490: 60305, 360936: 13787, 118601: 28529, 98970: 6970,
+    414149: 45962, 404347: 53587, 82320: 1734, 105960: 11085, 396664: 51181,
+}
+CAMPAIGN_WEIGHTS = np.array([0.23, 0.14, 0.13, 0.12, 0.09, 0.08, 0.07, 0.06, 0.05, 0.03])
+PRODUCTS = np.array(list("ABCDEFGHIJ"))
+PRODUCT_WEIGHTS = np.array([0.06, 0.08, 0.32, 0.11, 0.04, 0.03, 0.04, 0.14, 0.13, 0.05])
+PRODUCT_CATEGORY_2 = np.array([82527.0, 146115.0, 270915.0, 254132.0, 447834.0, 408790.0, 234846.0, 419804.0])
+
+START = np.datetime64("2017-07-02T00:00")
+N_MINUTES = 6 * 24 * 60
+USERS_PER_ROW = 0.33
+CLICK_RATE = 0.07
+MISSING_RATE = 0.005
+EMPTY_ROW_RATE = 0.001
+
+
+def make_users(n_users: int, rng: np.random.Generator) -> pd.DataFrame:
+    """One row per user with the attributes that stay constant over the user's sessions."""
+    age_level = rng.choice(7, n_users, p=[0.03, 0.06, 0.24, 0.33, 0.2, 0.1, 0.04]).astype(float)
+    female = rng.random(n_users) < 0.12
+    return pd.DataFrame({
+        "user_id": rng.choice(np.arange(1, 1_150_000), n_users, replace=False).astype(float),
+        "user_group_id": np.where(age_level == 0, 0, age_level + 6 * female),
+        "gender": np.where(female, "Female", "Male"),
+        "age_level": age_level,
+        "user_depth": rng.choice([1.0, 2.0, 3.0], n_users, p=[0.04, 0.1, 0.86]),
+        "city_development_index": np.where(rng.random(n_users) < 0.27, np.nan,
+                                           rng.choice([1.0, 2.0, 3.0, 4.0], n_users)),
+        "activity": rng.pareto(1.5, n_users) + 1,
+        "propensity": rng.lognormal(0, 0.6, n_users),
+    })
+
+
+def generate(n_rows: int, seed: int = 0, users: pd.DataFrame = None, first_session_id: int = 1,
+             missing_rate: float = MISSING_RATE) -> pd.DataFrame:
+    """
+    Generate `n_rows` raw sessions. Pass `users` (from make_users) to draw several chunks from
+    the same user population, with `first_session_id` keeping session ids unique across chunks.
+    """
+    rng = np.random.default_rng(seed)
+    if users is None:
+        users = make_users(max(int(n_rows * USERS_PER_ROW), 10), rng)
+
+    user_rows = rng.choice(len(users), n_rows, p=users["activity"] / users["activity"].sum())
+    campaigns = np.array(list(CAMPAIGN_WEBPAGE))
+    campaign_rows = rng.choice(len(campaigns), n_rows, p=CAMPAIGN_WEIGHTS)
+    campaign_id = campaigns[campaign_rows]
+    webpage_id = np.array(list(CAMPAIGN_WEBPAGE.values()))[campaign_rows]
+    product_rows = rng.choice(len(PRODUCTS), n_rows, p=PRODUCT_WEIGHTS)
+
+    product_category_1 = rng.choice([1.0, 2.0, 3.0, 4.0, 5.0], n_rows, p=[0.2, 0.15, 0.35, 0.2, 0.1])
+    product_category_1[campaign_id == 396664] = 1.0
+    product_category_2 = np.where(rng.random(n_rows) < 0.21, rng.choice(PRODUCT_CATEGORY_2, n_rows), np.nan)
+
+    minutes = rng.integers(0, N_MINUTES, n_rows)
+    date_time = np.char.replace(np.datetime_as_string(START + minutes.astype("timedelta64[m]"), unit="m"), "T", " ")
+
+    # Click probability around CLICK_RATE with campaign, product and user effects
+    logit = np.log(CLICK_RATE / (1 - CLICK_RATE)) + 0.3 * np.sin(campaign_rows) + 0.2 * np.cos(product_rows)
+    logit += np.log(users["propensity"].to_numpy()[user_rows]) - 0.18
+    is_click = (rng.random(n_rows) < 1 / (1 + np.exp(-logit))).astype(float)
+
+    user_attributes = users.iloc[user_rows].reset_index(drop=True)
+    df = pd.DataFrame({
+        "session_id": first_session_id + rng.permutation(n_rows).astype(float),
+        "DateTime": date_time.astype(object),
+        "user_id": user_attributes["user_id"].to_numpy(),
+        "product": PRODUCTS[product_rows].astype(object),
+        "campaign_id": campaign_id.astype(float),
+        "webpage_id": webpage_id.astype(float),
+        "product_category_1": product_category_1,
+        "product_category_2": product_category_2,
+        "user_group_id": user_attributes["user_group_id"].to_numpy(),
+        "gender": user_attributes["gender"].to_numpy().astype(object),
+        "age_level": user_attributes["age_level"].to_numpy(),
+        "user_depth": user_attributes["user_depth"].to_numpy(),
+        "city_development_index": user_attributes["city_development_index"].to_numpy(),
+        "var_1": (rng.random(n_rows) < 0.43).astype(float),
+        "is_click": is_click,
+    })[RAW_COLUMNS]
+
+    # Scattered missing values in every column, plus completely empty rows
+    for col in RAW_COLUMNS:
+        missing = rng.random(n_rows) < missing_rate
+        if missing.any():
+            df.loc[missing, col] = np.nan
+    df.loc[rng.random(n_rows) < EMPTY_ROW_RATE] = np.nan
+    return df
+
+
+def write_csv(path: Path, n_rows: int, seed: int = 0, chunk_rows: int = 1_000_000) -> Path:
+    """Write `n_rows` sessions to `path` chunk by chunk, so large files fit in memory."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    users = make_users(max(int(n_rows * USERS_PER_ROW), 10), rng)
+
+    for i, start in enumerate(range(0, n_rows, chunk_rows)):
+        chunk = generate(min(chunk_rows, n_rows - start), seed=seed + 1 + i, users=users, first_session_id=1 + start)
+        chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic raw click dataset.")
+    parser.add_argument("path", type=str, help="Output CSV path")
+    parser.add_argument("--rows", type=int, default=100_000, help="Number of sessions")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    print(write_csv(Path(args.path), args.rows, seed=args.seed))
@@ -22,34 +22,36 @@ from sklearn.metrics import precision_recall_curve, auc, classification_report,f
 import os
 from pathlib import Path
 from preprocess import DataPreprocessor
+from utils.columnar import load_processed
 
 class error_analysis():
     def __init__(self):
         pass
     
 
-    def compute_final_df(self):
+    def compute_final_df(self, extra_columns=None):
         # Load data
         model_path = Path("models/best_model_catboost_newest.cbm")
-        y_test = pd.read_pickle('data/processed/y_test.pkl')
-        X_test = pd.read_pickle('data/processed/X_test.pkl')
 
-        # Convert 'category' columns to 'object'
-        for col in X_test.columns:
-            if X_test[col].dtype.name == 'category':
-                X_test[col] = X_test[col].astype('object')
+        # Load the model
+        model = CatBoostClassifier()
+        model.load_model(model_path)
 
-        # Identify categorical features
+        # Only the model's features, plus the columns wanted for the analysis, are read
+        feature_names = model.feature_names_
+        columns = feature_names + [col for col in (extra_columns or []) if col not in feature_names]
+        y_test = load_processed(Path("data/processed"), "y_test")
+        X_test = load_processed(Path("data/processed"), "X_test", columns=columns)
+
+        # Identify categorical features, encoded with the category dictionaries of the artifact
         processors = DataPreprocessor()
+        processors.load_artifact()
         cat_features = processors.determine_categorical_features(X_test)
+        cat_features = [col for col in cat_features if col in feature_names]
         print("Categorical features:", cat_features)
 
-        # Load the model
-        model = CatBoostClassifier()
-        model.load_model(model_path)
-
         # Create a Pool object with categorical features
-        test_pool = Pool(X_test, cat_features=cat_features)
+        test_pool = Pool(X_test[feature_names], cat_features=cat_features)
 
         # Make predictions using the Pool
         predictions_proba = model.predict_proba(test_pool)
@@ -217,12 +219,12 @@ if __name__ == '__main__':
     # Create an instance of error_analysis
     ea = error_analysis()
     
+    categorical_columns = ['product', 'campaign_id', 'user_group_id', 'age_level', 'user_depth', 'city_development_index']
+
     # Call instance methods
-    df, ece = ea.compute_final_df()
+    df, ece = ea.compute_final_df(extra_columns=categorical_columns)
     df.to_csv('data/Predictions/error_analysis.csv', index=False)
     #ea.plot_error_analysis(df)
 
-    categorical_columns = ['product', 'campaign_id', 'user_group_id', 'age_level', 'user_depth', 'city_development_index']
-
     # Create and display the interactive Bokeh plot
     ea.create_interactive_plot(df, categorical_columns)
\ No newline at end of file
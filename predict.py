@@ -1,10 +1,12 @@
-<<<<<<< HEAD
 import pandas as pd
 import numpy as np
 import argparse
 from sklearn.metrics import f1_score, precision_score, recall_score
 import logging
 from catboost import CatBoostClassifier
+from pathlib import Path
+from preprocess import DataPreprocessor, ARTIFACT_NAME
+from utils.ingest import read_raw_csv
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -40,44 +42,41 @@ if __name__ == "__main__":
     parser.add_argument("--data", type=str,default= "data/processed/X_test.pkl", help="Path to the input data file")
     parser.add_argument("--model-name", type=str, required=True, help="Path to the saved model file")
     parser.add_argument("--batch-size", type=int, default=32, help="Prediction batch size")
+    parser.add_argument("--artifact", type=str, default=f"data/processed/{ARTIFACT_NAME}",
+                        help="Path to the fitted preprocessor artifact, used when --data is a raw CSV")
     args = parser.parse_args()
     # Load the data
     logger.info(f"Loading data from {args.data}...")
-    data = pd.read_pickle(args.data)
-    data.drop(columns=['session_id', 'DateTime', 'user_id'], inplace=True)
+    raw_input = args.data.endswith(".csv")
+    if raw_input:
+        # Raw sessions: transform them with the fitted state and options saved by preprocess.py
+        preprocessor = DataPreprocessor(save_as_pickle=False)
+        data = preprocessor.preprocess_test(read_raw_csv(args.data), artifact_path=Path(args.artifact))
+        data.drop(columns=['is_click'], inplace=True)
+    else:
+        data = pd.read_pickle(args.data)
+        data.drop(columns=['session_id', 'DateTime', 'user_id'], inplace=True)
     cat_features = data.select_dtypes(include=['object', 'category']).columns.tolist()
     for col in cat_features:
-        data[col] = data[col].astype("category").cat.add_categories("missing").fillna("missing")
+        data[col] = data[col].astype("category")
+        if "missing" not in data[col].cat.categories:
+            data[col] = data[col].cat.add_categories("missing")
+        data[col] = data[col].fillna("missing")
 
     # Make predictions
     predictions = predict(data, args.model_name, args.batch_size)
 
-    # Evaluate the model
-    logger.info("Evaluating model...")
-    y_test = pd.read_pickle("data/processed/y_test.pkl")
-    y_pred = predictions > 0.5  # Apply thresholding if needed
-    metrics = {
-        'f1': f1_score(y_test, y_pred),
-        'precision': precision_score(y_test, y_pred),
-        'recall': recall_score(y_test, y_pred),
-    }
+    if not raw_input:  # Raw CSVs come without labels
+        # Evaluate the model
+        logger.info("Evaluating model...")
+        y_test = pd.read_pickle("data/processed/y_test.pkl")
+        y_pred = predictions > 0.5  # Apply thresholding if needed
+        metrics = {
+            'f1': f1_score(y_test, y_pred),
+            'precision': precision_score(y_test, y_pred),
+            'recall': recall_score(y_test, y_pred),
+        }
 
-    # Log metrics
-    for metric_name, value in metrics.items():
-        logger.info(f"{metric_name}: {value:.3f}")
-
-=======
-import pickle
-import numpy as np
-
-class Predictor:
-    def __init__(self, model_path):
-        with open(model_path, 'rb') as f:
-            self.model = pickle.load(f)
-
-    def predict(self, X):
-        return self.model.predict(X)
-
-    def save_results(self, predictions, file_path):
-        np.savetxt(file_path, predictions, delimiter=',', fmt='%d')
->>>>>>> d9649fbb6f5d050a9eb6d56ee63254a8667d7539
+        # Log metrics
+        for metric_name, value in metrics.items():
+            logger.info(f"{metric_name}: {value:.3f}")
@@ -8,12 +8,54 @@ from pathlib import Path
 import logging
 from sklearn.model_selection import StratifiedKFold
 import numpy as np
-from sklearn.preprocessing import TargetEncoder
 import os
+import pickle
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from utils.fold_store import FoldStore
+from utils.sessions import SessionIndex, ClickHistory
+from utils.ingest import read_raw_csv, parse_datetime, DEFAULT_MEMORY_BUDGET_MB
+from utils.columnar import write_columnar, clear_columnar, COLUMNAR_SUFFIX
+from utils.preprocess_cache import PreprocessCache, code_version, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE_MB
+from utils.profiling import StageProfiler
+from utils.target_encoding import FactorizedTargetEncoder
+from utils.schema import cast_feature, apply_feature_schema
+from utils.shards import ShardStore, DEFAULT_N_SHARDS
+from utils.out_of_core import OutOfCorePipeline
+from utils.executors import make_executor
+from utils.copy_on_write import copy_on_write, copy_on_write_method, owned_copy
+from utils.aggregates import (value_counts, group_value_counts, combine_counts, mode_of_counts, group_modes,
+                              first_rows, combine_first_rows)
 
 current_dir = Path(os.path.dirname(os.path.abspath(__file__)))
 parent_dir = str(current_dir.parent)
 
+# Fitted preprocessor state written by save_data and read by preprocess_test
+ARTIFACT_NAME = "preprocessor_artifact.pkl"
+ARTIFACT_VERSION = 3
+PROFILE_REPORT_NAME = "preprocess_profile.json"
+# Trailing windows of the per-user and per-campaign session counts
+DEFAULT_TIME_WINDOWS = ["1h", "24h", "7d"]
+# Columns encoded through the persisted category dictionaries, and the category of missing and unseen values
+CATEGORICAL_COLUMNS = ["product_category", "product", "gender", "campaign_id", "webpage_id", "user_group_id"]
+MISSING_CATEGORY = "missing"
+# Columns filled from product_category_2 groups that hold a single value
+SINGLE_VALUE_FILL_COLUMNS = ['DateTime', 'user_id', 'product', 'campaign_id', 'webpage_id', 'product_category_1',
+                             'user_group_id', 'gender', 'age_level', 'user_depth', 'city_development_index', 'var_1']
+# Columns filled along user_id -> user_group_id -> global mode by fill_missing_values
+HIERARCHICAL_FILL_COLUMNS = ["age_level", "city_development_index", "var_1", "user_depth"]
+# Label-free time parts filled with the mode of the user's sessions, and the columns of the per-user distinct counts
+LABEL_FREE_TIME_COLUMNS = ["Hour", "Minute", "weekday", "part_of_day"]
+LABEL_FREE_DISTINCT_COLUMNS = ['webpage_id', 'product_category', 'campaign_id', 'product']
+# Column crosses encoded with cross_ctr, and the number of distinct keys above which a cross is hashed
+DEFAULT_CTR_CROSSES = [("campaign_id", "webpage_id"), ("product", "user_group_id"), ("user_id", "product_category")]
+DEFAULT_MAX_CROSS_CATEGORIES = 2 ** 20
+CROSS_HASH_MULTIPLIER = 1_000_003
+CROSS_BUCKET_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# Source files whose changes invalidate the preprocessing cache
+PIPELINE_SOURCES = [Path(__file__)] + sorted((current_dir / "utils").glob("*.py"))
+
 
 class DataPreprocessor:
     def __init__(
@@ -26,6 +68,17 @@ class DataPreprocessor:
         catb: bool = True,
         use_missing_with_mode: bool = False,
         fill_cat: bool = False,
+        indexed_folds: bool = False,
+        n_jobs: int = 1,
+        columnar: bool = False,
+        per_fold_features: bool = False,
+        cache_dir: Path = None,
+        cache_max_size_mb: float = DEFAULT_MAX_SIZE_MB,
+        profile: bool = False,
+        time_windows: list = None,
+        ctr_crosses: list = None,
+        max_cross_categories: int = DEFAULT_MAX_CROSS_CATEGORIES,
+        copy_on_write: bool = False,
 
         callback=None
     ):
@@ -39,6 +92,17 @@ class DataPreprocessor:
         self.callback = callback or (lambda x: None)  # Default no-op callback if none provided
         self.output_path.mkdir(parents=True, exist_ok=True)
         self.fill_cat = fill_cat
+        self.indexed_folds = indexed_folds
+        self.n_jobs = n_jobs
+        self.columnar = columnar
+        self.per_fold_features = per_fold_features
+        self.cache_dir = cache_dir
+        self.cache_max_size_mb = cache_max_size_mb
+        self.profiler = StageProfiler(enabled=profile)
+        self.time_windows = list(DEFAULT_TIME_WINDOWS if time_windows is None else time_windows)
+        self.ctr_crosses = DEFAULT_CTR_CROSSES if ctr_crosses is None else ctr_crosses
+        self.max_cross_categories = max_cross_categories
+        self.copy_on_write = copy_on_write
         
 
         # Set up logging
@@ -54,11 +118,21 @@ class DataPreprocessor:
 
     """
 
-    def load_data(self, csv_path: Path, test_path: Path) -> pd.DataFrame:
+    def profiled(self, name: str, func, df: pd.DataFrame, *args, **kwargs):
+        """Run the pipeline stage `func(df, *args, **kwargs)` and record it with the profiler."""
+        with self.profiler.stage(name, df) as stage:
+            return stage.output(func(df, *args, **kwargs))
+
+    def load_data(self, csv_path: Path, test_path: Path, chunksize: int = None,
+                  memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB) -> pd.DataFrame:
+        """
+        Load the raw train and test CSVs with the compact dtypes of RAW_SCHEMA. The files are
+        parsed in chunks of `chunksize` rows, or of as many rows as fit in `memory_budget_mb`.
+        """
         if not csv_path.exists():
             raise FileNotFoundError(f"File not found: {csv_path}")
-        df = pd.read_csv(csv_path)
-        df_test = pd.read_csv(test_path)
+        df = read_raw_csv(csv_path, chunksize=chunksize, memory_budget_mb=memory_budget_mb)
+        df_test = read_raw_csv(test_path, chunksize=chunksize, memory_budget_mb=memory_budget_mb)
         
         self.logger.info(f"Loading file from: {csv_path}")
         return df, df_test
@@ -79,42 +153,27 @@ class DataPreprocessor:
     
     def drop_completely_empty(self, df: pd.DataFrame) -> pd.DataFrame:
         '''drop completely empty rows'''
-        df.dropna(how='all', inplace=True)
-        return df
+        return df.dropna(how='all')
     
     def drop_session_id_or_is_click(self, df: pd.DataFrame) -> pd.DataFrame:
         '''drop rows missing session_id or is_click'''
-        df.dropna(subset=["session_id","is_click"], inplace=True)
-        df.drop_duplicates(subset=["session_id"], inplace=True)
-        return df
+        return df.dropna(subset=["session_id","is_click"]).drop_duplicates(subset=["session_id"])
 
     def drop_session_id(self, df: pd.DataFrame) -> pd.DataFrame:
         '''drop rows missing session_id'''
-        df.dropna(subset=["session_id"], inplace=True)
-        df.drop_duplicates(subset=["session_id"], inplace=True)
-        return df
+        return df.dropna(subset=["session_id"]).drop_duplicates(subset=["session_id"])
 
     def decrease_test_user_group_id(self, df_test: pd.DataFrame) -> pd.DataFrame:
         '''decrease user_group_id by 1 to align with training data'''
+        df_test = owned_copy(df_test)
         df_test["user_group_id"] = df_test["user_group_id"] - 1
         return df_test
 
-    def replace_test_user_depth_to_training(self, df_train: pd.DataFrame, df_test: pd.DataFrame) -> pd.DataFrame:
+    def replace_test_user_depth_to_training(self, df_test: pd.DataFrame) -> pd.DataFrame:
         '''replace (or fill) user_depth values in X_test according to the first
-         valid user_depth observed per user in X_train.'''
-        depth_mapping = (
-        df_train
-        .dropna(subset=["user_depth"])           
-        .groupby("user_id")["user_depth"]        
-        .first()                                 
-        .to_dict()                               
-        )
-
-        df_test["user_depth"] = (
-        df_test["user_id"].map(depth_mapping)
-        .fillna(df_test["user_depth"])
-        )
-        return df_test
+         valid user_depth observed per user in X_train (the fitted "user_depth <- user_id" table).'''
+        self.depth_mapping = self.fill_mappings.get("user_depth <- user_id", pd.Series(dtype="float64"))
+        return self.lookup_fill(df_test, "user_depth", "user_id", self.depth_mapping, overwrite=True)
 
     def concat_train_test(self, df_train: pd.DataFrame, df_test: pd.DataFrame) -> pd.DataFrame:
         '''concat df_train with df_test, with is_click = -1 as an indicator'''
@@ -122,6 +181,47 @@ class DataPreprocessor:
         df = pd.concat([df_train, df_test], ignore_index=True)
         return df
     
+    def fill_table(self, source_df: pd.DataFrame, target_col, key_col) -> pd.Series:
+        """
+        Lookup table from `key_col` (a column or a list of columns) to the first
+        non-null `target_col` value observed for that key in `source_df`, indexed by key.
+        """
+        return (
+            source_df.dropna(subset=[target_col])
+            .groupby(key_col, observed=True)[target_col]
+            .first()  # Assumes there's only one unique value per key
+        )
+
+    def fill_mapping(self, source_df: pd.DataFrame, target_col, key_col) -> dict:
+        """
+        Dictionary from `key_col` (a column or a list of columns) to the first
+        non-null `target_col` value observed for that key in `source_df`.
+        """
+        return self.fill_table(source_df, target_col, key_col).to_dict()
+
+    def lookup_fill(self, df: pd.DataFrame, target_col, key_col, table: pd.Series, overwrite: bool = False) -> pd.DataFrame:
+        """
+        Fill missing `target_col` values from a fitted lookup `table` indexed by `key_col`
+        (a column or a list of columns), with one Index.get_indexer call over the keys of `df`.
+        With `overwrite`, every row whose key is in the table takes the table value.
+        """
+        if table.empty or target_col not in df.columns:
+            return df
+
+        key_cols = key_col if isinstance(key_col, list) else [key_col]
+        if len(key_cols) == 1:
+            keys = df[key_cols[0]].to_numpy()
+        else:
+            keys = pd.MultiIndex.from_arrays([df[col].to_numpy() for col in key_cols])
+        codes = table.index.get_indexer(keys)
+
+        looked_up = pd.Series(table.to_numpy()[np.maximum(codes, 0)], index=df.index).where(codes >= 0)
+        if overwrite:
+            df[target_col] = looked_up.fillna(df[target_col])
+        else:
+            df[target_col] = df[target_col].fillna(looked_up)
+        return df
+
     # Function to infer missing values based on user_id
     def infer_by_col(self, df: pd.DataFrame, target_col, key_col='user_id', mapping_df=None)-> pd.DataFrame:
         """
@@ -142,12 +242,7 @@ class DataPreprocessor:
             source_df = df
 
         # Create a dictionary mapping key_col to target_col, ignoring NaNs
-        mapping_dict = (
-            source_df.dropna(subset=[target_col])
-            .groupby(key_col)[target_col]
-            .first()  # Assumes there's only one unique value per key_col
-            .to_dict()
-        )
+        mapping_dict = self.fill_mapping(source_df, target_col, key_col)
         
         # Map the key_col to target_col
         mapped_values = df[key_col].map(mapping_dict)
@@ -178,12 +273,7 @@ class DataPreprocessor:
             source_df = df
         
         # Create a dictionary mapping group_cols to target_col, ignoring NaNs
-        mapping_dict = (
-            source_df.dropna(subset=[target_col])
-                    .groupby(key_cols)[target_col]
-                    .first()  # Assumes there's only one unique value per group
-                    .to_dict()
-        )
+        mapping_dict = self.fill_mapping(source_df, target_col, key_cols)
         
         # Create a MultiIndex based on group_cols and map to target_col
         mapped_values = df.set_index(key_cols).index.map(mapping_dict)
@@ -196,102 +286,246 @@ class DataPreprocessor:
         
         return df
     
+    def single_value_mapping(self, df: pd.DataFrame, group_col) -> pd.DataFrame:
+        """
+        For every fillable column, the single unique non-null value of each `group_col`
+        group (NaN for groups with zero or several unique values). Indexed by group.
+
+        All fillable columns are resolved from one groupby: the per-group non-null
+        unique counts and first non-null values are aggregated together.
+        """
+        fillable_cols = [col for col in SINGLE_VALUE_FILL_COLUMNS if col in df.columns and col != group_col]
+
+        # One grouped pass: number of unique non-null values and the first non-null value per group
+        grouped = df.groupby(group_col)[fillable_cols]
+        n_unique = grouped.nunique()
+        first_value = grouped.first()
+
+        # Keep the value only for groups that have exactly one unique non-null value
+        return first_value.where(n_unique == 1)
+
+    def single_value_partial(self, df: pd.DataFrame, group_col) -> dict:
+        """
+        single_value_mapping statistics of a part of a dataset: per fillable column, the first row
+        of every (group, value) pair. Merged with combine_single_value_partials.
+        """
+        fillable_cols = [col for col in SINGLE_VALUE_FILL_COLUMNS if col in df.columns and col != group_col]
+        return {col: df[[group_col, col]].dropna().drop_duplicates() for col in fillable_cols}
+
+    def combine_single_value_partials(self, partials: list, group_col) -> pd.DataFrame:
+        """single_value_mapping of a dataset from the single_value_partial of its parts."""
+        table = {}
+        for col in partials[0]:
+            pairs = pd.concat([part[col] for part in partials]).sort_index(kind="stable").drop_duplicates()
+            n_unique = pairs.groupby(group_col).size()
+            first_value = pairs.drop_duplicates(subset=[group_col]).set_index(group_col)[col]
+            table[col] = first_value.where(n_unique.reindex(first_value.index) == 1)
+        return pd.DataFrame(table)
+
     def fillna_when_single_unique_value(self, df: pd.DataFrame, group_col)-> pd.DataFrame:
         """
         For each group (based on group_col) and for each column:
         - if that column has exactly one unique non-null value within the group,
             fill any NaNs in that column with the single unique value.
+
+        The NaNs are filled with a vectorized map on `group_col` from `single_value_mapping`.
         """
-        df = df.copy()  # avoid mutating original
-        
-        fillable_cols = ['DateTime', 'user_id', 'product', 'campaign_id',
-       'webpage_id', 'product_category_1', 'user_group_id', 'gender', 'age_level', 'user_depth',
-       'city_development_index', 'var_1']
-        
-        for col in fillable_cols:
-            # For each group, collect the array of unique non-null values
-            group_unique = (
-                df.groupby(group_col)[col]
-                .apply(lambda x: x.dropna().unique())
-            )
-            # Convert that array into a single value if length == 1, else np.nan
-            single_val_map = group_unique.apply(
-                lambda arr: arr[0] if len(arr) == 1 else np.nan
-            ).to_dict()
-
-            # Now fill the missing values for groups that have a single unique value
-            def _fill_func(row):
-                if pd.isnull(row[col]):
-                    # Look up the single possible value for this group
-                    possible_val = single_val_map.get(row[group_col], np.nan)
-                    if not pd.isnull(possible_val):
-                        return possible_val
-                return row[col]
-            
-            df[col] = df.apply(_fill_func, axis=1)
+        df = owned_copy(df)  # avoid mutating original
+        if df.empty:
+            return df
+
+        single_val_map = self.single_value_mapping(df, group_col)
+
+        for col in single_val_map.columns:
+            if df[col].isna().any():
+                df[col] = df[col].fillna(df[group_col].map(single_val_map[col]))
 
         return df
 
-    def deterministic_fill(self, df: pd.DataFrame) -> pd.DataFrame:
+    def lookup_fill_single_values(self, df: pd.DataFrame, group_col, table: pd.DataFrame) -> pd.DataFrame:
+        """Fill the NaNs of every column of a fitted `single_value_mapping` table from `group_col`."""
+        for col in table.columns:
+            if col in df.columns and df[col].isna().any():
+                df = self.lookup_fill(df, col, group_col, table[col])
+        return df
+
+    def deterministic_fill_rules(self) -> list:
+        """
+        Dependency graph of the deterministic fill rules, in the order they are applied.
+
+        Each rule is a dict with:
+            name (str): "target <- key" label used in the fill report.
+            requires (list): Columns that must exist for the rule to be active.
+            inputs (list): Every column the rule reads (target, key and filter columns).
+            targets (list): Columns the rule can fill.
+            apply (callable): Takes and returns the DataFrame, filling from a mapping built on it.
+            mapping (callable): Takes the DataFrame and returns the lookup table the rule fills from.
+            partial (callable): Takes a part of the DataFrame and returns the statistics of the
+                lookup table on that part.
+            combine (callable): Takes the partial statistics of every part and returns the lookup
+                table of the whole DataFrame (the same table as mapping).
+            lookup (callable): Takes the DataFrame and a fitted lookup table, returns the DataFrame
+                filled from that table.
+        """
+        def infer_rule(target, key, source=None, condition=None):
+            """Rule filling `target` from `key`, with the mapping built from the `source` rows only."""
+            key_cols = key if isinstance(key, list) else [key]
+
+            def mapping(df):
+                if condition is not None and not condition(df):
+                    return pd.Series(dtype="float64")
+                return self.fill_table(df if source is None else df[source(df)], target, key)
+
+            def apply(df):
+                if condition is not None and not condition(df):
+                    return df
+                mapping_df = None if source is None else df[source(df)]
+                if isinstance(key, list):
+                    return self.infer_by_two_cols(df, target_col=target, key_cols=key, mapping_df=mapping_df)
+                return self.infer_by_col(df, target, key_col=key, mapping_df=mapping_df)
+
+            return {
+                "name": f"{target} <- {key if isinstance(key, str) else '(' + ', '.join(key) + ')'}",
+                "requires": [target] + key_cols,
+                "inputs": [target] + key_cols,
+                "targets": [target],
+                "apply": apply,
+                "mapping": mapping,
+                "lookup": lambda df, table: self.lookup_fill(df, target, key, table),
+                "partial": lambda df: first_rows(df if source is None else df[source(df)], key_cols, target),
+                "combine": lambda partials: combine_first_rows(partials, key_cols, target),
+            }
+
+        rules = []
+
+        # Handle user columns
+        user_cols = ['user_group_id', 'gender', 'age_level', 'city_development_index', 'user_depth']
+        for col in user_cols:
+            rules.append(infer_rule(col, "user_id"))
+
+        # Handle product category
+        rules.append(infer_rule("product_category_1", "campaign_id",
+                                source=lambda df: df.campaign_id == 396664,
+                                condition=lambda df: 396664 in df.campaign_id.unique()))
+
+        # Handle webpage and campaign IDs
+        rules.append(infer_rule("webpage_id", "campaign_id"))
+        rules.append(infer_rule("campaign_id", "webpage_id", source=lambda df: df.webpage_id != 13787))
+
+        # Handle product category by webpage
+        rules.append(infer_rule("product_category_1", "webpage_id",
+                                source=lambda df: df.webpage_id == 51181,
+                                condition=lambda df: 51181 in df.webpage_id.unique()))
+
+        # Handle gender and age by user group
+        rules.append(infer_rule("gender", "user_group_id", source=lambda df: df.user_group_id != 0))
+        rules.append(infer_rule("age_level", "user_group_id"))
+        rules.append(infer_rule("user_group_id", "age_level",
+                                source=lambda df: df.age_level == 0,
+                                condition=lambda df: 0 in df.age_level.unique()))
+
+        # Handle user group by age and gender
+        rules.append(infer_rule("user_group_id", ["age_level", "gender"]))
+
+        # Handle product category 2
+        rules.append({
+            "name": "* <- product_category_2",
+            "requires": ["product_category_2"],
+            "inputs": ["product_category_2"] + SINGLE_VALUE_FILL_COLUMNS,
+            "targets": SINGLE_VALUE_FILL_COLUMNS,
+            "apply": lambda df: self.fillna_when_single_unique_value(df, group_col="product_category_2"),
+            "mapping": lambda df: self.single_value_mapping(df, group_col="product_category_2"),
+            "lookup": lambda df, table: self.lookup_fill_single_values(df, "product_category_2", table),
+            "partial": lambda df: self.single_value_partial(df, group_col="product_category_2"),
+            "combine": lambda partials: self.combine_single_value_partials(partials, group_col="product_category_2"),
+        })
+
+        return rules
+
+    def deterministic_fill_mappings(self, df: pd.DataFrame) -> dict:
+        """
+        Lookup tables of every active deterministic fill rule, built from `df`
+        (normally the training data after `deterministic_fill`), keyed by rule name.
+        """
+        return {
+            rule["name"]: rule["mapping"](df)
+            for rule in self.deterministic_fill_rules()
+            if all(col in df.columns for col in rule["requires"])
+        }
+
+    def deterministic_fill(self, df: pd.DataFrame, max_iterations: int = 10, mappings: dict = None) -> pd.DataFrame:
+        """
+        Apply the deterministic fill rules until no rule can fill anything more.
+
+        Rules are visited in declaration order, but a rule only reruns when one of its
+        input columns gained values since its last run (every rule is idempotent on its
+        own output). Changes are tracked with per-column null counts, and the number of
+        values filled by each rule is stored in `self.fill_report`.
+
+        Without `mappings` every rule builds its mapping from `df` itself (fitting on the
+        training data). With the fitted tables of `deterministic_fill_mappings`, every rule
+        first fills from its table with one vectorized lookup (test data, online requests), then
+        from the mapping built on `df` for the keys missing from the table.
+        """
+        rules = [rule for rule in self.deterministic_fill_rules()
+                 if all(col in df.columns for col in rule["requires"])
+                 and (mappings is None or rule["name"] in mappings)]
+        if mappings is None:
+            fills = {rule["name"]: rule["apply"] for rule in rules}
+        else:
+            # Training tables first; keys they do not cover (e.g. users only seen in df) are then
+            # filled by the rule fitted on df itself
+            fills = {rule["name"]: (lambda df, rule=rule: rule["apply"](rule["lookup"](df, mappings[rule["name"]])))
+                     for rule in rules}
+
+        def fill_rule(rule):
+            nonlocal df
+            df = fills[rule["name"]](df)
+            return {col: int(df[col].isna().sum()) for col in rule["targets"] if col in df.columns}
+
+        self.run_fill_rules(rules, fill_rule, df.isna().sum().to_dict(), max_iterations)
+        return df
+
+    def run_fill_rules(self, rules: list, fill_rule, null_counts: dict, max_iterations: int = 10):
+        """
+        The fixpoint loop of deterministic_fill over `rules`, for data held in any form.
+
+        Parameters:
+            fill_rule (callable): Applies one rule to the data and returns the number of missing
+                values left in each of the rule's target columns.
+            null_counts (dict): Number of missing values of every column before the fill.
+        """
+        null_counts = dict(null_counts)
+        versions = {col: 0 for col in null_counts}  # bumped every time a column gains values
+        last_run = {}  # rule name -> versions of its inputs after its last run
+        self.fill_report = {rule["name"]: 0 for rule in rules}
+
         changed = True
-        max_iterations = 10
         iteration = 0
 
         while changed and iteration < max_iterations:
-            old_df = df.copy()
-            user_cols = ['user_group_id', 'gender', 'age_level', 'city_development_index', 'user_depth']
-
-            # Handle user columns
-            for col in user_cols:
-                if col in df.columns:  # Only process if column exists
-                    df = self.infer_by_col(df, col, key_col='user_id')
-
-            # Handle product category
-            if 'product_category_1' in df.columns and 'campaign_id' in df.columns:
-                if 396664 in df.campaign_id.unique():
-                    df = self.infer_by_col(df, "product_category_1", key_col='campaign_id',
-                                        mapping_df=df[df.campaign_id == 396664])
-
-            # Handle webpage and campaign IDs
-            if 'webpage_id' in df.columns and 'campaign_id' in df.columns:
-                df = self.infer_by_col(df, "webpage_id", key_col='campaign_id')
-                df = self.infer_by_col(df, "campaign_id", key_col='webpage_id',
-                                       mapping_df=df[df.webpage_id != 13787])
-
-            # Handle product category by webpage
-            if 'product_category_1' in df.columns and 'webpage_id' in df.columns:
-                # MAke sure df.webpage_id == 51181 in the dataset
-                if 51181 in df.webpage_id.unique():
-                    df = self.infer_by_col(df, "product_category_1", key_col='webpage_id',
-                                        mapping_df=df[df.webpage_id == 51181])
-
-            # Handle gender and age by user group
-            if 'gender' in df.columns and 'user_group_id' in df.columns:
-                df = self.infer_by_col(df, "gender", key_col='user_group_id',
-                                       mapping_df=df[df.user_group_id != 0])
-
-            if 'age_level' in df.columns and 'user_group_id' in df.columns:
-                df = self.infer_by_col(df, "age_level", key_col='user_group_id')
-
-            if 'user_group_id' in df.columns and 'age_level' in df.columns:
-                if 0 in df.age_level.unique():
-                    df = self.infer_by_col(df, "user_group_id", key_col='age_level',
-                                        mapping_df=df[df.age_level == 0])
-
-            # Handle user group by age and gender
-            if all(col in df.columns for col in ["user_group_id", "age_level", "gender"]):
-                df = self.infer_by_two_cols(df, target_col="user_group_id",
-                                            key_cols=["age_level", "gender"])
-
-            # Handle product category 2
-            if "product_category_2" in df.columns:
-                df = self.fillna_when_single_unique_value(df, group_col="product_category_2")
-
-            changed = not df.equals(old_df)
+            changed = False
+            for rule in rules:
+                input_versions = tuple(versions.get(col) for col in rule["inputs"])
+                if last_run.get(rule["name"]) == input_versions:
+                    continue
+
+                for col, n_missing in fill_rule(rule).items():
+                    filled = null_counts[col] - n_missing
+                    if filled > 0:
+                        null_counts[col] = n_missing
+                        versions[col] += 1
+                        self.fill_report[rule["name"]] += filled
+                        changed = True
+
+                last_run[rule["name"]] = tuple(versions.get(col) for col in rule["inputs"])
             iteration += 1
 
-        return df
-    
+        self.logger.info(f"Deterministic fill finished after {iteration} iterations, "
+                         f"filled {sum(self.fill_report.values())} values")
+        for name, filled in self.fill_report.items():
+            self.logger.info(f"  {name}: {filled}")
+
     def split_to_train_test(self, df: pd.DataFrame) -> pd.DataFrame:
         train_df = df[df.is_click !=-1]
         test_df = df[df.is_click ==-1]
@@ -299,15 +533,55 @@ class DataPreprocessor:
 
 
 
+    def _group_mode_codes(self, group_codes, n_groups, value_codes, n_values):
+        """
+        Mode of `value_codes` within each group of `group_codes` (both factorized, -1 = missing).
+        Ties are broken by the smallest value code. Returns one code per group, -1 for groups
+        without any non-null value.
+        """
+        if n_groups == 0 or n_values == 0:
+            return np.full(n_groups, -1, dtype=np.int64)
+
+        valid = (group_codes >= 0) & (value_codes >= 0)
+        pairs = group_codes[valid].astype(np.int64) * n_values + value_codes[valid]
+
+        if n_groups * n_values <= max(4 * len(group_codes), 1 << 20):
+            # Dense (group, value) count table; argmax returns the smallest code among ties
+            counts = np.bincount(pairs, minlength=n_groups * n_values).reshape(n_groups, n_values)
+            mode_codes = counts.argmax(axis=1)
+            mode_codes[counts.max(axis=1) == 0] = -1
+            return mode_codes
+
+        # Sparse count table for high-cardinality (group, value) combinations
+        uniq_pairs, counts = np.unique(pairs, return_counts=True)
+        groups, values = np.divmod(uniq_pairs, n_values)
+        order = np.lexsort((values, -counts, groups))
+        groups, values = groups[order], values[order]
+        first_in_group = np.r_[True, groups[1:] != groups[:-1]]
+        mode_codes = np.full(n_groups, -1, dtype=np.int64)
+        mode_codes[groups[first_in_group]] = values[first_in_group]
+        return mode_codes
+
     def mode_target(self, df, columns, group_by_col="user_id"):
-        df_temp = df.copy()
-        result = pd.DataFrame(index=df_temp.index)
-        
+        """
+        Mode of each column in `columns` within its `group_by_col` group, broadcast back to
+        every row (ties broken by the smallest value, like Series.mode). Rows with a missing
+        group key, or whose group has no non-null value, get NaN.
+
+        The group key is factorized once for all columns; each column is then reduced with a
+        (group, value) count table and an argmax per group.
+        """
+        result = pd.DataFrame(index=df.index)
+
+        group_codes, group_uniques = pd.factorize(df[group_by_col])
+
         for column in columns:
-            mode = df_temp.groupby(group_by_col, observed=True)[column].transform(lambda x: x.mode().iloc[0] if not x.mode().empty else np.nan)
-            result[column] = mode
-        
-        result = result.sample(frac=1)  # Shuffle rows
+            value_codes, value_uniques = pd.factorize(df[column], sort=True)
+            mode_codes = self._group_mode_codes(group_codes, len(group_uniques), value_codes, len(value_uniques))
+            # The trailing -1 is picked up by rows whose group key is missing (code -1)
+            row_codes = np.append(mode_codes, -1)[group_codes]
+            result[column] = pd.Series(value_uniques).reindex(row_codes).to_numpy()
+
         return result
     
     def fill_with_mode(self,df, columns): 
@@ -325,27 +599,56 @@ class DataPreprocessor:
                 df[column] = df[column].fillna(median_value)
         return df
 
+    def category_labels(self, values: pd.Series) -> tuple:
+        """
+        Codes of `values` (-1 for missing) and the category label of every code: the value as
+        a string without a trailing ".0". Only the unique values are converted to strings.
+        """
+        codes, uniques = pd.factorize(values.to_numpy())
+        labels = pd.Index(uniques).astype(str).str.replace(r'\.0$', '', regex=True)
+        return codes, labels
+
+    def build_category_dictionaries(self, df: pd.DataFrame) -> dict:
+        """
+        One category dictionary per categorical column of `df`: its sorted labels followed by
+        MISSING_CATEGORY, which also stands for values unseen when the dictionary was built.
+        """
+        return self.combine_category_labels([self.category_label_sets(df)])
+
+    def category_label_sets(self, df: pd.DataFrame) -> dict:
+        """Unique category labels of every categorical column of `df`, see combine_category_labels."""
+        return {col: self.category_labels(df[col])[1].unique() for col in CATEGORICAL_COLUMNS if col in df.columns}
+
+    def combine_category_labels(self, label_sets: list) -> dict:
+        """Category dictionaries of a dataset from the category_label_sets of its parts."""
+        dictionaries = {}
+        for col in label_sets[0] if label_sets else []:
+            labels = label_sets[0][col].append([part[col] for part in label_sets[1:]])
+            labels = labels[labels != MISSING_CATEGORY].unique().sort_values()
+            dictionaries[col] = labels.append(pd.Index([MISSING_CATEGORY]))
+        return dictionaries
+
+    def encode_categories(self, values: pd.Series, dictionary: pd.Index) -> pd.Categorical:
+        """Categorical of `values` over `dictionary`, with missing and unseen values as MISSING_CATEGORY."""
+        codes, labels = self.category_labels(values)
+        missing_code = dictionary.get_loc(MISSING_CATEGORY)
+        label_codes = dictionary.get_indexer(labels).astype(np.int32)
+        label_codes[label_codes < 0] = missing_code
+        row_codes = np.where(codes >= 0, label_codes[codes], missing_code).astype(np.int32)
+        return pd.Categorical.from_codes(row_codes, categories=dictionary)
+
     def determine_categorical_features(self, df: pd.DataFrame, cat_features: list = None):
         """
         Identify and process categorical features, ensuring compatibility with CatBoost.
+
+        The categorical columns are encoded in place through the category_dictionaries fitted by
+        `preprocess` (or restored from the artifact), so folds, test data and serving all share one
+        category order. Without fitted dictionaries they are built from `df` itself.
         """
-        cat_cols = ["product_category", "product", "gender", "campaign_id", "webpage_id", "user_group_id"]
-        for col in cat_cols:
-            if col in df.columns:
-                if col in ["campaign_id", "webpage_id", "user_group_id", "product_category"]:
-                    # Convert to string first and remove .0
-                    temp_values = df[col].astype(str).str.replace(r'\.0$', '', regex=True)
-                    # Then convert to category with the processed values
-                    df[col] = pd.Categorical(temp_values)
-                    # Add missing category
-                    if "missing" not in df[col].cat.categories:
-                        df[col] = df[col].cat.add_categories("missing")
-                    df[col] = df[col].fillna("missing")
-                else:
-                    df[col] = df[col].astype("category")
-                    if "missing" not in df[col].cat.categories:
-                        df[col] = df[col].cat.add_categories("missing")
-                    df[col] = df[col].fillna("missing")
+        dictionaries = getattr(self, "category_dictionaries", None) or self.build_category_dictionaries(df)
+        for col in CATEGORICAL_COLUMNS:
+            if col in df.columns and col in dictionaries:
+                df[col] = self.encode_categories(df[col], dictionaries[col])
 
         if cat_features:
             cat_features = [col for col in cat_features if col in df.columns]
@@ -369,7 +672,24 @@ class DataPreprocessor:
         Fill missing values using mode, median, or forward/backward fill.
         Includes subfunctions for modularity.
         """
-        df = df.copy()
+        df = self.prepare_missing_values(df)
+
+        cols_for_ffill_bfill = self.hierarchical_fill_columns(df)
+
+        if cols_for_ffill_bfill:
+            self.logger.info(f"Filling missing values with user_id -> user_group_id -> global mode for columns: {cols_for_ffill_bfill}")
+            self.logger.info(f'Number of missing values before: {df[cols_for_ffill_bfill].isna().sum()}')
+            df = self.hierarchical_mode_fill(df, cols_for_ffill_bfill, ["user_id", "user_group_id"])
+            self.logger.info(f'Number of missing values after: {df[cols_for_ffill_bfill].isna().sum()}')
+
+        return df
+
+    def prepare_missing_values(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        The steps of fill_missing_values that only need each user's own rows: the user_id
+        placeholder, the merged product category and the per-user mode of fill_cat.
+        """
+        df = owned_copy(df)
         self.logger.info(f"NAs in the dataset: {df.isna().sum().sum()}")
 
         # Handle user_id
@@ -393,31 +713,49 @@ class DataPreprocessor:
             cat_cols_to_fill = ["product", "campaign_id", "webpage_id", "gender", "product_category", "user_group_id"]
             cat_cols_to_fill = [col for col in cat_cols_to_fill if col in df.columns]
             if cat_cols_to_fill:
-                df = self.mode_target(df, cat_cols_to_fill, "user_id")
+                df[cat_cols_to_fill] = self.mode_target(df, cat_cols_to_fill, "user_id")
 
-        cols_for_ffill_bfill = ["age_level", "city_development_index", "var_1", "user_depth"]
-        cols_for_ffill_bfill = [col for col in cols_for_ffill_bfill if col in df.columns]
+        return df
 
-        if cols_for_ffill_bfill:
-            self.logger.info(f"Filling missing values with user_id for columns: {cols_for_ffill_bfill}")
-            self.logger.info(f'Number of missing values before: {df[cols_for_ffill_bfill].isna().sum()}')
-            df[cols_for_ffill_bfill] = self.mode_target(df, cols_for_ffill_bfill, "user_id")
-            self.logger.info(f'Number of missing values after: {df[cols_for_ffill_bfill].isna().sum()}')
+    def hierarchical_fill_columns(self, df: pd.DataFrame) -> list:
+        """Columns of `df` filled by hierarchical_mode_fill in fill_missing_values."""
+        return [col for col in HIERARCHICAL_FILL_COLUMNS if col in df.columns]
+
+    def hierarchical_mode_fill(self, df: pd.DataFrame, columns: list, fallback_keys: list) -> pd.DataFrame:
+        """
+        Mode imputation along a fallback chain of group keys, ending with the global mode.
+
+        Like mode_target, every row first takes the mode of its group for the first key. Rows
+        still missing then take the mode of their group for the next key, computed over the values
+        of the previous level, and finally the global mode. Ties go to the smallest value, like
+        Series.mode.
+
+        The keys are factorized once for all columns and every column once for all levels; each
+        level is a (group, value) count table over the codes, and only the rows still missing
+        are looked up at the later levels.
+        """
+        keys = [pd.factorize(df[key]) for key in fallback_keys]
+
+        for column in columns:
+            value_codes, value_uniques = pd.factorize(df[column], sort=True)
+            n_values = len(value_uniques)
+
+            # The trailing -1 is picked up by rows whose group key is missing (code -1)
+            group_codes, group_uniques = keys[0]
+            row_codes = np.append(self._group_mode_codes(group_codes, len(group_uniques), value_codes, n_values), -1)[group_codes]
 
-            if df[cols_for_ffill_bfill].isna().sum().sum() > 0:
-                self.logger.warning(f'Still missing values in columns: {cols_for_ffill_bfill}')
-                self.logger.info(f"Filling missing values with user_group_id for columns: {cols_for_ffill_bfill}")
-                for col in cols_for_ffill_bfill:
-                    mask = df[col].isna()  # Identify rows where the value is still missing
-                    if mask.sum() > 0:
-                        df.loc[mask, col] = self.mode_target(df, [col], "user_group_id").loc[mask, col]
-                self.logger.info(f'Number of missing values after: {df[cols_for_ffill_bfill].isna().sum()}')
-
-                if df[cols_for_ffill_bfill].isna().sum().sum() > 0:
-                    self.logger.warning(f'Still missing values in columns: {cols_for_ffill_bfill}')
-                    self.logger.info(f"Filling missing values with mode for columns: {cols_for_ffill_bfill}")
-                    df = self.fill_with_mode(df, cols_for_ffill_bfill)
-                    self.logger.info(f'Number of missing values after: {df[cols_for_ffill_bfill].isna().sum()}')
+            for group_codes, group_uniques in keys[1:]:
+                missing = np.flatnonzero(row_codes < 0)
+                if len(missing) == 0:
+                    break
+                mode_codes = self._group_mode_codes(group_codes, len(group_uniques), row_codes, n_values)
+                row_codes[missing] = np.append(mode_codes, -1)[group_codes[missing]]
+
+            missing = row_codes < 0
+            if missing.any() and not missing.all():
+                row_codes[missing] = np.bincount(row_codes[~missing], minlength=n_values).argmax()
+
+            df[column] = pd.Series(value_uniques).reindex(row_codes).to_numpy()
 
         return df
 
@@ -430,195 +768,509 @@ class DataPreprocessor:
 
     """
 
+    def cv_fold_ids(self, y: pd.Series, cv=5, random_state=100) -> np.ndarray:
+        """
+        Stratified cross-fitting fold of every row. The folds only depend on is_click, so the CTR
+        smoothing and the target encoder of every column share the same fold assignment.
+        """
+        fold_ids = np.empty(len(y), dtype=np.int64)
+        skf = StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state)
+        for fold, (_, val_idx) in enumerate(skf.split(np.zeros(len(y)), y)):
+            fold_ids[val_idx] = fold
+        return fold_ids
+
+    def ctr_fold_statistics(self, df, col, fold_ids, n_folds, clicks, has_session):
+        """
+        Sufficient statistics of `col` for smoothed CTR, per (fold, category).
+
+        `col` is factorized once and every statistic is a single np.bincount over
+        fold_id * n_categories + code, so the cost is linear in the number of rows.
+
+        Returns:
+            uniques (pd.Index): The sorted categories of `col`.
+            codes (np.ndarray): Category code of each row (-1 for missing).
+            rows, clicks, views (np.ndarray): (n_folds, n_categories) tables with the
+                number of rows, the sum of is_click and the number of sessions.
+        """
+        codes, uniques = pd.factorize(df[col], sort=True)
+        return (uniques, codes) + self.code_fold_statistics(codes, len(uniques), fold_ids, n_folds, clicks, has_session)
+
+    def code_fold_statistics(self, codes, n_categories, fold_ids, n_folds, clicks, has_session):
+        """(n_folds, n_categories) tables of rows, clicks and views of integer `codes` (-1 for missing)."""
+        valid = codes >= 0
+        keys = fold_ids[valid] * n_categories + codes[valid]
+        size = n_folds * n_categories
+        fold_rows = np.bincount(keys, minlength=size).reshape(n_folds, n_categories)
+        fold_clicks = np.bincount(keys, weights=clicks[valid], minlength=size).reshape(n_folds, n_categories)
+        fold_views = np.bincount(keys[has_session[valid]], minlength=size).reshape(n_folds, n_categories)
+        return fold_rows, fold_clicks, fold_views
+
+    def smoothed_ctrs(self, codes, fold_ids, fold_rows, fold_clicks, fold_views, alpha, global_ctr):
+        """
+        Out-of-fold smoothed CTR of every row and the smoothed CTR of every category on all rows,
+        from the fold statistics of code_fold_statistics.
+        """
+        total_clicks = fold_clicks.sum(axis=0)
+        total_views = fold_views.sum(axis=0)
+
+        # Out-of-fold statistics are the totals minus the row's own fold.
+        # Categories unseen outside the fold fall back to the global CTR.
+        oof_table = (total_clicks - fold_clicks + alpha * global_ctr) / (total_views - fold_views + alpha)
+        oof_table = np.where(fold_rows.sum(axis=0) - fold_rows > 0, oof_table, global_ctr)
+
+        valid = codes >= 0
+        oof_ctr = np.full(len(codes), global_ctr, dtype=np.float64)
+        oof_ctr[valid] = oof_table[fold_ids[valid], codes[valid]]
+
+        mapping_all = (total_clicks + alpha * global_ctr) / (total_views + alpha)
+        return oof_ctr, mapping_all
+
     def smooth_ctr(self, df, cols_to_encode, subset="train", alpha=10, cv=5, random_state=100):
-        
-        df = df.copy()
-        
+
+        df = owned_copy(df)
+
         if subset == "train":
             # Initialize dictionaries to store mappings and global CTRs for later use on test data.
             self.ctr_maps = {}
             self.global_ctrs = {}
-            
+
+            # Compute the global CTR from the full training data
+            global_ctr = df['is_click'].mean()
+            clicks = df['is_click'].fillna(0).to_numpy(dtype=np.float64)
+            has_session = df['session_id'].notna().to_numpy()
+
+            fold_ids = self.cv_fold_ids(df['is_click'], cv=cv, random_state=random_state)
+
             for col in cols_to_encode:
-                # Compute the global CTR from the full training data
-                global_ctr = df['is_click'].mean()
                 self.global_ctrs[col] = global_ctr
 
-                # Create an empty series to hold the out-of-fold CTR values.
-                oof_ctr = pd.Series(np.nan, index=df.index)
-                
-                # Set up the cross-validation splitter
-                skf = StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state)
-                
-                # Loop through each fold for out-of-fold predictions.
-                for train_idx, val_idx in skf.split(df, df['is_click']):
-                    train_fold = df.iloc[train_idx]
-                    val_fold = df.iloc[val_idx]
-                    
-                    # Compute clicks and views on the training fold for this column.
-                    clicks = train_fold.groupby(col)['is_click'].sum()
-                    views = train_fold.groupby(col)['session_id'].count()
-                    
-                    # Compute the smoothed CTR mapping on the training fold.
-                    mapping = ((clicks + alpha * global_ctr) / (views + alpha)).rename(f'{col}_ctrS')
-                    
-                    # Map the computed CTR values to the validation fold.
-                    oof_ctr.iloc[val_idx] = val_fold[col].map(mapping)
-                
-                # Fill any missing values (e.g., unseen categories in the CV splits) with the global CTR.
-                oof_ctr.fillna(global_ctr, inplace=True)
-                df[f'{col}_ctrS'] = oof_ctr
-                
-                # Now, compute the mapping using the entire training data for test transformation.
-                clicks_all = df.groupby(col)['is_click'].sum()
-                views_all = df.groupby(col)['session_id'].count()
-                mapping_all = ((clicks_all + alpha * global_ctr) / (views_all + alpha)).rename(f'{col}_ctrS')
-                self.ctr_maps[col] = mapping_all.to_dict()
-            
+                uniques, codes, fold_rows, fold_clicks, fold_views = self.ctr_fold_statistics(
+                    df, col, fold_ids, cv, clicks, has_session)
+                oof_ctr, mapping_all = self.smoothed_ctrs(
+                    codes, fold_ids, fold_rows, fold_clicks, fold_views, alpha, global_ctr)
+                self.add_feature(df, f'{col}_ctrS', oof_ctr)
+
+                # The mapping of the entire training data is used for the test transformation.
+                self.ctr_maps[col] = pd.Series(mapping_all, index=uniques).to_dict()
+
             return df
         
         elif subset == "test":
             # For the test data, use the mapping computed from the training set.
             for col in cols_to_encode:
                 global_ctr = self.global_ctrs.get(col, df['is_click'].mean())
-                df[f'{col}_ctrS'] = df[col].map(self.ctr_maps.get(col, {})).fillna(global_ctr)
+                # astype: mapping a categorical column returns a categorical of the CTRs
+                self.add_feature(df, f'{col}_ctrS', df[col].map(self.ctr_maps.get(col, {})).astype("float64").fillna(global_ctr))
             return df
         
         else:
             raise ValueError("subset must be either 'train' or 'test'")
 
-    
-    
+    def resolve_ctr_crosses(self, columns: list) -> list:
+        """The ctr_crosses option as a list of column tuples: "all" means every pair of `columns`."""
+        if self.ctr_crosses == "all":
+            return list(itertools.combinations(columns, 2))
+        return [tuple(cross) for cross in self.ctr_crosses if all(col in columns for col in cross)]
 
-    def add_target_encoding(self, df, cols_to_target_encode, subset="train"):
-        df = df.copy()
+    def cross_keys(self, df, categories):
+        """
+        Combined int64 key of a cross from the integer codes of its columns, without building any
+        string: codes are combined in mixed radix, so keys are exact as long as the product of the
+        column cardinalities fits in int64. Larger crosses fall back to a polynomial hash
+        (wrapping uint64 arithmetic) and are then always bucketed.
 
-        if subset == "train":
-            self.te = TargetEncoder()
-            # Transform returns numpy array, so we need to convert it back to DataFrame
-            df_te = pd.DataFrame(
-                self.te.fit_transform(df[cols_to_target_encode], df["is_click"]),
-                columns=cols_to_target_encode,
-                index=df.index
-            )
-        elif subset == "test":
-            if not hasattr(self, 'te'):
-                raise ValueError("Target Encoder has not been trained! Run on training data first.")
-            df_te = pd.DataFrame(
-                self.te.transform(df[cols_to_target_encode]),
-                columns=cols_to_target_encode,
-                index=df.index
-            )
+        Parameters:
+            categories (dict): Column -> pd.Index of its training categories.
 
-        # Append the encoded features
-        for orig_col in cols_to_target_encode:
-            df[f"{orig_col}_te"] = df_te[orig_col]
+        Returns:
+            tuple: (keys, valid, exact), where valid marks the rows with a known category in
+                every column of the cross.
+        """
+        keys = np.zeros(len(df), dtype=np.uint64)
+        valid = np.ones(len(df), dtype=bool)
+        exact = np.prod([float(len(uniques)) for uniques in categories.values()]) < 2 ** 62
+        for col, uniques in categories.items():
+            codes = uniques.get_indexer(df[col].to_numpy())
+            valid &= codes >= 0
+            radix = len(uniques) if exact else CROSS_HASH_MULTIPLIER
+            keys = keys * np.uint64(radix) + codes.astype(np.uint64)
+        return keys, valid, exact
+
+    def cross_buckets(self, keys, n_buckets):
+        """Fibonacci hash of `keys` into `n_buckets` (a power of 2) buckets."""
+        shift = np.uint64(64 - int(np.log2(n_buckets)))
+        return ((keys * CROSS_BUCKET_MULTIPLIER) >> shift).astype(np.int64)
+
+    def cross_ctr(self, df, crosses, subset="train", alpha=10, cv=5, random_state=100):
+        """
+        Smoothed out-of-fold CTR of every cross of `crosses` (tuples of columns), added as
+        `<col>_x_<col>_ctrS` columns with the same smoothing and folds as smooth_ctr.
 
-        return df
+        Crosses with more than max_cross_categories distinct training keys are hashed into
+        max_cross_categories buckets (rounded up to a power of 2), which bounds the size of
+        the statistics and of the fitted table regardless of the cross cardinality.
+        """
+        df = owned_copy(df)
+
+        if subset == "train":
+            self.cross_ctr_maps = {}
+            global_ctr = df['is_click'].mean()
+            clicks = df['is_click'].fillna(0).to_numpy(dtype=np.float64)
+            has_session = df['session_id'].notna().to_numpy()
+            fold_ids = self.cv_fold_ids(df['is_click'], cv=cv, random_state=random_state)
+
+            categories = {}
+            for col in sorted({col for cross in crosses for col in cross}):
+                categories[col] = pd.Index(pd.factorize(df[col].to_numpy())[1])
+
+            for cross in crosses:
+                name = "_x_".join(cross)
+                keys, valid, exact = self.cross_keys(df, {col: categories[col] for col in cross})
+                valid_codes, uniques = pd.factorize(keys[valid])
+                codes = np.full(len(df), -1, dtype=np.int64)
+                codes[valid] = valid_codes
+
+                n_buckets = None
+                if not exact or len(uniques) > self.max_cross_categories:
+                    n_buckets = 2 ** int(np.ceil(np.log2(self.max_cross_categories)))
+                    codes[valid] = self.cross_buckets(keys[valid], n_buckets)
+                    self.logger.info(f"Hashing {len(uniques)} {name} crosses into {n_buckets} buckets")
+
+                n_categories = n_buckets or len(uniques)
+                oof_ctr, mapping_all = self.smoothed_ctrs(
+                    codes, fold_ids, *self.code_fold_statistics(codes, n_categories, fold_ids, cv, clicks, has_session),
+                    alpha, global_ctr)
+                self.add_feature(df, f'{name}_ctrS', oof_ctr)
+
+                self.cross_ctr_maps[name] = {
+                    "columns": cross,
+                    "categories": [categories[col] for col in cross],
+                    "n_buckets": n_buckets,
+                    # Bucket tables are dense, exact tables are indexed by the cross key
+                    "table": mapping_all if n_buckets else pd.Series(mapping_all, index=pd.Index(uniques)),
+                    "global_ctr": global_ctr,
+                }
+            return df
 
+        elif subset == "test":
+            for name, cross_map in getattr(self, "cross_ctr_maps", {}).items():
+                keys, valid, _ = self.cross_keys(df, dict(zip(cross_map["columns"], cross_map["categories"])))
+                cross_ctr = np.full(len(df), cross_map["global_ctr"], dtype=np.float64)
+                if cross_map["n_buckets"]:
+                    cross_ctr[valid] = cross_map["table"][self.cross_buckets(keys[valid], cross_map["n_buckets"])]
+                else:
+                    codes = cross_map["table"].index.get_indexer(keys[valid])
+                    cross_ctr[np.flatnonzero(valid)[codes >= 0]] = cross_map["table"].to_numpy()[codes[codes >= 0]]
+                self.add_feature(df, f'{name}_ctrS', cross_ctr)
+            return df
 
+        else:
+            raise ValueError("subset must be either 'train' or 'test'")
 
+    
+    
 
-    def cumulative_unique_count(self, values):
+    def add_target_encoding(self, df, cols_to_target_encode, subset="train", cv=5, random_state=100):
         """
-        For a 1D array/Series of values, return an array of
-        'number of unique values so far (before this row)'.
+        Add the `<col>_te` target encodings (float32). On train they are cross-fitted on the
+        cv_fold_ids folds, on test the encodings fitted on the full training data are applied.
         """
-        seen = set()
-        result = []
-        for val in values:
-            result.append(len(seen))
-            seen.add(val)
-        return result
+        df = owned_copy(df)
 
-    
+        if subset == "train":
+            self.te = FactorizedTargetEncoder()
+            fold_ids = self.cv_fold_ids(df["is_click"], cv=cv, random_state=random_state)
+            return self.te.fit_transform(df, cols_to_target_encode, df["is_click"], fold_ids)
+        elif subset == "test":
+            if getattr(self, "te", None) is None:
+                raise ValueError("Target Encoder has not been trained! Run on training data first.")
+            return self.te.transform(df, cols_to_target_encode)
+        else:
+            raise ValueError("subset must be either 'train' or 'test'")
 
+    def previous_clicks(self, df, subset="train"):
+        """
+        Number of clicks of the user before the session's DateTime, counted on the training data:
+        the history is fitted on `df` when subset is "train" and reused when it is "test".
+        """
+        df = owned_copy(df)
 
+        if subset == "train":
+            self.click_history = ClickHistory(df["user_id"], df["DateTime"], df["is_click"])
+        elif subset == "test":
+            if getattr(self, "click_history", None) is None:
+                raise ValueError("Click history has not been fitted! Run on training data first.")
+        else:
+            raise ValueError("subset must be either 'train' or 'test'")
 
-    def feature_generation(self, df: pd.DataFrame, subset="train") -> pd.DataFrame:
+        # Sessions without user_id or DateTime have no known history
+        self.add_feature(df, "user_previous_clicks", self.click_history.previous_clicks(df["user_id"], df["DateTime"]).fillna(0))
+        return df
 
-        df = df.copy()
+    def add_feature(self, df: pd.DataFrame, col: str, values):
+        """Set the generated column `col` of `df`, in its compact dtype from the schema registry (utils.schema)."""
+        df[col] = cast_feature(values, col)
 
-        
-        # Handle product category columns in input data
+    def combine_product_categories(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Merge product_category_1 and product_category_2 into a single product_category column."""
         if all(col in df.columns for col in ["product_category_1", "product_category_2"]):
             df["product_category"] = df["product_category_1"].fillna(df["product_category_2"])
             df.drop(columns=["product_category_1", "product_category_2"], inplace=True)
+        return df
 
-        # Continue with feature generation
-        cols_to_target_encode = [c for c in df.columns if c not in ["session_id", "DateTime", "is_click"]]
-
-        if subset == "train":
-            df = self.smooth_ctr(df, cols_to_target_encode, subset="train")
-            df = self.add_target_encoding(df, cols_to_target_encode, subset="train")
-        elif subset == "test":
-            df = self.smooth_ctr(df, cols_to_target_encode, subset="test")
-            df = self.add_target_encoding(df, cols_to_target_encode, subset="test")
-
+    def label_free_features(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        The features that do not depend on is_click (time parts, per-user session features and
+        campaign features), computed on `df` and returned as a frame of the new columns only.
+        """
+        df = self.combine_product_categories(owned_copy(df))
+        input_cols = df.columns
+        df = self.label_free_columns(df, self.campaign_statistics(df))
+        missing = self.label_free_missing(df)
+        fill_values = self.label_free_fill_values(self.label_free_fill_statistics(df, [group for group, n in missing.items() if n > 0]))
+        return self.fill_label_free_features(df, fill_values).drop(columns=input_cols)
+
+    def label_free_columns(self, df: pd.DataFrame, campaign_statistics: dict) -> pd.DataFrame:
+        """
+        Add the label-free features to `df` in place, before the fills with dataset-wide modes of
+        fill_label_free_features. Per-user features only need the user's own rows; campaign
+        features come from the `campaign_statistics` of the whole dataset.
+        """
         # Generate time-based features
-        df['Hour'] = df['DateTime'].dt.hour
-        df['Minute'] = df['DateTime'].dt.minute # Maybe drop
-        df['weekday'] = df['DateTime'].dt.weekday 
-        def part_of_day(hour):
-            if 6 <= hour < 12:
-                return 'morning'
-            elif 12 <= hour < 17:
-                return 'afternoon'
-            elif 17 <= hour < 22:
-                return 'evening'
-            else:
-                return 'night'
-        df['part_of_day'] = df['Hour'].apply(part_of_day)
-        df['user_total_num_of_sessions']= df.groupby("user_id")["session_id"].transform('nunique')
+        self.add_feature(df, 'Hour', df['DateTime'].dt.hour)
+        self.add_feature(df, 'Minute', df['DateTime'].dt.minute) # Maybe drop
+        self.add_feature(df, 'weekday', df['DateTime'].dt.weekday)
+        # Hours 22-6, and a missing hour, are night
+        hour = df['Hour'].to_numpy(dtype=float)
+        self.add_feature(df, 'part_of_day', np.select(
+            [(6 <= hour) & (hour < 12), (12 <= hour) & (hour < 17), (17 <= hour) & (hour < 22)],
+            ['morning', 'afternoon', 'evening'], default='night'))
+
+        # Per-user sequential features, all derived from a single (user_id, DateTime) sort
+        self.session_index = SessionIndex(df)
+        self.add_feature(df, 'user_total_num_of_sessions', self.session_index.session_counts(df["session_id"]))
 
         # user_session_order (starting from 1)
-        df['user_session_order'] = df.sort_values(by="DateTime").groupby('user_id')['DateTime'].rank(method='first')
+        self.add_feature(df, 'user_session_order', self.session_index.session_order())
 
         # is_first_session (binary)
-        first_session_map = df.groupby("user_id")["DateTime"].min().to_dict()
-        df["is_first_session"] = (df.DateTime == df.user_id.map(first_session_map)).astype("int")
-        df['user_num_of_days_in_webpage'] = df.groupby(["user_id", "webpage_id"])["weekday"].transform('nunique')
-
-        # campaign_num_of_products
-        df['campaign_num_of_products'] = df.groupby("campaign_id")["product"].transform('nunique')
-
-        # campaign_num_of_product_categories
-        df['campaign_num_of_product_categories'] = df.groupby("campaign_id")["product_category"].transform('nunique')
-
-        # user's hours_since_last_session
-        df['hours_since_last_session'] = (df.sort_values(by="DateTime").groupby("user_id")["DateTime"].diff()).dt.total_seconds()/3600
-        # Replace NaN with 0
-        df['hours_since_last_session'] = df['hours_since_last_session'].fillna(0)
-        #cols = ['webpage_id', 'product_category', 'campaign_id', 'product']
-        #for col in cols:
-            #df['user_distinct_' + col] = df.sort_values("DateTime").groupby('user_id', group_keys=False)[col].apply(self.cumulative_unique_count)
-        # Fill missing values for time-based features
-        cols_to_fill = ["Hour", "Minute", "weekday", "part_of_day"]
+        self.add_feature(df, "is_first_session", self.session_index.first_session())
+        self.add_feature(df, 'user_num_of_days_in_webpage',
+                         df.groupby(["user_id", "webpage_id"])["weekday"].transform('nunique'))
+
+        # campaign_num_of_products and campaign_num_of_product_categories
+        for col, name in [("product", "campaign_num_of_products"), ("product_category", "campaign_num_of_product_categories")]:
+            n_unique = campaign_statistics[col].groupby("campaign_id", observed=True)[col].nunique()
+            self.add_feature(df, name, df["campaign_id"].map(n_unique))
+
+        # user's hours_since_last_session, NaN replaced with 0
+        self.add_feature(df, 'hours_since_last_session', self.session_index.hours_since_previous().fillna(0))
+
+        # Number of distinct values the user saw in earlier sessions
+        for col in LABEL_FREE_DISTINCT_COLUMNS:
+            self.add_feature(df, 'user_distinct_' + col, self.session_index.cumulative_distinct(df[col]))
+
+        # Sessions of the user and of the campaign in the trailing time windows
+        for prefix, counts in [("user", self.session_index.window_counts(self.time_windows)),
+                               ("campaign", self.campaign_window_counts(df, campaign_statistics["session_times"]))]:
+            for window in self.time_windows:
+                self.add_feature(df, f'{prefix}_sessions_last_{window}', counts[window])
+
+        # Time-based features take the mode of the user's sessions
+        cols_to_fill = LABEL_FREE_TIME_COLUMNS
         df[cols_to_fill] = self.mode_target(df, cols_to_fill, "user_id")
 
-        if df[cols_to_fill].isna().sum().sum() > 0:
-            df[cols_to_fill] = df[cols_to_fill].fillna(df[cols_to_fill].mode().iloc[0])
-        
-        new_colls = ['user_total_num_of_sessions', 'user_session_order', 'is_first_session', 
-                     'user_num_of_days_in_webpage', 'campaign_num_of_products', 'campaign_num_of_product_categories',
-                       'hours_since_last_session']
-        
-        if df[new_colls].isna().sum().sum() > 0:
-            self.logger.warning(f"Still missing values in columns: {new_colls}, sum: {df[new_colls].isna().sum().sum()}")
-            #df[new_colls] = df[new_colls].fillna(df[new_colls].mode().iloc[0])
-            df[new_colls] = df[new_colls].fillna(df[new_colls].apply(lambda x: x.mode().iloc[0] if not x.mode().empty else 0))
-
         # Generate campaign-based features
-        df['start_date'] = df.groupby('campaign_id', observed=True)['DateTime'].transform('min')
+        df['start_date'] = df['campaign_id'].map(campaign_statistics["start_date"]).astype(df['DateTime'].dtype)
         df['campaign_duration'] = df['DateTime'] - df['start_date']
-        df['campaign_duration_hours'] = df['campaign_duration'].dt.total_seconds() / 3600
+        self.add_feature(df, 'campaign_duration_hours', df['campaign_duration'].dt.total_seconds() / 3600)
+        return df
+
+    def campaign_statistics(self, df: pd.DataFrame) -> dict:
+        """
+        Statistics of the campaign features of `df`: the unique (campaign_id, product) and
+        (campaign_id, product_category) pairs, the number of sessions per (campaign_id, DateTime)
+        and the first DateTime of every campaign. The statistics of several parts of a dataset
+        are merged with combine_campaign_statistics.
+        """
+        with_campaign = df["campaign_id"].notna()
+        timed = df.loc[with_campaign & df["DateTime"].notna(), ["campaign_id", "DateTime"]]
+        return {
+            "product": df.loc[with_campaign, ["campaign_id", "product"]].drop_duplicates(),
+            "product_category": df.loc[with_campaign, ["campaign_id", "product_category"]].drop_duplicates(),
+            "session_times": timed.groupby(["campaign_id", "DateTime"]).size(),
+            "start_date": timed.groupby("campaign_id")["DateTime"].min(),
+        }
+
+    def combine_campaign_statistics(self, statistics: list) -> dict:
+        """Campaign statistics of a whole dataset from the campaign_statistics of its parts."""
+        return {
+            "product": pd.concat([part["product"] for part in statistics]).drop_duplicates(),
+            "product_category": pd.concat([part["product_category"] for part in statistics]).drop_duplicates(),
+            "session_times": combine_counts([part["session_times"] for part in statistics]),
+            "start_date": pd.concat([part["start_date"] for part in statistics]).groupby(level=0).min(),
+        }
+
+    def campaign_window_counts(self, df: pd.DataFrame, session_times: pd.Series) -> pd.DataFrame:
+        """
+        Number of the campaign's other sessions in the trailing window (t - window, t] of each row,
+        for every window of time_windows, from the session counts per (campaign_id, DateTime) of
+        campaign_statistics. Same counts as SessionIndex(df, user_col="campaign_id").window_counts.
+
+        The counts are keyed by campaign_code * (n_times + 1) + time rank and accumulated, so a
+        window is the difference of two np.searchsorted lookups per row.
+        """
+        campaign_index = pd.Index(session_times.index.get_level_values(0).unique())
+        times = session_times.index.get_level_values(1).to_numpy(dtype="datetime64[ns]").view(np.int64)
+        unique_times = np.unique(times)
+        stride = np.int64(len(unique_times) + 1)
+
+        keys = (campaign_index.get_indexer(session_times.index.get_level_values(0)).astype(np.int64) * stride
+                + np.searchsorted(unique_times, times) + 1)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        cumulative = np.concatenate([[0], np.cumsum(session_times.to_numpy()[order])])
+
+        row_codes = campaign_index.get_indexer(df["campaign_id"].to_numpy())
+        datetimes = df["DateTime"].to_numpy(dtype="datetime64[ns]")
+        timed = np.flatnonzero((row_codes >= 0) & ~np.isnat(datetimes))
+        offsets = row_codes[timed].astype(np.int64) * stride
+        row_times = datetimes[timed].view(np.int64)
+
+        def sessions_until(limits):
+            """Sessions of the row's campaign with DateTime <= limit, plus those of the campaigns before it."""
+            return cumulative[np.searchsorted(keys, offsets + np.searchsorted(unique_times, limits, side="right"), side="right")]
+
+        counts = {}
+        upper = sessions_until(row_times)
+        for window in self.time_windows:
+            window_count = np.full(len(df), np.nan)
+            # The row itself is inside its window
+            window_count[timed] = upper - sessions_until(row_times - pd.Timedelta(window).value) - 1
+            counts[window] = window_count
+        return pd.DataFrame(counts, index=df.index)
+
+    def label_free_fill_columns(self) -> dict:
+        """The label-free columns filled with their dataset-wide mode, per fill group."""
+        return {
+            "time": LABEL_FREE_TIME_COLUMNS,
+            "sessions": ['user_total_num_of_sessions', 'user_session_order', 'is_first_session',
+                         'user_num_of_days_in_webpage', 'campaign_num_of_products', 'campaign_num_of_product_categories',
+                         'hours_since_last_session'] + ['user_distinct_' + col for col in LABEL_FREE_DISTINCT_COLUMNS]
+                        + [f'{prefix}_sessions_last_{window}' for prefix in ["user", "campaign"] for window in self.time_windows],
+            "campaign_duration": ["campaign_duration_hours"],
+        }
+
+    def label_free_missing(self, df: pd.DataFrame) -> dict:
+        """Number of missing values of every fill group of label_free_fill_columns in `df`."""
+        return {group: int(df[columns].isna().sum().sum()) for group, columns in self.label_free_fill_columns().items()}
+
+    def label_free_fill_statistics(self, df: pd.DataFrame, groups: list) -> dict:
+        """
+        Value counts behind the fills of the fill `groups` (only needed for groups with missing
+        values): per column for "time" and "sessions", per (campaign_id, value) for the campaign
+        duration, together with the campaigns of `df`.
+        """
+        columns = self.label_free_fill_columns()
+        statistics = {}
+        for group in groups:
+            if group == "campaign_duration":
+                statistics[group] = {
+                    "counts": group_value_counts(df, "campaign_id", "campaign_duration_hours"),
+                    "campaigns": pd.Series(0, index=df["campaign_id"].dropna().unique()),
+                }
+            else:
+                statistics[group] = {col: value_counts(df[col]) for col in columns[group]}
+        return statistics
+
+    def combine_label_free_fill_statistics(self, statistics: list) -> dict:
+        """Fill statistics of a whole dataset from the label_free_fill_statistics of its parts."""
+        combined = {}
+        for group in statistics[0] if statistics else []:
+            if group == "campaign_duration":
+                combined[group] = {key: combine_counts([part[group][key] for part in statistics])
+                                   for key in ["counts", "campaigns"]}
+            else:
+                combined[group] = {col: combine_counts([part[group][col] for part in statistics])
+                                   for col in statistics[0][group]}
+        return combined
+
+    def label_free_fill_values(self, statistics: dict) -> dict:
+        """
+        Fill values of every fill group with missing values: the column mode for "time" (none for
+        a column without values), the column mode or 0 for "sessions", and for the campaign duration
+        the mode of each campaign or 0.
+        """
+        fill_values = {}
+        for group, group_statistics in statistics.items():
+            if group == "campaign_duration":
+                modes = group_modes(group_statistics["counts"])
+                fill_values[group] = modes.reindex(group_statistics["campaigns"].index).fillna(0)
+            else:
+                default = np.nan if group == "time" else 0
+                fill_values[group] = pd.Series({col: mode_of_counts(counts, default) for col, counts in group_statistics.items()},
+                                               dtype=object)
+        return fill_values
+
+    def fill_label_free_features(self, df: pd.DataFrame, fill_values: dict) -> pd.DataFrame:
+        """
+        Fill the label-free features of `df` with the dataset-wide `fill_values` of
+        label_free_fill_values and cast them to their compact dtypes.
+        """
+        columns = self.label_free_fill_columns()
+
+        # Fill missing values for time-based features
+        if "time" in fill_values:
+            df[columns["time"]] = df[columns["time"]].fillna(fill_values["time"])
+
+        if "sessions" in fill_values:
+            self.logger.warning(f"Still missing values in columns: {columns['sessions']}, sum: {df[columns['sessions']].isna().sum().sum()}")
+            df[columns["sessions"]] = df[columns["sessions"]].fillna(fill_values["sessions"])
 
         # Fill campaign duration missing values
-        df.loc[:, 'campaign_duration_hours'] = df['campaign_duration_hours'].fillna(
-            df.groupby('campaign_id')['campaign_duration_hours'].transform(
-                lambda x: x.mode().iloc[0] if not x.mode().empty else 0
-            )
-        )
+        if "campaign_duration" in fill_values:
+            df.loc[:, 'campaign_duration_hours'] = df['campaign_duration_hours'].fillna(
+                df['campaign_id'].map(fill_values["campaign_duration"]))
+
+        # Integer features that held missing values before the fills
+        return apply_feature_schema(df)
+
+    def feature_generation(self, df: pd.DataFrame, subset="train", label_free: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        Generate the model features of `df`. The target encoders are fitted when subset is "train"
+        and applied when it is "test". `label_free` holds precomputed label_free_features covering
+        the rows of `df`; they are computed on `df` itself when not given.
+        """
+        df = self.combine_product_categories(owned_copy(df))
+
+        # Continue with feature generation
+        cols_to_target_encode = self.target_encoding_columns(df)
+
+        if subset == "train":
+            df = self.profiled("smooth_ctr[train]", self.smooth_ctr, df, cols_to_target_encode, subset="train")
+            df = self.profiled("cross_ctr[train]", self.cross_ctr, df, self.resolve_ctr_crosses(cols_to_target_encode), subset="train")
+            df = self.profiled("add_target_encoding[train]", self.add_target_encoding, df, cols_to_target_encode, subset="train")
+            df = self.profiled("previous_clicks[train]", self.previous_clicks, df, subset="train")
+        elif subset == "test":
+            df = self.profiled("smooth_ctr[test]", self.smooth_ctr, df, cols_to_target_encode, subset="test")
+            df = self.profiled("cross_ctr[test]", self.cross_ctr, df, self.resolve_ctr_crosses(cols_to_target_encode), subset="test")
+            df = self.profiled("add_target_encoding[test]", self.add_target_encoding, df, cols_to_target_encode, subset="test")
+            df = self.profiled("previous_clicks[test]", self.previous_clicks, df, subset="test")
+
+        return self.finish_features(df, subset, label_free)
+
+    def target_encoding_columns(self, df: pd.DataFrame) -> list:
+        """Columns of `df` encoded by smooth_ctr and add_target_encoding."""
+        return [c for c in df.columns if c not in ["session_id", "DateTime", "is_click"]]
+
+    def finish_features(self, df: pd.DataFrame, subset: str, label_free: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        Last steps of feature_generation, after the target encoders: join the label-free features,
+        drop the identifier columns and encode the categorical columns.
+        """
+        if label_free is None:
+            label_free = self.profiled(f"label_free_features[{subset}]", self.label_free_features, df)
+        df = pd.concat([df, label_free.reindex(df.index)], axis=1)
 
         # Drop unnecessary columns
         df.drop(columns=['DateTime', 'start_date', 'campaign_duration', 'session_id', 'user_id'], inplace=True,
@@ -626,7 +1278,9 @@ class DataPreprocessor:
 
         # Handle categorical features
         if self.catb:
-            self.determine_categorical_features(df)
+            with self.profiler.stage(f"determine_categorical_features[{subset}]", df) as stage:
+                self.determine_categorical_features(df)
+                stage.output(df)
 
         # One-hot encoding if enabled
         if self.use_dummies:
@@ -645,74 +1299,174 @@ class DataPreprocessor:
     """
     
 
+    def fit_transform_features(self, train_df: pd.DataFrame, test_df: pd.DataFrame,
+                               train_label_free: pd.DataFrame = None, test_label_free: pd.DataFrame = None) -> tuple:
+        """
+        Fit the feature generation on `train_df` and apply it to `test_df`, starting from a
+        clean state so no mapping leaks between jobs. Precomputed label-free features are
+        reused when given, see feature_generation.
+
+        Returns:
+            tuple: (train_processed, test_processed, fitted_state), where fitted_state holds
+                the fitted ctr_maps, global_ctrs, cross_ctr_maps, te and click_history.
+        """
+        self.ctr_maps = {}
+        self.global_ctrs = {}
+        self.cross_ctr_maps = {}
+        self.te = None
+        self.click_history = None
+
+        train_processed = self.feature_generation(train_df, subset="train", label_free=train_label_free)
+        test_processed = self.feature_generation(test_df, subset="test", label_free=test_label_free)
+
+        fitted_state = {"ctr_maps": self.ctr_maps, "global_ctrs": self.global_ctrs, "cross_ctr_maps": self.cross_ctr_maps,
+                        "te": self.te, "click_history": self.click_history}
+        return train_processed, test_processed, fitted_state
+
+    def run_feature_jobs(self, jobs):
+        """
+        Run `fit_transform_features` on the arguments of every job of `jobs` and yield the
+        results in order.
+
+        With n_jobs == 1 the jobs run one after the other in this process. Otherwise they run
+        in a process pool, each in a fresh DataPreprocessor with the same options.
+        """
+        if self.n_jobs == 1:
+            for job in jobs:
+                yield self.fit_transform_features(*job)
+            return
+
+        n_workers = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+        options = self.worker_options()
+        self.logger.info(f"Running feature generation jobs on {n_workers} processes")
+
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_fit_transform_features_job, options, self.shared_state(), *job) for job in jobs]
+            for future in futures:
+                train_processed, test_processed, fitted_state = future.result()
+                self.profiler.extend(fitted_state.pop("profile", []))
+                yield train_processed, test_processed, fitted_state
+
+    def shared_state(self) -> dict:
+        """State fitted before the feature jobs that every worker process needs."""
+        return {"category_dictionaries": getattr(self, "category_dictionaries", None)}
+
+    def worker_options(self) -> dict:
+        """Constructor options for an equivalent DataPreprocessor running inside a worker process."""
+        return {
+            "output_path": self.output_path,
+            "remove_outliers": self.remove_outliers,
+            "fillna": self.fillna,
+            "use_dummies": self.use_dummies,
+            "save_as_pickle": self.save_as_pickle,
+            "catb": self.catb,
+            "use_missing_with_mode": self.use_missing_with_mode,
+            "fill_cat": self.fill_cat,
+            "indexed_folds": self.indexed_folds,
+            "columnar": self.columnar,
+            "per_fold_features": self.per_fold_features,
+            "profile": self.profiler.enabled,
+            "time_windows": self.time_windows,
+            "ctr_crosses": self.ctr_crosses,
+            "max_cross_categories": self.max_cross_categories,
+            "copy_on_write": self.copy_on_write,
+        }
+
+    @copy_on_write_method
     def preprocess(self, df_train: pd.DataFrame, df_test: pd.DataFrame) -> tuple:
         # Initial cleaning steps that do not involve target-dependent feature generation
-        df_train = self.drop_completely_empty(df_train).copy()
-        df_train = self.drop_session_id_or_is_click(df_train)
-        df_test = self.decrease_test_user_group_id(df_test) # Maybe remove it
-        df_test = self.replace_test_user_depth_to_training(df_train, df_test) # Maybe remove it
-        
+        self.profiler.reset()
+        df_train, df_test = owned_copy(df_train), owned_copy(df_test)
+        df_train = self.profiled("drop_completely_empty[train]", self.drop_completely_empty, df_train)
+        df_train = self.profiled("drop_session_id_or_is_click[train]", self.drop_session_id_or_is_click, df_train)
+        df_test = self.profiled("decrease_test_user_group_id[test]", self.decrease_test_user_group_id, df_test) # Maybe remove it
+
         self.logger.info(f"Total missing values in train dataset: {df_train.isna().sum().sum()}")
         self.logger.info(f"Total missing values in test dataset: {df_test.isna().sum().sum()}")
+
+        # Fit: fill the training data and build every inference table once from it
+        df_train = self.profiled("deterministic_fill[train]", self.deterministic_fill, df_train)
+        self.fill_mappings = self.deterministic_fill_mappings(df_train)
+
+        # Apply: the test data is filled from the training tables, then from its own rules
+        df_test = self.profiled("replace_test_user_depth_to_training[test]", self.replace_test_user_depth_to_training, df_test) # Maybe remove it
+        df_test = self.profiled("deterministic_fill[test]", self.deterministic_fill, df_test, mappings=self.fill_mappings)
         
-        df_train = self.deterministic_fill(df_train)
-        df_test = self.deterministic_fill(df_test)
-        
-        df_train["DateTime"] = pd.to_datetime(df_train["DateTime"], errors="coerce")
-        df_test["DateTime"] = pd.to_datetime(df_test["DateTime"], errors="coerce")
+        df_train["DateTime"] = parse_datetime(df_train["DateTime"])
+        df_test["DateTime"] = parse_datetime(df_test["DateTime"])
         
         if self.remove_outliers: # Maybe we need it
             df_train = self.remove_outliers(df_train)
             df_test = self.remove_outliers(df_test)
 
         if self.fillna:
-            df_train = self.fill_missing_values(df_train)
-            df_test = self.fill_missing_values(df_test)
+            df_train = self.profiled("fill_missing_values[train]", self.fill_missing_values, df_train)
+            df_test = self.profiled("fill_missing_values[test]", self.fill_missing_values, df_test)
         
         # Create stratified folds from the raw training data (without feature generation)
 
         y = df_train["is_click"]
         skf = StratifiedKFold(n_splits=5, shuffle=True, random_state=100)
         fold_datasets = []
-        
-        for fold, (train_idx, val_idx) in enumerate(skf.split(df_train, y)):
-            train_fold = df_train.iloc[train_idx].copy()
-            val_fold = df_train.iloc[val_idx].copy()
-            
-            # Reset any mapping parameters to ensure independence per fold
-            self.ctr_maps = {}
-            self.global_ctrs = {}
-            self.te = None
-            
-            # Perform feature generation on the training fold (fitting transformations)
-            train_fold_processed = self.feature_generation(train_fold, subset="train")
-            # Use the transformations learned on the training fold to process the validation fold
-            val_fold_processed = self.feature_generation(val_fold, subset="test")
+
+        # One category dictionary per categorical column, shared by every fold, the test set and the artifact
+        category_source = [col for col in CATEGORICAL_COLUMNS + ["product_category_1", "product_category_2"]
+                           if col in df_train.columns]
+        self.category_dictionaries = self.build_category_dictionaries(
+            self.combine_product_categories(owned_copy(df_train[category_source])))
+
+        # The label-free features are computed once on the full train and test sets and shared by
+        # all jobs, unless per-fold semantics are requested, in which case every job computes them
+        # on its own rows.
+        if self.per_fold_features:
+            train_label_free, test_label_free = None, None
+        else:
+            train_label_free = self.profiled("label_free_features[train]", self.label_free_features, df_train)
+            test_label_free = self.profiled("label_free_features[test]", self.label_free_features, df_test)
+
+        def fold_label_free(rows):
+            return None if train_label_free is None else train_label_free.iloc[rows]
+
+        # One job per fold, plus the entire training set for final model training. Each job fits
+        # the transformations on its train part and uses them to process its test part.
+        fold_jobs = (
+            (owned_copy(df_train.iloc[train_idx]), owned_copy(df_train.iloc[val_idx]),
+             fold_label_free(train_idx), fold_label_free(val_idx))
+            for train_idx, val_idx in skf.split(df_train, y)
+        )
+        final_job = (df_train, df_test, train_label_free, test_label_free)
+        results = self.run_feature_jobs(itertools.chain(fold_jobs, [final_job]))
+        with self.profiler.stage("feature_jobs", df_train) as stage:
+            for fold in range(skf.get_n_splits()):
+                train_fold_processed, val_fold_processed, _ = next(results)
             
-            fold_datasets.append((
-                train_fold_processed.drop(columns=["is_click"]), 
-                train_fold_processed["is_click"],
-                val_fold_processed.drop(columns=["is_click"]), 
-                val_fold_processed["is_click"]
-            ))
+                fold_datasets.append((
+                    train_fold_processed.drop(columns=["is_click"]), 
+                    train_fold_processed["is_click"],
+                    val_fold_processed.drop(columns=["is_click"]), 
+                    val_fold_processed["is_click"]
+                ))
             
-            self.callback({
-                f"fold_{fold}_train_dataset": train_fold_processed.drop(columns=["is_click"]),
-                f"fold_{fold}_val_dataset": val_fold_processed.drop(columns=["is_click"]),
-                f"fold_{fold}_train_target": train_fold_processed["is_click"],
-                f"fold_{fold}_val_target": val_fold_processed["is_click"]
-            })
+                # The callback gets the fold's own frames, so a cached run stores them only once
+                X_fold_train, y_fold_train, X_fold_val, y_fold_val = fold_datasets[-1]
+                self.callback({
+                    f"fold_{fold}_train_dataset": X_fold_train,
+                    f"fold_{fold}_val_dataset": X_fold_val,
+                    f"fold_{fold}_train_target": y_fold_train,
+                    f"fold_{fold}_val_target": y_fold_val
+                })
         
-        # Process the entire training set for final model training
-        self.ctr_maps = {}
-        self.global_ctrs = {}
-        self.te = None
-        df_train_processed = self.feature_generation(df_train, subset="train")
+            # The entire training set, with the test set processed using the full training data parameters
+            df_train_processed, df_test_processed, fitted_state = next(results)
+            stage.output(df_train_processed)
+        self.ctr_maps = fitted_state["ctr_maps"]
+        self.global_ctrs = fitted_state["global_ctrs"]
+        self.cross_ctr_maps = fitted_state["cross_ctr_maps"]
+        self.te = fitted_state["te"]
+        self.click_history = fitted_state["click_history"]
         X_train = df_train_processed.drop(columns=["is_click"])
         y_train = df_train_processed["is_click"]
         
-        # Process the test set using the full training data parameters
-        df_test_processed = self.feature_generation(df_test, subset="test")
         X_test = df_test_processed.drop(columns=["is_click"])
         y_test = df_test_processed["is_click"]
         
@@ -724,12 +1478,20 @@ class DataPreprocessor:
             "X_test_1st": df_test_processed
         })
         self.logger.info("Created stratified folds with per-fold feature generation.")
+
+        if self.profiler.enabled:
+            self.report_profile()
         
         return df_train_processed, X_train, X_test, y_train, y_test, fold_datasets, df_test_processed
 
-    def preprocess_test(self, df_test: pd.DataFrame, trained_preprocessor=None) -> pd.DataFrame:
+    @copy_on_write_method
+    def preprocess_test(self, df_test: pd.DataFrame, trained_preprocessor=None, artifact_path: Path = None) -> pd.DataFrame:
         """
         Preprocess test data with detailed logging of transformations.
+
+        The fitted encoders come from `trained_preprocessor` if given, otherwise from the
+        artifact saved by `save_data` (default: output_path / ARTIFACT_NAME). Only when no
+        artifact exists are they refitted from the raw training CSV.
         """
         try:
             def log_dataset_stats(df, stage):
@@ -755,17 +1517,35 @@ class DataPreprocessor:
             # Initial logging
             log_dataset_stats(df_test, "Initial State")
 
-            if trained_preprocessor is None:
+            artifact_path = Path(artifact_path) if artifact_path is not None else self.output_path / ARTIFACT_NAME
+
+            if trained_preprocessor is not None:
+                self.logger.info("Using pre-fitted preprocessor")
+                self.te = trained_preprocessor.te
+                self.ctr_maps = trained_preprocessor.ctr_maps
+                self.global_ctrs = trained_preprocessor.global_ctrs
+                self.cross_ctr_maps = trained_preprocessor.cross_ctr_maps
+                self.category_dictionaries = trained_preprocessor.category_dictionaries
+                self.click_history = trained_preprocessor.click_history
+                self.fill_mappings = trained_preprocessor.fill_mappings
+
+            elif artifact_path.exists():
+                self.load_artifact(artifact_path)
+
+            else:
+                self.logger.warning(f"No preprocessor artifact at {artifact_path}, refitting on the training data")
                 # Load training data logging
                 self.logger.info("\nLoading training data for reference...")
                 train_data_path = current_dir / "data/raw/train_dataset_full.csv"
-                train_data = pd.read_csv(train_data_path)
+                train_data = read_raw_csv(train_data_path)
 
-                train_data["DateTime"] = pd.to_datetime(train_data["DateTime"], errors="coerce")
                 train_data = self.drop_completely_empty(train_data)
                 train_data.dropna(subset=["is_click"], inplace=True)
                 log_dataset_stats(train_data, "Training Data Reference")
 
+                self.fill_mappings = self.deterministic_fill_mappings(self.deterministic_fill(owned_copy(train_data)))
+                self.logger.info(f"Fitted deterministic fill tables: {list(self.fill_mappings)}")
+
                 # Prepare encoders and mappings
                 if "product_category_1" in train_data.columns and "product_category_2" in train_data.columns:
                     train_data["product_category"] = train_data["product_category_1"].fillna(
@@ -773,31 +1553,35 @@ class DataPreprocessor:
                     train_data.drop(columns=["product_category_1", "product_category_2"], inplace=True)
                     self.logger.info("Combined product categories")
 
-                cols_to_encode = [c for c in train_data.columns if c not in ["session_id", "DateTime", "is_click"]]
+                self.category_dictionaries = self.build_category_dictionaries(train_data)
+
+                cols_to_encode = self.target_encoding_columns(train_data)
                 self.logger.info(f"\nColumns to encode: {cols_to_encode}")
 
                 # Fit encoders logging
-                self.te = TargetEncoder()
-                self.te.fit(train_data[cols_to_encode], train_data["is_click"].astype(int))
-                self.logger.info("Fitted TargetEncoder")
+                self.te = FactorizedTargetEncoder().fit(train_data, cols_to_encode, train_data["is_click"].astype(int))
+                self.logger.info("Fitted target encoder")
 
                 train_data = self.smooth_ctr(train_data, cols_to_encode, subset="train")
                 self.logger.info("Fitted CTR Smoothing")
 
+                self.cross_ctr(train_data, self.resolve_ctr_crosses(cols_to_encode), subset="train")
+                self.logger.info(f"Fitted cross CTRs: {list(self.cross_ctr_maps)}")
 
-                # Prepare CTR mappings with logging
-                
-            else:
-                self.logger.info("Using pre-fitted preprocessor")
-                self.te = trained_preprocessor.te
+                train_data["DateTime"] = parse_datetime(train_data["DateTime"])
+                self.previous_clicks(train_data, subset="train")
+                self.logger.info("Fitted click history")
 
             # Track each transformation
-            df_test = self.drop_completely_empty(df_test).copy()
+            df_test = owned_copy(self.drop_completely_empty(df_test))
             log_dataset_stats(df_test, "After dropping empty rows")
 
             df_test = self.drop_session_id(df_test)
             log_dataset_stats(df_test, "After dropping sessions")
 
+            df_test = self.deterministic_fill(df_test, mappings=self.fill_mappings)
+            log_dataset_stats(df_test, "After deterministic fill")
+
             if "product_category_1" in df_test.columns and "product_category_2" in df_test.columns:
                 df_test["product_category"] = df_test["product_category_1"].fillna(df_test["product_category_2"])
                 df_test.drop(columns=["product_category_1", "product_category_2"], inplace=True)
@@ -806,10 +1590,7 @@ class DataPreprocessor:
             #df_test = self.decrease_test_user_group_id(df_test)
 
             df_test["is_click"] = -1
-            df_test["DateTime"] = pd.to_datetime(df_test["DateTime"], errors="coerce")
-
-            #df_test = self.deterministic_fill(df_test)
-            #log_dataset_stats(df_test, "After deterministic fill")
+            df_test["DateTime"] = parse_datetime(df_test["DateTime"])
 
             if self.fillna:
                 df_test = self.fill_missing_values(df_test)
@@ -904,6 +1685,180 @@ class DataPreprocessor:
             self.logger.error(f"Error in analyze_feature_importance: {str(e)}")
             return None
 
+    def export_artifact(self) -> dict:
+        """
+        Fitted state of the last `preprocess` run: everything `preprocess_test` needs to
+        transform new data without refitting. Lookup tables are stored as Series, which
+        pickle and load much faster than dicts.
+        """
+        if not getattr(self, "ctr_maps", None) or getattr(self, "te", None) is None:
+            raise ValueError("Preprocessor has not been fitted! Run preprocess on training data first.")
+
+        return {
+            "version": ARTIFACT_VERSION,
+            "options": {
+                "remove_outliers": self.remove_outliers,
+                "fillna": self.fillna,
+                "use_dummies": self.use_dummies,
+                "catb": self.catb,
+                "fill_cat": self.fill_cat,
+                "time_windows": self.time_windows,
+                "ctr_crosses": self.ctr_crosses,
+                "max_cross_categories": self.max_cross_categories,
+            },
+            "ctr_maps": {col: pd.Series(mapping, dtype="float64") for col, mapping in self.ctr_maps.items()},
+            "global_ctrs": dict(self.global_ctrs),
+            "cross_ctr_maps": self.cross_ctr_maps,
+            "te": self.te,
+            "click_history": self.click_history,
+            "fill_mappings": getattr(self, "fill_mappings", {}),
+            "depth_mapping": getattr(self, "depth_mapping", pd.Series(dtype="float64")),
+            "category_dictionaries": getattr(self, "category_dictionaries", {}),
+        }
+
+    def save_artifact(self, artifact_path: Path = None) -> Path:
+        artifact_path = Path(artifact_path) if artifact_path is not None else self.output_path / ARTIFACT_NAME
+        with open(artifact_path, "wb") as f:
+            pickle.dump(self.export_artifact(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.logger.info(f"Saved preprocessor artifact to {artifact_path}")
+        return artifact_path
+
+    def load_artifact(self, artifact_path: Path = None) -> dict:
+        """
+        Restore the fitted state saved by `save_artifact` (ctr_maps, global_ctrs, cross_ctr_maps, te, click_history,
+        fill_mappings, depth_mapping and category_dictionaries) onto this preprocessor.
+        """
+        artifact_path = Path(artifact_path) if artifact_path is not None else self.output_path / ARTIFACT_NAME
+        if not artifact_path.exists():
+            raise FileNotFoundError(f"File not found: {artifact_path}")
+
+        with open(artifact_path, "rb") as f:
+            artifact = pickle.load(f)
+
+        self.apply_artifact(artifact)
+        self.logger.info(f"Loaded preprocessor artifact from: {artifact_path}")
+        return artifact
+
+    def apply_artifact(self, artifact: dict):
+        """
+        Set the fitted state of an artifact returned by `export_artifact` on this preprocessor,
+        together with the options it was fitted with: the transform must match the training one.
+        """
+        if artifact.get("version") != ARTIFACT_VERSION:
+            raise ValueError(f"Unsupported preprocessor artifact version {artifact.get('version')} "
+                             f"(expected {ARTIFACT_VERSION}), rerun preprocess to regenerate it.")
+
+        mismatched = {k: v for k, v in artifact["options"].items() if getattr(self, k) != v}
+        if mismatched:
+            self.logger.warning(f"Using the options the artifact was fitted with instead of this preprocessor's: {mismatched}")
+        for name, value in artifact["options"].items():
+            setattr(self, name, value)
+
+        self.ctr_maps = artifact["ctr_maps"]
+        self.global_ctrs = artifact["global_ctrs"]
+        self.cross_ctr_maps = artifact["cross_ctr_maps"]
+        self.te = artifact["te"]
+        self.click_history = artifact["click_history"]
+        self.fill_mappings = artifact["fill_mappings"]
+        self.depth_mapping = artifact["depth_mapping"]
+        self.category_dictionaries = artifact["category_dictionaries"]
+
+    def report_profile(self):
+        """Log the per-stage profile of the last run, save it as JSON and send it to the callback."""
+        report_path = self.profiler.save_report(self.output_path / PROFILE_REPORT_NAME)
+        self.logger.info(f"Preprocessing profile (saved to {report_path}):\n{self.profiler.summary_table()}")
+
+        # Per-column dtype and memory of the processed training set
+        columns = self.profiler.column_summary("feature_jobs")
+        self.logger.info(f"Processed training set columns ({columns['memory_mb'].sum():.1f} MB):\n"
+                         f"{columns.to_string(index=False, float_format=lambda x: f'{x:.3f}')}")
+
+        summary = self.profiler.summary()
+        self.callback({
+            "preprocess_profile": summary,
+            "preprocess_column_memory": columns,
+            **{f"profile/{row.stage}/wall_s": row.wall_s for row in summary.itertuples()},
+            **{f"profile/{row.stage}/peak_memory_mb": row.peak_memory_mb for row in summary.itertuples()},
+        })
+
+    def output_options(self) -> dict:
+        """The constructor options that change the outputs of `preprocess`."""
+        return {
+            "remove_outliers": self.remove_outliers,
+            "fillna": self.fillna,
+            "use_dummies": self.use_dummies,
+            "catb": self.catb,
+            "use_missing_with_mode": self.use_missing_with_mode,
+            "fill_cat": self.fill_cat,
+            "per_fold_features": self.per_fold_features,
+            "time_windows": self.time_windows,
+            "ctr_crosses": self.ctr_crosses,
+            "max_cross_categories": self.max_cross_categories,
+        }
+
+    def load_and_preprocess(self, csv_path: Path, test_path: Path, chunksize: int = None,
+                            memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB) -> tuple:
+        """
+        `load_data` followed by `preprocess`, served from the preprocessing cache when it is
+        enabled (cache_dir) and the input files, output options and pipeline code are unchanged.
+        A cache hit also restores the fitted state, so `save_data` and `preprocess_test` work as
+        after a full run, and replays the callback payloads of the cached run (folds and processed
+        sets) in their original order. The profile payload of the cached run is not replayed: its
+        timings belong to the run that filled the cache, not to this one.
+        """
+        if self.cache_dir is None:
+            df_train, df_test = self.load_data(csv_path, test_path, chunksize=chunksize, memory_budget_mb=memory_budget_mb)
+            return self.preprocess(df_train, df_test)
+
+        cache = PreprocessCache(self.cache_dir, self.cache_max_size_mb)
+        key = cache.key([csv_path, test_path], self.output_options(), code_version(PIPELINE_SOURCES))
+        cached = cache.get(key)
+        if cached is not None:
+            outputs, artifact, payloads = cached
+            self.apply_artifact(artifact)
+            self.logger.info(f"Loaded preprocessed data from cache entry {key}")
+            for payload in payloads:
+                if "preprocess_profile" not in payload:
+                    self.callback(payload)
+            return outputs
+
+        df_train, df_test = self.load_data(csv_path, test_path, chunksize=chunksize, memory_budget_mb=memory_budget_mb)
+        callback, payloads = self.callback, []
+        self.callback = lambda payload: (payloads.append(payload), callback(payload))
+        try:
+            outputs = self.preprocess(df_train, df_test)
+        finally:
+            self.callback = callback
+        description = {"inputs": [str(csv_path), str(test_path)], **self.output_options()}
+        # One pickle for all three, so the frames the payloads share with the outputs are stored once
+        cache.put(key, (outputs, self.export_artifact(), payloads), description=description)
+        return outputs
+
+    @copy_on_write_method
+    def preprocess_out_of_core(self, csv_path: Path, test_path: Path, shard_dir: Path = None,
+                               n_shards: int = DEFAULT_N_SHARDS, chunksize: int = None,
+                               memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB, scheduler: str = None):
+        """
+        `load_and_preprocess` followed by `save_data` for training data larger than RAM. The raw
+        CSVs are partitioned by user_id hash into `n_shards` on-disk shards under `shard_dir`
+        (default: output_path / "shards") and processed shard by shard, see utils.out_of_core.
+        The outputs are written as Arrow files and indexed folds, the same files as
+        save_data with columnar=True writes after the in-memory path.
+
+        The shard tasks run on n_jobs local processes, or on a dask.distributed cluster when
+        `scheduler` is given: "local" for a LocalCluster of n_jobs processes, otherwise the address
+        of a running scheduler, whose workers must all see `shard_dir` (see utils.executors).
+        """
+        unsupported = [name for name in ["remove_outliers", "use_dummies", "per_fold_features"] if getattr(self, name)]
+        if unsupported:
+            raise ValueError(f"Options not supported in out-of-core mode: {unsupported}")
+
+        store = ShardStore(Path(shard_dir) if shard_dir is not None else self.output_path / "shards", n_shards)
+        self.logger.info(f"Preprocessing {csv_path} out of core in {n_shards} shards under {store.root}")
+        with make_executor(self.n_jobs, scheduler) as executor:
+            OutOfCorePipeline(self, store, executor).run(csv_path, test_path, chunksize=chunksize,
+                                                         memory_budget_mb=memory_budget_mb)
+
     r"""
      ____                  
     / ___|  __ ___   _____ 
@@ -913,6 +1868,32 @@ class DataPreprocessor:
     """
 
     def save_data(self, df_train, X_train, X_test, y_train, y_test, fold_datasets, df_test):
+        self.save_artifact()
+
+        # Folds are written either as one indexed Arrow file per fold, or as 4 files per fold.
+        # Stale indexed folds are removed in the latter case, since ModelTrainer prefers them.
+        fold_store = FoldStore(self.output_path)
+        if self.indexed_folds or self.columnar:
+            fold_store.write(fold_datasets)
+        else:
+            fold_store.clear()
+
+        tables = {
+            "cleaned_data_Maor": df_train,
+            "X_train": X_train,
+            "X_test": X_test,
+            "y_train": y_train,
+            "y_test": y_test,
+            "df_TEST_DoNotTouch": df_test,
+        }
+        if self.columnar:
+            for name, data in tables.items():
+                write_columnar(data, self.output_path / f"{name}{COLUMNAR_SUFFIX}")
+            self.logger.info(f"Saved preprocessed data, train-test split, and folds as Arrow to {self.output_path}")
+            return
+        # Same reasoning as for the folds, the columnar files take precedence when loading
+        clear_columnar(self.output_path, list(tables))
+
         if self.save_as_pickle:
             df_train.to_pickle(self.output_path / "cleaned_data_Maor.pkl")
             X_train.to_pickle(self.output_path / "X_train.pkl")
@@ -921,11 +1902,12 @@ class DataPreprocessor:
             y_test.to_pickle(self.output_path / "y_test.pkl")
             df_test.to_pickle(self.output_path / "df_TEST_DoNotTouch.pkl")
             
-            for i, (X_train_fold, y_train_fold, X_val_fold, y_val_fold) in enumerate(fold_datasets):
-                X_train_fold.to_pickle(self.output_path / f"X_train_fold_{i}.pkl")
-                y_train_fold.to_pickle(self.output_path / f"y_train_fold_{i}.pkl")
-                X_val_fold.to_pickle(self.output_path / f"X_val_fold_{i}.pkl")
-                y_val_fold.to_pickle(self.output_path / f"y_val_fold_{i}.pkl")
+            if not self.indexed_folds:
+                for i, (X_train_fold, y_train_fold, X_val_fold, y_val_fold) in enumerate(fold_datasets):
+                    X_train_fold.to_pickle(self.output_path / f"X_train_fold_{i}.pkl")
+                    y_train_fold.to_pickle(self.output_path / f"y_train_fold_{i}.pkl")
+                    X_val_fold.to_pickle(self.output_path / f"X_val_fold_{i}.pkl")
+                    y_val_fold.to_pickle(self.output_path / f"y_val_fold_{i}.pkl")
 
             self.logger.info(f"Saved preprocessed data, train-test split, and folds as Pickle to {self.output_path}")
         else:
@@ -936,14 +1918,27 @@ class DataPreprocessor:
             y_test.to_csv(self.output_path / "y_test.csv", index=False, header=True)
             df_test.to_csv(self.output_path / "df_TEST_DoNotTouch.csv", index=False)
             
-            for i, (X_train_fold, y_train_fold, X_val_fold, y_val_fold) in enumerate(fold_datasets):
-                X_train_fold.to_csv(self.output_path / f"X_train_fold_{i}.csv", index=False)
-                y_train_fold.to_csv(self.output_path / f"y_train_fold_{i}.csv", index=False, header=True)
-                X_val_fold.to_csv(self.output_path / f"X_val_fold_{i}.csv", index=False)
-                y_val_fold.to_csv(self.output_path / f"y_val_fold_{i}.csv", index=False, header=True)
+            if not self.indexed_folds:
+                for i, (X_train_fold, y_train_fold, X_val_fold, y_val_fold) in enumerate(fold_datasets):
+                    X_train_fold.to_csv(self.output_path / f"X_train_fold_{i}.csv", index=False)
+                    y_train_fold.to_csv(self.output_path / f"y_train_fold_{i}.csv", index=False, header=True)
+                    X_val_fold.to_csv(self.output_path / f"X_val_fold_{i}.csv", index=False)
+                    y_val_fold.to_csv(self.output_path / f"y_val_fold_{i}.csv", index=False, header=True)
 
             self.logger.info(f"Saved preprocessed data, train-test split, and folds as CSV to {self.output_path}")
 
+def _fit_transform_features_job(options: dict, shared_state: dict, *job) -> tuple:
+    """Process pool entry point for DataPreprocessor.run_feature_jobs."""
+    preprocessor = DataPreprocessor(**options)
+    for name, value in shared_state.items():
+        setattr(preprocessor, name, value)
+    with copy_on_write(preprocessor.copy_on_write):
+        train_processed, test_processed, fitted_state = preprocessor.fit_transform_features(*job)
+    # The stage records of the worker are merged into the parent's profiler
+    fitted_state["profile"] = preprocessor.profiler.records
+    return train_processed, test_processed, fitted_state
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--csv_path", type=str, default="data/raw/train_dataset_full.csv", help="Path to the input CSV file")
@@ -955,6 +1950,24 @@ if __name__ == "__main__":
     parser.add_argument("--use-missing-with-mode", action="store_true", help="Flag to fill missing values with mode")
     parser.add_argument("--save-as-pickle", action="store_true", default=True, help="Flag to save as Pickle instead of CSV")
     parser.add_argument("--fill-cat", action="store_true", help="Flag to fill categorical columns")
+    parser.add_argument("--indexed-folds", action="store_true", help="Flag to store folds as one indexed Arrow file per fold")
+    parser.add_argument("--columnar", action="store_true", help="Flag to save compressed Arrow files instead of Pickle or CSV")
+    parser.add_argument("--per-fold-features", action="store_true", help="Flag to recompute label-free features inside every fold")
+    parser.add_argument("--n-jobs", type=int, default=1, help="Number of processes for per-fold feature generation, or for the shard tasks in out-of-core mode (-1 for all cores)")
+    parser.add_argument("--chunksize", type=int, default=None, help="Rows per chunk when reading the raw CSVs")
+    parser.add_argument("--memory-budget-mb", type=float, default=DEFAULT_MEMORY_BUDGET_MB, help="Memory budget for parsing one CSV chunk")
+    parser.add_argument("--cache-dir", type=str, default=str(DEFAULT_CACHE_DIR), help="Directory of the preprocessing cache")
+    parser.add_argument("--cache-max-size-mb", type=float, default=DEFAULT_MAX_SIZE_MB, help="Size limit of the preprocessing cache")
+    parser.add_argument("--no-cache", action="store_true", help="Flag to always rerun preprocessing without the cache")
+    parser.add_argument("--profile", action="store_true", help="Flag to record per-stage timing and memory")
+    parser.add_argument("--ctr-crosses", nargs="*", default=None, help="Column crosses for cross CTRs as col1,col2[,...] or 'all' for every pair")
+    parser.add_argument("--max-cross-categories", type=int, default=DEFAULT_MAX_CROSS_CATEGORIES, help="Distinct keys above which a cross CTR is hashed into buckets")
+    parser.add_argument("--time-windows", nargs="*", default=DEFAULT_TIME_WINDOWS, help="Trailing windows of the session count features, e.g. 1h 24h 7d")
+    parser.add_argument("--copy-on-write", action="store_true", help="Flag to run the pipeline under pandas copy-on-write, copying only the columns each stage changes")
+    parser.add_argument("--out-of-core", action="store_true", help="Flag to preprocess shard by shard on disk, for data larger than RAM")
+    parser.add_argument("--n-shards", type=int, default=DEFAULT_N_SHARDS, help="Number of user_id shards in out-of-core mode")
+    parser.add_argument("--shard-dir", type=str, default=None, help="Directory of the shards in out-of-core mode (default: <output_path>/shards)")
+    parser.add_argument("--scheduler", type=str, default=None, help="Dask scheduler of the shard tasks in out-of-core mode: 'local' or a scheduler address")
     args = parser.parse_args()
 
     preprocessor = DataPreprocessor(
@@ -962,9 +1975,27 @@ if __name__ == "__main__":
         remove_outliers=args.remove_outliers,
         fillna=args.fillna,
         use_dummies=args.use_dummies,
-        save_as_pickle=args.save_as_pickle
+        save_as_pickle=args.save_as_pickle,
+        indexed_folds=args.indexed_folds,
+        n_jobs=args.n_jobs,
+        columnar=args.columnar,
+        per_fold_features=args.per_fold_features,
+        cache_dir=None if args.no_cache else Path(args.cache_dir),
+        cache_max_size_mb=args.cache_max_size_mb,
+        profile=args.profile,
+        time_windows=args.time_windows,
+        ctr_crosses=None if args.ctr_crosses is None else (
+            "all" if args.ctr_crosses == ["all"] else [tuple(cross.split(",")) for cross in args.ctr_crosses]),
+        max_cross_categories=args.max_cross_categories,
+        copy_on_write=args.copy_on_write
     )
 
-    df_train, df_test = preprocessor.load_data(Path(args.csv_path), Path(args.test_path))
-    df_train, X_train, X_test, y_train, y_test, fold_datasets, df_test = preprocessor.preprocess(df_train, df_test)
-    preprocessor.save_data(df_train, X_train, X_test, y_train, y_test, fold_datasets, df_test)
\ No newline at end of file
+    if args.out_of_core:
+        preprocessor.preprocess_out_of_core(
+            Path(args.csv_path), Path(args.test_path), shard_dir=None if args.shard_dir is None else Path(args.shard_dir),
+            n_shards=args.n_shards, chunksize=args.chunksize, memory_budget_mb=args.memory_budget_mb,
+            scheduler=args.scheduler)
+    else:
+        df_train, X_train, X_test, y_train, y_test, fold_datasets, df_test = preprocessor.load_and_preprocess(
+            Path(args.csv_path), Path(args.test_path), chunksize=args.chunksize, memory_budget_mb=args.memory_budget_mb)
+        preprocessor.save_data(df_train, X_train, X_test, y_train, y_test, fold_datasets, df_test)
\ No newline at end of file
@@ -2,6 +2,7 @@ import wandb
 from prefect import task, flow
 from pathlib import Path
 from preprocess import DataPreprocessor
+from utils.preprocess_cache import DEFAULT_CACHE_DIR
 from train import ModelTrainer
 import pandas as pd
 import numpy as np
@@ -65,10 +66,11 @@ def preprocess_data(csv_path: str, output_path: str,test_path:str):
         fillna=True,
         use_dummies=False,
         save_as_pickle=True,
+        cache_dir=DEFAULT_CACHE_DIR,
         callback=wandb_callback
     )
-    df, X_test_1st = preprocessor.load_data(Path(csv_path), Path(test_path))
-    df_clean, X_train, X_test, y_train, y_test, fold_datasets, X_test_1st = preprocessor.preprocess(df, X_test_1st)
+    df_clean, X_train, X_test, y_train, y_test, fold_datasets, X_test_1st = preprocessor.load_and_preprocess(
+        Path(csv_path), Path(test_path))
     preprocessor.save_data(df_clean, X_train, X_test, y_train, y_test, fold_datasets, X_test_1st)
     return df_clean, X_train, X_test, y_train, y_test, fold_datasets, X_test_1st
 
@@ -0,0 +1,14 @@
+import logging
+
+import pytest
+
+from benchmarks.synthetic import write_csv
+
+logging.getLogger("preprocess").setLevel(logging.ERROR)
+
+
+@pytest.fixture(scope="session")
+def raw_csvs(tmp_path_factory):
+    """Paths of a small synthetic raw train CSV and test CSV."""
+    directory = tmp_path_factory.mktemp("raw")
+    return write_csv(directory / "train.csv", 3000, seed=0), write_csv(directory / "test.csv", 750, seed=1000)
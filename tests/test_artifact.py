@@ -0,0 +1,22 @@
+import logging
+
+from preprocess import DataPreprocessor
+from utils.ingest import read_raw_csv
+
+
+def test_serving_uses_the_options_of_the_artifact(raw_csvs, tmp_path, caplog):
+    train_path, test_path = raw_csvs
+    trained = DataPreprocessor(output_path=tmp_path / "train", time_windows=["1h"], save_as_pickle=False)
+    X_test = trained.preprocess(*trained.load_data(train_path, test_path))[-1]
+    artifact_path = trained.save_artifact(tmp_path / "artifact.pkl")
+
+    # Serving with other options than the training run
+    served = DataPreprocessor(output_path=tmp_path / "serve", fillna=True, save_as_pickle=False)
+    with caplog.at_level(logging.WARNING, logger="preprocess"):
+        transformed = served.preprocess_test(read_raw_csv(test_path), artifact_path=artifact_path)
+
+    assert "fitted with" in caplog.text
+    assert served.fillna is False and served.time_windows == ["1h"]
+    assert list(transformed.columns) == list(X_test.columns)
+    # Values left missing by training stay missing when serving
+    assert transformed.isna().sum().sum() > 0
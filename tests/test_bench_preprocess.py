@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from benchmarks import bench_preprocess
+from benchmarks.bench_preprocess import DEFAULT_SIZES, compare, parse_size, run_size
+from preprocess import DataPreprocessor
+
+
+def test_parse_size():
+    assert parse_size("100k") == 100_000
+    assert parse_size("1.5M") == 1_500_000
+    assert parse_size("2500") == 2500
+
+
+def test_default_sizes_fit_a_dev_machine():
+    assert max(parse_size(size) for size in DEFAULT_SIZES) <= 1_000_000
+
+
+def test_run_size_smoke(tmp_path, monkeypatch):
+    monkeypatch.setattr(bench_preprocess, "DATA_DIR", tmp_path)
+    profiled_runs = []
+    preprocess = DataPreprocessor.preprocess
+    monkeypatch.setattr(DataPreprocessor, "preprocess",
+                        lambda self, *args: profiled_runs.append(self.profiler.enabled) or preprocess(self, *args))
+    result = run_size(2000, seed=0, options={"fillna": True})
+    # The timed run is not profiled, the stages come from a second run
+    assert profiled_runs == [False, True]
+    assert result["status"] == "ok" and result["rows"] == 2000
+    assert result["total_wall_s"] > 0
+    assert any(stage["stage"] == "feature_jobs" for stage in result["stages"])
+
+
+@pytest.mark.parametrize("candidate_wall, expected", [(1.1, True), (1.5, False)])
+def test_compare_flags_regressions(tmp_path, capsys, candidate_wall, expected):
+    def results(total_wall):
+        return {"results": [{"rows": 100, "status": "ok", "total_wall_s": total_wall,
+                             "stages": [{"stage": "smooth_ctr[train]", "wall_s": total_wall}]}]}
+
+    baseline, candidate = tmp_path / "baseline.json", tmp_path / "candidate.json"
+    baseline.write_text(json.dumps(results(1.0)))
+    candidate.write_text(json.dumps(results(candidate_wall)))
+    assert compare(baseline, candidate) is expected
+    assert ("REGRESSION" in capsys.readouterr().out) is not expected
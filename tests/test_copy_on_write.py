@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+from benchmarks.check_memory import CEILING_RATIO, preprocess_peak
+from benchmarks.synthetic import write_csv
+from preprocess import DataPreprocessor
+
+
+@pytest.fixture(scope="module")
+def memory_csvs(tmp_path_factory):
+    """Raw CSVs large enough for the peak memory to scale with the rows rather than fixed overheads."""
+    directory = tmp_path_factory.mktemp("memory")
+    return write_csv(directory / "train.csv", 10000, seed=0), write_csv(directory / "test.csv", 2500, seed=1000)
+
+
+def test_copy_on_write_peak_memory_below_ceiling(memory_csvs, tmp_path):
+    copy_on_write = preprocess_peak(*memory_csvs, tmp_path, {"fillna": True, "copy_on_write": True})
+    deep_copy = preprocess_peak(*memory_csvs, tmp_path, {"fillna": True, "copy_on_write": False})
+
+    assert copy_on_write["ratio"] < CEILING_RATIO
+    # Copy-on-write saves about a third of the deep-copy peak
+    assert copy_on_write["peak_mb"] < 0.8 * deep_copy["peak_mb"]
+
+
+@pytest.mark.parametrize("copy_on_write", [False, True])
+def test_preprocess_does_not_modify_its_input_frames(raw_csvs, tmp_path, copy_on_write):
+    preprocessor = DataPreprocessor(output_path=tmp_path, fillna=True, copy_on_write=copy_on_write)
+    df_train, df_test = preprocessor.load_data(*raw_csvs)
+    train_before, test_before = df_train.copy(), df_test.copy()
+
+    outputs = preprocessor.preprocess(df_train, df_test)
+
+    pd.testing.assert_frame_equal(df_train, train_before)
+    pd.testing.assert_frame_equal(df_test, test_before)
+    # A second run on the same frames gives the same outputs
+    pd.testing.assert_frame_equal(preprocessor.preprocess(df_train, df_test)[-1], outputs[-1])
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocess import DataPreprocessor
+
+CROSS = ("user_id", "product")
+NAME = "user_id_x_product"
+
+
+def click_frame(n_rows, seed):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "session_id": np.arange(n_rows, dtype=np.float64),
+        "user_id": rng.integers(0, 300, n_rows).astype(np.float64),
+        "product": rng.choice(list("ABCDEFGHIJ"), n_rows).astype(object),
+        "is_click": (rng.random(n_rows) < 0.1).astype(np.float64),
+    })
+    df.loc[rng.random(n_rows) < 0.02, "user_id"] = np.nan
+    df.loc[rng.random(n_rows) < 0.02, "product"] = np.nan
+    df.loc[rng.random(n_rows) < 0.02, "session_id"] = np.nan
+    return df
+
+
+def concatenated_key(df):
+    """The cross as a single string column, missing when any of its columns is."""
+    key = df["user_id"].astype(str) + "|" + df["product"].astype(str)
+    return key.where(df["user_id"].notna() & df["product"].notna())
+
+
+@pytest.fixture
+def frames():
+    df_train, df_test = click_frame(4000, seed=0), click_frame(1000, seed=1)
+    # Test keys of categories unseen in training
+    df_test.loc[:9, "user_id"] = 1000.0
+    df_test.loc[10:19, "product"] = "Z"
+    return df_train, df_test
+
+
+def test_cross_ctr_equals_smooth_ctr_on_concatenated_key(frames):
+    df_train, df_test = frames
+    crossed = DataPreprocessor()
+    train = crossed.cross_ctr(df_train, [CROSS], subset="train")
+    test = crossed.cross_ctr(df_test, [CROSS], subset="test")
+
+    concatenated = DataPreprocessor()
+    expected_train = concatenated.smooth_ctr(df_train.assign(**{NAME: concatenated_key(df_train)}), [NAME], subset="train")
+    expected_test = concatenated.smooth_ctr(df_test.assign(**{NAME: concatenated_key(df_test)}), [NAME], subset="test")
+
+    assert crossed.cross_ctr_maps[NAME]["n_buckets"] is None
+    pd.testing.assert_series_equal(train[f"{NAME}_ctrS"], expected_train[f"{NAME}_ctrS"])
+    pd.testing.assert_series_equal(test[f"{NAME}_ctrS"], expected_test[f"{NAME}_ctrS"])
+
+
+def test_cross_ctr_hashes_large_crosses_into_buckets(frames):
+    df_train, df_test = frames
+    preprocessor = DataPreprocessor(max_cross_categories=100)
+    train = preprocessor.cross_ctr(df_train, [CROSS], subset="train")
+    test = preprocessor.cross_ctr(df_test, [CROSS], subset="test")
+
+    # 100 buckets are rounded up to 128, and the table has one CTR per bucket
+    cross_map = preprocessor.cross_ctr_maps[NAME]
+    assert cross_map["n_buckets"] == 128
+    assert cross_map["table"].shape == (128,)
+
+    # The bucket CTRs are smooth_ctr on the bucket of every row
+    def buckets(df):
+        keys, valid, _ = preprocessor.cross_keys(df, dict(zip(cross_map["columns"], cross_map["categories"])))
+        return pd.Series(preprocessor.cross_buckets(keys, 128), index=df.index).where(valid)
+
+    expected = DataPreprocessor()
+    expected_train = expected.smooth_ctr(df_train.assign(**{NAME: buckets(df_train)}), [NAME], subset="train")
+    expected_test = expected.smooth_ctr(df_test.assign(**{NAME: buckets(df_test)}), [NAME], subset="test")
+    pd.testing.assert_series_equal(train[f"{NAME}_ctrS"], expected_train[f"{NAME}_ctrS"])
+    pd.testing.assert_series_equal(test[f"{NAME}_ctrS"], expected_test[f"{NAME}_ctrS"])
+
+    # Test rows with an unseen category in the cross get the global CTR
+    assert (test.loc[:19, f"{NAME}_ctrS"] == np.float32(df_train["is_click"].mean())).all()
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocess import SINGLE_VALUE_FILL_COLUMNS, DataPreprocessor
+
+USER_COLUMNS = ["user_group_id", "gender", "age_level", "user_depth"]
+
+
+def user_frame(user_ids, seed):
+    """Rows of users with constant attributes, with some of them missing."""
+    rng = np.random.default_rng(seed)
+    users = pd.DataFrame({
+        "user_id": np.asarray(user_ids, dtype=np.float64),
+        "user_group_id": rng.integers(1, 12, len(user_ids)).astype(np.float64),
+        "gender": rng.choice(["Male", "Female"], len(user_ids)).astype(object),
+        "age_level": rng.integers(1, 6, len(user_ids)).astype(np.float64),
+        "user_depth": rng.integers(1, 4, len(user_ids)).astype(np.float64),
+    })
+    df = users.loc[np.repeat(users.index, 4)].reset_index(drop=True)
+    # The first row of every user misses its attributes, the others are complete
+    df.loc[::4, USER_COLUMNS] = np.nan
+    return df
+
+
+@pytest.fixture
+def frames():
+    df_train = user_frame(range(0, 50), seed=0)
+    # Users 40 to 49 are in both sets, users 100 to 119 only in test
+    df_test = user_frame(list(range(40, 50)) + list(range(100, 120)), seed=1)
+    return df_train, df_test
+
+
+def test_test_only_users_are_filled_from_the_test_rows(frames):
+    df_train, df_test = frames
+    preprocessor = DataPreprocessor()
+    mappings = preprocessor.deterministic_fill_mappings(preprocessor.deterministic_fill(df_train.copy()))
+
+    filled = preprocessor.deterministic_fill(df_test.copy(), mappings=mappings)
+
+    test_only = filled["user_id"] >= 100
+    assert filled.loc[test_only, USER_COLUMNS].notna().all().all()
+    expected = df_test[test_only].groupby("user_id")[USER_COLUMNS].first()
+    pd.testing.assert_frame_equal(filled[test_only].groupby("user_id")[USER_COLUMNS].first(), expected)
+    assert (filled[test_only].groupby("user_id")[USER_COLUMNS].nunique() == 1).all().all()
+
+
+def test_training_tables_take_precedence(frames):
+    df_train, df_test = frames
+    preprocessor = DataPreprocessor()
+    mappings = preprocessor.deterministic_fill_mappings(preprocessor.deterministic_fill(df_train.copy()))
+
+    filled = preprocessor.deterministic_fill(df_test.copy(), mappings=mappings)
+
+    # The missing rows of users seen in training get their training values
+    seen = filled["user_id"] < 100
+    missing = seen & df_test["user_depth"].isna()
+    expected = df_train.groupby("user_id")["user_depth"].first()
+    np.testing.assert_array_equal(filled.loc[missing, "user_depth"], filled.loc[missing, "user_id"].map(expected))
+
+
+def reference_fillna_when_single_unique_value(df, group_col):
+    """The groupby/apply formulation fillna_when_single_unique_value replaced."""
+    df = df.copy()
+    for col in [col for col in SINGLE_VALUE_FILL_COLUMNS if col in df.columns]:
+        group_unique = df.groupby(group_col)[col].apply(lambda x: x.dropna().unique())
+        single_val_map = group_unique.apply(lambda arr: arr[0] if len(arr) == 1 else np.nan).to_dict()
+
+        def _fill_func(row):
+            if pd.isnull(row[col]):
+                possible_val = single_val_map.get(row[group_col], np.nan)
+                if not pd.isnull(possible_val):
+                    return possible_val
+            return row[col]
+
+        df[col] = df.apply(_fill_func, axis=1)
+    return df
+
+
+def test_fillna_when_single_unique_value_matches_reference():
+    rng = np.random.default_rng(0)
+    n_rows = 400
+    df = pd.DataFrame({
+        "product_category_2": rng.choice([1.0, 2.0, 3.0, 4.0, np.nan], n_rows),
+        "user_id": rng.integers(0, 5, n_rows).astype(np.float64),
+        "product": rng.choice(["A", "B"], n_rows).astype(object),
+        "campaign_id": rng.integers(0, 3, n_rows).astype(np.float64),
+        "gender": rng.choice(["Male", "Female"], n_rows).astype(object),
+        "var_1": rng.integers(0, 2, n_rows).astype(np.float64),
+    })
+    # Groups 1 and 2 have a single value in some columns, group 3 in none
+    df.loc[df["product_category_2"] == 1.0, ["product", "campaign_id"]] = ["C", 7.0]
+    df.loc[df["product_category_2"] == 2.0, ["gender", "var_1", "user_id"]] = ["Male", 1.0, 9.0]
+    for col in ["user_id", "product", "campaign_id", "gender", "var_1"]:
+        df.loc[rng.random(n_rows) < 0.2, col] = np.nan
+
+    filled = DataPreprocessor().fillna_when_single_unique_value(df, group_col="product_category_2")
+
+    expected = reference_fillna_when_single_unique_value(df, "product_category_2")
+    assert filled.isna().sum().sum() < df.isna().sum().sum()
+    pd.testing.assert_frame_equal(filled, expected)
@@ -0,0 +1,27 @@
+import pytest
+
+from benchmarks.check_backends import compare_backend
+from utils.executors import DaskExecutor, ProcessExecutor, SerialExecutor, make_executor
+
+OPTIONS = {"fillna": True}
+
+
+@pytest.mark.parametrize("backend", ["serial", "processes", "standin"])
+def test_backend_matches_pandas_path(raw_csvs, tmp_path, backend):
+    assert compare_backend(*raw_csvs, tmp_path, backend, n_workers=2, n_shards=4, options=OPTIONS) == []
+
+
+def test_dask_local_cluster_matches_pandas_path(raw_csvs, tmp_path):
+    pytest.importorskip("dask.distributed")
+    assert compare_backend(*raw_csvs, tmp_path, "dask", n_workers=2, n_shards=4, options=OPTIONS) == []
+
+
+def test_make_executor():
+    assert type(make_executor(1)) is SerialExecutor
+    assert isinstance(make_executor(2), ProcessExecutor) and make_executor(2).n_workers == 2
+
+
+def test_dask_executor_requires_dask_without_client(monkeypatch):
+    monkeypatch.setattr("utils.executors.Client", None)
+    with pytest.raises(ImportError, match="dask"):
+        DaskExecutor()
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.ingest import RAW_SCHEMA, parse_datetime, read_raw_csv
+
+
+def write_raw(path, n_rows=40, session_start=1):
+    df = pd.DataFrame({
+        "session_id": np.arange(session_start, session_start + n_rows, dtype=np.int64),
+        "DateTime": ["2017-07-02 10:00"] * n_rows,
+        "user_id": np.arange(n_rows),
+        "product": ["A", "B"] * (n_rows // 2),
+        "campaign_id": [359520] * n_rows,
+        "is_click": [0, 1] * (n_rows // 2),
+    })
+    df.loc[3, "user_id"] = np.nan
+    df.to_csv(path, index=False)
+    return path
+
+
+def test_dtypes_do_not_depend_on_the_values(tmp_path):
+    # session_ids beyond 2**24 in the later chunks only
+    path = write_raw(tmp_path / "raw.csv", session_start=2 ** 24 - 20)
+    df = read_raw_csv(path, chunksize=10)
+    for col in ["session_id", "user_id", "campaign_id", "is_click"]:
+        assert df[col].dtype == RAW_SCHEMA[col]
+    assert df["session_id"].iloc[-1] == 2 ** 24 + 19
+    assert df["user_id"].isna().sum() == 1
+
+
+def test_float32_column_beyond_exact_range_raises(tmp_path):
+    path = write_raw(tmp_path / "raw.csv")
+    df = pd.read_csv(path)
+    df.loc[5, "campaign_id"] = 2 ** 24 + 1
+    df.to_csv(path, index=False)
+    with pytest.raises(ValueError, match="campaign_id"):
+        read_raw_csv(path, chunksize=10)
+
+
+def test_parse_datetime_infers_other_formats_and_warns(caplog):
+    values = pd.Series(["2017-07-02 10:00", "2017-07-02T11:30:00", "07/03/2017 08:15", "not a date", None],
+                       name="DateTime")
+    with caplog.at_level("WARNING", logger="utils.ingest"):
+        parsed = parse_datetime(values)
+    expected = pd.to_datetime(["2017-07-02 10:00", "2017-07-02 11:30", "2017-07-03 08:15", None, None])
+    pd.testing.assert_series_equal(parsed, pd.Series(expected, name="DateTime"))
+    assert "3 DateTime values" in caplog.text and "1 could not be parsed" in caplog.text
+
+
+def test_parse_datetime_is_silent_on_the_raw_format(caplog):
+    with caplog.at_level("WARNING", logger="utils.ingest"):
+        parsed = parse_datetime(pd.Series(["2017-07-02 10:00", None], name="DateTime"))
+    assert parsed.isna().tolist() == [False, True]
+    assert caplog.text == ""
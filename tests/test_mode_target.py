@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocess import DataPreprocessor
+
+
+def reference_mode_target(df, columns, group_by_col="user_id"):
+    """The groupby/transform formulation mode_target replaced, without its final row shuffle."""
+    result = pd.DataFrame(index=df.index)
+    for column in columns:
+        result[column] = df.groupby(group_by_col, observed=True)[column].transform(
+            lambda x: x.mode().iloc[0] if not x.mode().empty else np.nan)
+    return result
+
+
+@pytest.mark.parametrize("n_users, n_values", [
+    (50, 4),        # dense (group, value) count table
+    (1500, 2000),   # sparse count table: 1500 groups * ~1500 values exceed the dense limit
+])
+def test_mode_target_matches_reference(n_users, n_values):
+    rng = np.random.default_rng(0)
+    n_rows = 3000
+    df = pd.DataFrame({
+        "user_id": rng.integers(0, n_users, n_rows).astype(np.float64),
+        "age_level": rng.integers(0, n_values, n_rows).astype(np.float64),
+        "gender": rng.choice(["Male", "Female"], n_rows).astype(object),
+    }, index=rng.permutation(n_rows))
+    for col in df.columns:
+        df.loc[rng.random(n_rows) < 0.1, col] = np.nan
+    # Users whose values are all missing
+    df.loc[df["user_id"] < 3, "age_level"] = np.nan
+
+    result = DataPreprocessor().mode_target(df, ["age_level", "gender"], "user_id")
+
+    pd.testing.assert_frame_equal(result, reference_mode_target(df, ["age_level", "gender"], "user_id"))
@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+from preprocess import DataPreprocessor
+from utils.preprocess_cache import DEFAULT_CACHE_DIR
+
+
+def test_default_cache_dir_is_under_the_repository():
+    assert DEFAULT_CACHE_DIR.is_absolute()
+    assert (DEFAULT_CACHE_DIR.parent.parent / "preprocess.py").exists()
+
+
+def test_cache_hit_replays_the_callback_payloads(raw_csvs, tmp_path, monkeypatch):
+    def run():
+        payloads = []
+        preprocessor = DataPreprocessor(output_path=tmp_path / "out", fillna=True, profile=True,
+                                        cache_dir=tmp_path / "cache", callback=payloads.append)
+        return preprocessor.load_and_preprocess(*raw_csvs), payloads
+
+    outputs, payloads = run()
+    monkeypatch.setattr(DataPreprocessor, "preprocess", lambda *args: pytest.fail("cache miss"))
+    cached_outputs, cached_payloads = run()
+
+    # Everything but the profile of the run that filled the cache
+    expected = [list(payload) for payload in payloads if "preprocess_profile" not in payload]
+    assert [list(payload) for payload in cached_payloads] == expected
+    assert any("fold_0_train_dataset" in payload for payload in cached_payloads)
+    assert any("preprocess_profile" in payload for payload in payloads)
+    assert not any(key.startswith("profile/") or key == "preprocess_profile"
+                   for payload in cached_payloads for key in payload)
+    pd.testing.assert_frame_equal(cached_payloads[-1]["X_train"], payloads[-2]["X_train"])
+    pd.testing.assert_frame_equal(cached_outputs[1], outputs[1])
@@ -0,0 +1,41 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from utils.profiling import StageProfiler, reset_peak_rss
+
+
+def allocate(mb):
+    array = np.ones(mb * 2 ** 20 // 8)
+    del array
+
+
+@pytest.mark.skipif(not reset_peak_rss(), reason="the peak RSS can only be reset on Linux")
+def test_every_stage_reports_its_own_peak_memory():
+    profiler = StageProfiler(enabled=True)
+    with profiler.stage("large"):
+        allocate(64)
+    with profiler.stage("small"):
+        allocate(16)
+    with profiler.stage("outer"):
+        allocate(8)
+        with profiler.stage("inner"):
+            allocate(32)
+
+    peaks = {record["stage"]: record["peak_memory_mb"] for record in profiler.records}
+    assert peaks["large"] == pytest.approx(64, abs=2)
+    # Below the process peak set by "large", still measured
+    assert peaks["small"] == pytest.approx(16, abs=2)
+    assert peaks["inner"] == pytest.approx(32, abs=2)
+    # The outer stage includes the peak of the inner one, and at most its own 8 MB on top when
+    # the allocator keeps them resident
+    assert 30 <= peaks["outer"] <= 42
+    assert profiler.summary().set_index("stage")["peak_memory_mb"].to_dict() == peaks
+
+
+def test_stages_are_timed_without_allocation_tracing():
+    profiler = StageProfiler(enabled=True)
+    with profiler.stage("stage"):
+        assert not tracemalloc.is_tracing()
+    assert profiler.records[0]["wall_s"] >= 0
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+from preprocess import DataPreprocessor
+from utils.sessions import ClickHistory, SessionIndex
+
+
+def sessions_frame():
+    """Two users with a missing DateTime each and a tied timestamp, plus a row without user_id."""
+    return pd.DataFrame({
+        "user_id": [1.0, 1.0, 1.0, 1.0, 2.0, 2.0, np.nan],
+        "DateTime": pd.to_datetime(["2017-07-02 10:00", None, "2017-07-02 09:00", "2017-07-02 10:00",
+                                    None, "2017-07-02 08:00", "2017-07-02 07:00"]),
+    }, index=[10, 11, 12, 13, 14, 15, 16])
+
+
+def test_session_order_skips_missing_datetime_and_keeps_row_order_on_ties():
+    order = SessionIndex(sessions_frame()).session_order()
+    expected = pd.Series([2.0, np.nan, 1.0, 3.0, np.nan, 1.0, np.nan], index=[10, 11, 12, 13, 14, 15, 16])
+    pd.testing.assert_series_equal(order, expected)
+
+
+def test_first_session_and_hours_since_previous():
+    index = SessionIndex(sessions_frame())
+    pd.testing.assert_series_equal(index.first_session(),
+                                   pd.Series([0, 0, 1, 0, 0, 1, 0], index=[10, 11, 12, 13, 14, 15, 16]))
+    pd.testing.assert_series_equal(index.hours_since_previous(),
+                                   pd.Series([1.0, np.nan, np.nan, 0.0, np.nan, np.nan, np.nan],
+                                             index=[10, 11, 12, 13, 14, 15, 16]))
+
+
+def test_session_order_matches_ranking_of_valid_sessions():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "user_id": rng.integers(0, 50, 2000).astype(float),
+        "DateTime": pd.Timestamp("2017-07-02") + pd.to_timedelta(rng.integers(0, 300, 2000), unit="min"),
+    })
+    df.loc[rng.choice(2000, 100, replace=False), "DateTime"] = pd.NaT
+    df.loc[rng.choice(2000, 50, replace=False), "user_id"] = np.nan
+
+    # Stable ranking of the sessions with a DateTime only (a groupby rank of the whole column would
+    # rank NaT first), ties in row order
+    valid = df.dropna(subset=["DateTime"]).sort_values("DateTime", kind="stable")
+    expected = valid.groupby("user_id")["DateTime"].rank(method="first")
+    pd.testing.assert_series_equal(SessionIndex(df).session_order(), expected.reindex(df.index), check_names=False)
+
+
+def random_sessions(n_rows=2000, seed=0):
+    """Sessions with tied timestamps, missing DateTime and missing user_id."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "user_id": rng.integers(0, 50, n_rows).astype(float),
+        "DateTime": pd.Timestamp("2017-07-02") + pd.to_timedelta(rng.integers(0, 3 * 24 * 60, n_rows) // 30 * 30,
+                                                                 unit="min"),
+        "product": rng.choice(list("ABCDEFGHIJ"), n_rows).astype(object),
+        "is_click": (rng.random(n_rows) < 0.2).astype(float),
+    })
+    df.loc[rng.choice(n_rows, n_rows // 20, replace=False), "DateTime"] = pd.NaT
+    df.loc[rng.choice(n_rows, n_rows // 40, replace=False), "user_id"] = np.nan
+    df.loc[rng.choice(n_rows, n_rows // 10, replace=False), "product"] = np.nan
+    return df
+
+
+def test_cumulative_distinct_matches_per_user_set_loop():
+    df = random_sessions()
+
+    # Per-user loop over the sequence order (time, missing DateTime last, ties in row order),
+    # counting the distinct non-missing values before each row
+    expected = pd.Series(np.nan, index=df.index)
+    ordered = df.dropna(subset=["user_id"]).sort_values(["user_id", "DateTime"], na_position="last", kind="stable")
+    for _, sessions in ordered.groupby("user_id"):
+        seen = set()
+        for row, value in sessions["product"].items():
+            expected[row] = len(seen)
+            if pd.notna(value):
+                seen.add(value)
+
+    pd.testing.assert_series_equal(SessionIndex(df).cumulative_distinct(df["product"]), expected)
+
+
+def naive_window_counts(df, key_col, window):
+    """Per row, the other rows of its key with a DateTime in (t - window, t]; NaN without key or DateTime."""
+    counts = pd.Series(np.nan, index=df.index)
+    timed = df.dropna(subset=[key_col, "DateTime"])
+    for row, key, time in zip(timed.index, timed[key_col], timed["DateTime"]):
+        others = timed[(timed[key_col] == key) & (timed.index != row)]["DateTime"]
+        counts[row] = ((others > time - pd.Timedelta(window)) & (others <= time)).sum()
+    return counts
+
+
+WINDOWS = ["30min", "1h", "24h"]
+
+
+def test_window_counts_match_naive_count():
+    df = random_sessions(n_rows=800)
+    counts = SessionIndex(df).window_counts(WINDOWS)
+    for window in WINDOWS:
+        pd.testing.assert_series_equal(counts[window], naive_window_counts(df, "user_id", window), check_names=False)
+
+
+def test_campaign_window_counts_match_naive_count():
+    df = random_sessions(n_rows=800).rename(columns={"user_id": "campaign_id"})
+    df["product_category"] = 1.0
+    preprocessor = DataPreprocessor(time_windows=WINDOWS)
+    counts = preprocessor.campaign_window_counts(df, preprocessor.campaign_statistics(df)["session_times"])
+    for window in WINDOWS:
+        pd.testing.assert_series_equal(counts[window], naive_window_counts(df, "campaign_id", window), check_names=False)
+
+
+def test_previous_clicks_count_strictly_earlier_clicks():
+    train, test = random_sessions(seed=0), random_sessions(n_rows=500, seed=1)
+    # Users without any training click
+    test.loc[test.index[:20], "user_id"] = 1000.0
+    history = ClickHistory(train["user_id"], train["DateTime"], train["is_click"])
+
+    clicks = train[(train["is_click"] > 0)].dropna(subset=["user_id", "DateTime"])
+    for df in [train, test]:
+        expected = pd.Series(np.nan, index=df.index)
+        timed = df.dropna(subset=["user_id", "DateTime"])
+        for row, user, time in zip(timed.index, timed["user_id"], timed["DateTime"]):
+            expected[row] = ((clicks["user_id"] == user) & (clicks["DateTime"] < time)).sum()
+        pd.testing.assert_series_equal(history.previous_clicks(df["user_id"], df["DateTime"]), expected)
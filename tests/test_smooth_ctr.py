@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.model_selection import StratifiedKFold
+
+from preprocess import DataPreprocessor
+from utils.schema import cast_feature
+
+COLUMNS = ["product", "campaign_id", "user_id"]
+
+
+def reference_smooth_ctr(df, cols_to_encode, alpha=10, cv=5, random_state=100):
+    """The per-fold groupby formulation smooth_ctr replaced: out-of-fold CTRs and the full-data maps."""
+    df = df.copy()
+    ctr_maps = {}
+    for col in cols_to_encode:
+        global_ctr = df['is_click'].mean()
+        oof_ctr = pd.Series(np.nan, index=df.index)
+        skf = StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state)
+        for train_idx, val_idx in skf.split(df, df['is_click']):
+            train_fold, val_fold = df.iloc[train_idx], df.iloc[val_idx]
+            clicks = train_fold.groupby(col)['is_click'].sum()
+            views = train_fold.groupby(col)['session_id'].count()
+            oof_ctr.iloc[val_idx] = val_fold[col].map((clicks + alpha * global_ctr) / (views + alpha))
+        df[f'{col}_ctrS'] = oof_ctr.fillna(global_ctr)
+
+        clicks_all = df.groupby(col)['is_click'].sum()
+        views_all = df.groupby(col)['session_id'].count()
+        ctr_maps[col] = ((clicks_all + alpha * global_ctr) / (views_all + alpha)).to_dict()
+    return df, ctr_maps
+
+
+@pytest.fixture
+def clicks():
+    rng = np.random.default_rng(0)
+    n_rows = 3000
+    df = pd.DataFrame({
+        "session_id": np.arange(n_rows, dtype=np.float64),
+        "product": rng.choice(list("ABCDEFGHIJ"), n_rows).astype(object),
+        "campaign_id": rng.choice([359520.0, 405490.0, 360936.0, 118601.0], n_rows),
+        # Many users with a single row: absent from the training part of their fold
+        "user_id": rng.integers(0, 1500, n_rows).astype(np.float64),
+        "is_click": (rng.random(n_rows) < 0.1).astype(np.float64),
+    })
+    for col in ["product", "user_id", "session_id"]:
+        df.loc[rng.random(n_rows) < 0.03, col] = np.nan
+    # A category whose rows have no session: clicks without views
+    df.loc[df["product"] == "J", "session_id"] = np.nan
+    return df
+
+
+def test_smooth_ctr_matches_reference(clicks):
+    preprocessor = DataPreprocessor()
+    encoded = preprocessor.smooth_ctr(clicks, COLUMNS, subset="train")
+
+    expected, expected_maps = reference_smooth_ctr(clicks, COLUMNS)
+    for col in COLUMNS:
+        name = f"{col}_ctrS"
+        pd.testing.assert_series_equal(encoded[name], cast_feature(expected[name], name))
+        assert preprocessor.ctr_maps[col] == expected_maps[col]
+
+    # The test transform maps with the full-data tables
+    df_test = clicks.sample(500, random_state=1)
+    transformed = preprocessor.smooth_ctr(df_test, COLUMNS, subset="test")
+    for col in COLUMNS:
+        name = f"{col}_ctrS"
+        values = df_test[col].map(expected_maps[col]).fillna(clicks["is_click"].mean())
+        pd.testing.assert_series_equal(transformed[name], cast_feature(values, name).rename(name))
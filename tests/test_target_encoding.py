@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.model_selection import StratifiedKFold
+from sklearn.preprocessing import TargetEncoder
+
+from preprocess import DataPreprocessor
+from utils.target_encoding import FactorizedTargetEncoder
+
+COLUMNS = ["user_id", "product", "webpage_id"]
+
+
+@pytest.fixture
+def clicks():
+    rng = np.random.default_rng(0)
+    n_rows = 5000
+    df = pd.DataFrame({
+        "user_id": rng.integers(0, 1500, n_rows).astype(np.float64),
+        "product": rng.choice(list("ABCDEFGHIJ"), n_rows).astype(object),
+        "webpage_id": rng.choice([13787.0, 60305.0, 28529.0, 6970.0, 45962.0], n_rows),
+    })
+    df.loc[rng.random(n_rows) < 0.02, "user_id"] = np.nan
+    df.loc[rng.random(n_rows) < 0.02, "product"] = np.nan
+    y = pd.Series((rng.random(n_rows) < 0.07 + 0.05 * (df["product"] == "C")).astype(int))
+    return df, y
+
+
+def cv_fold_ids(y):
+    return DataPreprocessor().cv_fold_ids(y)
+
+
+def sklearn_encoder():
+    # The folds of DataPreprocessor.cv_fold_ids
+    cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=100)
+    return TargetEncoder(target_type="binary", smooth="auto", cv=cv)
+
+
+def test_fit_transform_matches_sklearn_cross_fitting(clicks):
+    df, y = clicks
+    expected = sklearn_encoder().fit_transform(df[COLUMNS], y)
+
+    encoded = FactorizedTargetEncoder().fit_transform(df.copy(), COLUMNS, y, cv_fold_ids(y))
+
+    for i, col in enumerate(COLUMNS):
+        np.testing.assert_allclose(encoded[f"{col}_te"], expected[:, i].astype(np.float32), rtol=0, atol=1e-8)
+
+
+def test_transform_matches_sklearn_full_fit(clicks):
+    df, y = clicks
+    sklearn = sklearn_encoder().fit(df[COLUMNS], y)
+    encoder = FactorizedTargetEncoder()
+    encoder.fit_transform(df.copy(), COLUMNS, y, cv_fold_ids(y))
+
+    # Test rows with categories of the training data and unseen ones
+    df_test = pd.concat([df.sample(500, random_state=1), pd.DataFrame({
+        "user_id": [99999.0, np.nan], "product": ["Z", np.nan], "webpage_id": [1.0, 13787.0]})], ignore_index=True)
+    expected = sklearn.transform(df_test[COLUMNS])
+    encoded = encoder.transform(df_test.copy(), COLUMNS)
+
+    for i, col in enumerate(COLUMNS):
+        np.testing.assert_allclose(encoded[f"{col}_te"], expected[:, i].astype(np.float32), rtol=0, atol=1e-8)
+    assert encoded["user_id_te"].iloc[-2] == np.float32(y.mean())
@@ -1,4 +1,3 @@
-<<<<<<< HEAD
 import argparse
 import pandas as pd
 import logging
@@ -19,19 +18,9 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.naive_bayes import ComplementNB, GaussianNB
 from sklearn.ensemble import StackingClassifier
-=======
-from sklearn.ensemble import RandomForestClassifier
-import pickle
-
-class Trainer:
-    def __init__(self):
-        self.model = RandomForestClassifier(random_state=42)
->>>>>>> d9649fbb6f5d050a9eb6d56ee63254a8667d7539
-
-    def train_model(self, X_train, y_train):
-        self.model.fit(X_train, y_train)
+from utils.fold_store import FoldStore
+from utils.columnar import load_processed
 
-<<<<<<< HEAD
 class ModelTrainer:
     def __init__(self, folds_dir: str, test_file: str, model_name: str = "catboost",
                  callback=None, params=None, select_features=False,
@@ -43,6 +32,7 @@ class ModelTrainer:
         self.params = params
         self.select_features = select_features
         self.features_path = features_path
+        self.fold_store = FoldStore(self.folds_dir)
 
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
@@ -54,13 +44,29 @@ class ModelTrainer:
 
     """
 
-    def load_fold_data(self, fold_index):
+    def count_folds(self):
+        if self.fold_store.exists():
+            return self.fold_store.n_folds
+        return len(list(self.folds_dir.glob("X_train_fold_*.pkl")))
+
+    def load_fold_data(self, fold_index, columns=None):
+        if self.fold_store.exists():
+            return self.fold_store.load_fold(fold_index, columns)
         X_train = pd.read_pickle(self.folds_dir / f"X_train_fold_{fold_index}.pkl")
         y_train = pd.read_pickle(self.folds_dir / f"y_train_fold_{fold_index}.pkl").squeeze()
         X_val = pd.read_pickle(self.folds_dir / f"X_val_fold_{fold_index}.pkl")
         y_val = pd.read_pickle(self.folds_dir / f"y_val_fold_{fold_index}.pkl").squeeze()
+        if columns is not None:
+            X_train, X_val = X_train[columns], X_val[columns]
         return X_train, y_train, X_val, y_val
 
+    def load_selected_features(self):
+        """The features saved at features_path, or None to use all of them."""
+        if self.features_path is None:
+            return None
+        with open(self.features_path, 'rb') as f:
+            return pickle.load(f)
+
     def determine_categorical_features(self, X_train: pd.DataFrame):
         cat_features = X_train.select_dtypes(include=['object', 'category']).columns.tolist()
         return cat_features
@@ -89,24 +95,29 @@ class ModelTrainer:
         
 
         # Load and merge all fold datasets
-        X_train_all = []
-        X_val_all = []
-        y_train_all = []
-        y_val_all = []
-        
-        n_folds = len(list(self.folds_dir.glob("X_train_fold_*.pkl")))
-        for fold_index in range(n_folds):
-            X_train_fold, y_train_fold, X_val_fold, y_val_fold = self.load_fold_data(fold_index)
-            X_train_all.append(X_train_fold)
-            X_val_all.append(X_val_fold)
-            y_train_all.append(y_train_fold)
-            y_val_all.append(y_val_fold)
-        
-        # Concatenate all folds
-        X_train = pd.concat(X_train_all, axis=0)
-        X_val = pd.concat(X_val_all, axis=0)
-        y_train = pd.concat(y_train_all, axis=0)
-        y_val = pd.concat(y_val_all, axis=0)
+        if self.fold_store.exists():
+            # Stacked straight from the memory-mapped fold files, without per-fold frames
+            X_train, y_train = self.fold_store.load_concatenated("train")
+            X_val, y_val = self.fold_store.load_concatenated("val")
+        else:
+            X_train_all = []
+            X_val_all = []
+            y_train_all = []
+            y_val_all = []
+
+            n_folds = self.count_folds()
+            for fold_index in range(n_folds):
+                X_train_fold, y_train_fold, X_val_fold, y_val_fold = self.load_fold_data(fold_index)
+                X_train_all.append(X_train_fold)
+                X_val_all.append(X_val_fold)
+                y_train_all.append(y_train_fold)
+                y_val_all.append(y_val_fold)
+
+            # Concatenate all folds
+            X_train = pd.concat(X_train_all, axis=0)
+            X_val = pd.concat(X_val_all, axis=0)
+            y_train = pd.concat(y_train_all, axis=0)
+            y_val = pd.concat(y_val_all, axis=0)
         cat_features = self.determine_categorical_features(X_train)
         # Convert all values in categorical columns that consist of 34546.0 for example to string
         for col in cat_features:
@@ -282,13 +293,15 @@ class ModelTrainer:
 
     def train_and_evaluate(self):
         self.logger.info(f"Loading fold data from: {self.folds_dir}")
-        n_folds = len(list(self.folds_dir.glob("X_train_fold_*.pkl")))
+        n_folds = self.count_folds()
         self.logger.info(f"Detected {n_folds} folds.")
         best_PRAUC = 0
         best_model = None
         fold_scores_val = []
         fold_scores_train = []
         self.chosen_features = None
+        # Only the selected columns are read from the columnar files
+        self.optimized_features = self.load_selected_features()
         if self.params is not None:
             #read params
             with open(self.params, 'r') as f:
@@ -303,15 +316,9 @@ class ModelTrainer:
         for fold_index in range(n_folds):
             self.logger.info(f"Processing fold {fold_index + 1}...")
 
-            X_train_cv, y_train_cv, X_val_cv, y_val_cv = self.load_fold_data(fold_index)
+            X_train_cv, y_train_cv, X_val_cv, y_val_cv = self.load_fold_data(fold_index, self.optimized_features)
 
             if self.features_path is not None:
-
-                with open(self.features_path, 'rb') as f:
-                    self.optimized_features = pickle.load(f)
-                X_train_cv = X_train_cv[self.optimized_features]
-                X_val_cv = X_val_cv[self.optimized_features]
-
                 cat_features = self.determine_categorical_features(X_train_cv)
                 self.logger.warning(f"Selected features: {self.optimized_features}")
 
@@ -326,8 +333,8 @@ class ModelTrainer:
             elif self.model_name == "stacking":
                 X_train_cv = self.fill_missing_with_mode(X_train_cv)
                 X_val_cv = self.fill_missing_with_mode(X_val_cv)
-                X_test = pd.read_pickle(self.folds_dir / "X_test.pkl")
-                y_test = pd.read_pickle(self.folds_dir / "y_test.pkl").squeeze()
+                X_test = load_processed(self.folds_dir, "X_test")
+                y_test = load_processed(self.folds_dir, "y_test").squeeze()
                 X_test = self.fill_missing_with_mode(X_test)
                 print("X_train", X_train_cv.isnull().sum().sum())
                 print("X_val",X_val_cv.columns.isnull().sum().sum())   
@@ -410,18 +417,19 @@ class ModelTrainer:
         
 
         self.logger.info("Predicting on test set using the final model on the REAL TEST (warning: do not touch)")
-        X_test = pd.read_pickle(self.folds_dir / "X_test.pkl")
-        X_train = pd.read_pickle(self.folds_dir / "X_train.pkl")
-        y_train = pd.read_pickle(self.folds_dir / "y_train.pkl").squeeze()
-        y_test = pd.read_pickle(self.folds_dir / "y_test.pkl").squeeze()
+        X_test = load_processed(self.folds_dir, "X_test", self.optimized_features)
+        X_train = load_processed(self.folds_dir, "X_train", self.optimized_features)
+        y_train = load_processed(self.folds_dir, "y_train").squeeze()
+        y_test = load_processed(self.folds_dir, "y_test").squeeze()
         # Merge al validation folds for creating X_val
-        X_val = pd.concat([pd.read_pickle(self.folds_dir / f"X_val_fold_{fold_index}.pkl") for fold_index in range(n_folds)], axis=0)
-        y_val = pd.concat([pd.read_pickle(self.folds_dir / f"y_val_fold_{fold_index}.pkl") for fold_index in range(n_folds)], axis=0)
+        if self.fold_store.exists():
+            X_val, y_val = self.fold_store.load_concatenated("val", self.optimized_features)
+        else:
+            X_val = pd.concat([pd.read_pickle(self.folds_dir / f"X_val_fold_{fold_index}.pkl") for fold_index in range(n_folds)], axis=0)
+            y_val = pd.concat([pd.read_pickle(self.folds_dir / f"y_val_fold_{fold_index}.pkl") for fold_index in range(n_folds)], axis=0)
         
         if self.features_path is not None:
-            X_train = X_train[self.optimized_features]
             X_val = X_val[self.optimized_features]
-            X_test = X_test[self.optimized_features]
         
         self.logger.warning(f"X_train shape: {X_train.shape}")
 
@@ -486,7 +494,7 @@ if __name__ == "__main__":
                             select_features=args.select_features, features_path=args.features_path)
 
     if args.tune:
-        X_train, y_train = pd.read_pickle(trainer.folds_dir / "X_train.pkl"), pd.read_pickle(trainer.folds_dir / "y_train.pkl").squeeze()
+        X_train, y_train = load_processed(trainer.folds_dir, "X_train"), load_processed(trainer.folds_dir, "y_train").squeeze()
         cat_features = trainer.determine_categorical_features(X_train)
         trainer.hyperparameter_tuning(X_train, y_train, cat_features, n_trials=args.n_trials, run_id=args.run_id)
 
@@ -498,16 +506,11 @@ if __name__ == "__main__":
             model_name=args.model_name,
             params=args.params
         )
-        X_train = pd.read_pickle(Path(args.folds_dir) / "X_train.pkl")
-        y_train = pd.read_pickle(Path(args.folds_dir) / "y_train.pkl").squeeze()
+        X_train = load_processed(Path(args.folds_dir), "X_train")
+        y_train = load_processed(Path(args.folds_dir), "y_train").squeeze()
         trainer.feature_selection(X_train, y_train, n_trials=args.n_trials, run_id=args.run_id)
 
     if args.train:
         trainer.train_and_evaluate()
     
     
-=======
-    def save_model(self, file_path):
-        with open(file_path, 'wb') as f:
-            pickle.dump(self.model, f)
->>>>>>> d9649fbb6f5d050a9eb6d56ee63254a8667d7539
@@ -0,0 +1,83 @@
+"""
+Mergeable partial aggregates. Each helper computes the aggregate of one part of a dataset (the
+whole frame in memory, or one on-disk shard in the out-of-core mode) and its `combine_` twin
+merges the aggregates of several parts into the aggregate of the whole dataset. Parts carry
+their original row labels, so "first" always means first in the row order of the dataset.
+"""
+import numpy as np
+import pandas as pd
+
+
+def value_counts(values: pd.Series) -> pd.Series:
+    """Number of rows of every non-missing value of `values`."""
+    counts = values.value_counts(sort=False)
+    # Categorical columns also count their unobserved categories
+    return counts[counts > 0]
+
+
+def group_value_counts(df: pd.DataFrame, group_col: str, value_col: str) -> pd.Series:
+    """Number of rows of every (group, value) pair of `df` with a non-missing group and value."""
+    pairs = df[[group_col, value_col]].dropna()
+    counts = pairs.groupby([group_col, value_col], observed=True).size()
+    return counts[counts > 0]
+
+
+def combine_counts(parts: list) -> pd.Series:
+    """Sum of the counts of several parts, on the union of their values."""
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return pd.Series(dtype="int64")
+    counts = pd.concat(parts)
+    return counts.groupby(level=list(range(counts.index.nlevels)), observed=True).sum()
+
+
+def mode_of_counts(counts: pd.Series, default=np.nan):
+    """Most frequent value of `counts`, the smallest one on ties (like Series.mode); `default` without values."""
+    counts = counts[counts > 0]
+    if counts.empty:
+        return default
+    return counts[counts == counts.max()].index.sort_values()[0]
+
+
+def group_modes(counts: pd.Series) -> pd.Series:
+    """Mode of every group of (group, value) `counts`, the smallest value on ties."""
+    if counts.empty:
+        return pd.Series(dtype="float64")
+    frame = counts.rename("count").reset_index()
+    group_col, value_col = frame.columns[:2]
+    frame = frame.sort_values([group_col, "count", value_col], ascending=[True, False, True], kind="stable")
+    return frame.drop_duplicates(group_col).set_index(group_col)[value_col]
+
+
+def first_rows(df: pd.DataFrame, keys: list, value_col: str) -> pd.DataFrame:
+    """
+    First row of every key (a list of columns) with a non-missing `value_col` and non-missing keys,
+    as a frame of the key and value columns indexed by row label.
+    """
+    rows = df[keys + [value_col]].dropna()
+    return rows[~rows.duplicated(subset=keys)]
+
+
+def combine_first_rows(parts: list, keys: list, value_col: str) -> pd.Series:
+    """`value_col` of the first row of every key over several parts, indexed by key."""
+    rows = pd.concat(parts).sort_index(kind="stable")
+    rows = rows[~rows.duplicated(subset=keys)]
+    return rows.set_index(keys if len(keys) > 1 else keys[0])[value_col]
+
+
+def first_appearance(values: pd.Series, dropna: bool = True) -> pd.Series:
+    """
+    Unique values of `values` with the row label of their first occurrence, as a Series of row
+    labels indexed by value. Missing values are a value of their own unless `dropna`.
+    """
+    codes, uniques = pd.factorize(values.to_numpy(), use_na_sentinel=dropna)
+    valid = codes >= 0
+    _, first = np.unique(codes[valid], return_index=True)
+    return pd.Series(values.index.to_numpy()[np.flatnonzero(valid)[first]], index=pd.Index(uniques))
+
+
+def combine_first_appearance(parts: list) -> pd.Index:
+    """Unique values of several parts in the order of their first occurrence in the dataset."""
+    labels = pd.concat(parts)
+    labels = labels.groupby(level=0, dropna=False, sort=False).min()
+    return labels.sort_values(kind="stable").index
@@ -0,0 +1,61 @@
+import logging
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_SUFFIX = ".feather"
+COMPRESSION = "zstd"
+
+
+def write_columnar(data, path: Path, compression: str = COMPRESSION):
+    """
+    Write a DataFrame or Series as a compressed Arrow (Feather v2) file. Dtypes, the index and
+    the dictionaries of categorical columns are kept in the file's pandas metadata.
+    """
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    table = pa.Table.from_pandas(frame, preserve_index=True)
+    feather.write_feather(table, str(path), compression=compression)
+
+
+def read_columnar(path: Path, columns: list = None):
+    """
+    Read a file written by `write_columnar`, memory-mapped, decoding only `columns` (all by default).
+    A file holding a single column is returned as a Series.
+    """
+    schema = feather.read_table(str(path), columns=[], memory_map=True).schema
+    index_columns = [col for col in schema.pandas_metadata["index_columns"] if isinstance(col, str)]
+    if columns is not None:
+        columns = list(columns) + index_columns
+
+    frame = feather.read_table(str(path), columns=columns, memory_map=True).to_pandas(split_blocks=True)
+    if frame.shape[1] == 1 and len(schema.names) - len(index_columns) == 1:
+        return frame.iloc[:, 0]
+    return frame
+
+
+def load_processed(data_dir: Path, name: str, columns: list = None):
+    """
+    Load the processed table `name` saved by DataPreprocessor.save_data, preferring the columnar
+    file and falling back to the pickle. Only `columns` are read from a columnar file.
+    """
+    columnar_path = Path(data_dir) / f"{name}{COLUMNAR_SUFFIX}"
+    if columnar_path.exists():
+        return read_columnar(columnar_path, columns)
+
+    data = pd.read_pickle(Path(data_dir) / f"{name}.pkl")
+    if columns is not None and isinstance(data, pd.DataFrame):
+        data = data[list(columns)]
+    return data
+
+
+def clear_columnar(data_dir: Path, names: list):
+    """Remove the columnar files of `names`, e.g. before writing the tables in another format."""
+    for name in names:
+        path = Path(data_dir) / f"{name}{COLUMNAR_SUFFIX}"
+        if path.exists():
+            path.unlink()
+            logger.info(f"Removed stale columnar file {path}")
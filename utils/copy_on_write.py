@@ -0,0 +1,41 @@
+"""
+Copy-free execution of the preprocessing pipeline on top of pandas copy-on-write.
+
+Ownership rules: a stage never modifies the frame it is given, it works on `owned_copy(df)`
+and returns that frame; the caller then owns the result and drops its reference to the input.
+Outside copy-on-write `owned_copy` is a deep copy of every column. Under copy-on-write (the
+copy_on_write option of DataPreprocessor) it is a shallow copy, and pandas only copies a column
+when the stage overwrites it while another frame still references it, so every stage allocates
+only the columns it adds or changes.
+
+Frames produced under copy-on-write may share memory with each other (e.g. X_train and df_train):
+modify them under copy-on-write as well, or copy them first.
+"""
+import functools
+from contextlib import nullcontext
+
+import pandas as pd
+
+
+def copy_on_write_enabled() -> bool:
+    """Whether pandas copy-on-write is active."""
+    return pd.get_option("mode.copy_on_write") is True
+
+
+def copy_on_write(enabled: bool = True):
+    """Context running pandas with copy-on-write when `enabled` (a no-op context otherwise)."""
+    return pd.option_context("mode.copy_on_write", True) if enabled else nullcontext()
+
+
+def owned_copy(df):
+    """A copy of `df` the caller may modify without changing `df`: shallow under copy-on-write."""
+    return df.copy(deep=not copy_on_write_enabled())
+
+
+def copy_on_write_method(method):
+    """Run the method `method` under copy-on-write when the copy_on_write option of its instance is set."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with copy_on_write(self.copy_on_write):
+            return method(self, *args, **kwargs)
+    return wrapper
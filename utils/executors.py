@@ -0,0 +1,133 @@
+"""
+Executors of the shard tasks of the out-of-core pipeline (utils.out_of_core).
+
+Every stage of the pipeline runs one task per shard, and the executor decides where:
+    - SerialExecutor: one shard after the other in this process,
+    - ProcessExecutor: on a pool of local processes,
+    - DaskExecutor: on a dask.distributed cluster, either a running scheduler (multi-node) or a
+      LocalCluster of local processes (dask is an optional dependency, see requirements.txt).
+
+Remote tasks run in a DataPreprocessor rebuilt from the worker_options and shared_state of the
+driver's one, and read and write their shards in the ShardStore directly: only the task
+arguments (combined statistics, fitted tables) and results (partial statistics) travel between
+processes. On a multi-node cluster the shard directory must therefore be on storage shared by
+every worker (e.g. NFS), and the repository importable on every worker.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.copy_on_write import copy_on_write
+
+try:
+    from dask.distributed import Client, LocalCluster
+except ImportError:  # dask is optional, only the DaskExecutor needs it
+    Client = LocalCluster = None
+
+LOCAL_SCHEDULER = "local"
+
+
+def run_shard_task(preprocessor_class, options: dict, shared_state: dict, task, store, dataset: str, stage: str,
+                   shard: int, args: tuple):
+    """Worker entry point: `task` on one shard, in a DataPreprocessor rebuilt from the driver's options and state."""
+    preprocessor = preprocessor_class(**options)
+    for name, value in shared_state.items():
+        setattr(preprocessor, name, value)
+    with copy_on_write(preprocessor.copy_on_write):
+        return task(preprocessor, store, dataset, stage, shard, *args)
+
+
+def _run_scattered_shard_task(preprocessor_class, context: tuple, task, store, dataset: str, stage: str, shard: int):
+    options, shared_state, args = context
+    return run_shard_task(preprocessor_class, options, shared_state, task, store, dataset, stage, shard, args)
+
+
+class SerialExecutor:
+    """Runs the shard tasks one after the other in this process, on the driver's DataPreprocessor."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def map(self, task, preprocessor, store, dataset: str, stage: str, shards: list, args: tuple) -> list:
+        return [task(preprocessor, store, dataset, stage, shard, *args) for shard in shards]
+
+
+class ProcessExecutor(SerialExecutor):
+    """Runs the shard tasks on a pool of `n_workers` local processes."""
+
+    def __init__(self, n_workers: int):
+        self.n_workers = n_workers
+        self.pool = None
+
+    def __enter__(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.n_workers)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.pool.shutdown()
+        self.pool = None
+
+    def map(self, task, preprocessor, store, dataset: str, stage: str, shards: list, args: tuple) -> list:
+        options, shared_state = preprocessor.worker_options(), preprocessor.shared_state()
+        futures = [self.pool.submit(run_shard_task, type(preprocessor), options, shared_state, task, store,
+                                    dataset, stage, shard, args) for shard in shards]
+        return [future.result() for future in futures]
+
+
+class DaskExecutor(SerialExecutor):
+    """
+    Runs the shard tasks on a dask.distributed cluster: the scheduler at `address`, or a LocalCluster
+    of `n_workers` processes for address "local". Any object with the submit, scatter and gather
+    methods of a dask Client can be given as `client` instead.
+    """
+
+    def __init__(self, address: str = LOCAL_SCHEDULER, n_workers: int = None, client=None):
+        if client is None and Client is None:
+            raise ImportError("The dask scheduler requires dask.distributed: pip install 'dask[distributed]'")
+        self.address = address
+        self.n_workers = n_workers
+        self.client = client
+        self.cluster = None
+        self.owns_client = client is None
+
+    def __enter__(self):
+        if self.owns_client:
+            if self.address == LOCAL_SCHEDULER:
+                self.cluster = LocalCluster(n_workers=self.n_workers, threads_per_worker=1, processes=True)
+                self.client = Client(self.cluster)
+            else:
+                self.client = Client(self.address)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.owns_client:
+            self.client.close()
+            if self.cluster is not None:
+                self.cluster.close()
+            self.client, self.cluster = None, None
+
+    def map(self, task, preprocessor, store, dataset: str, stage: str, shards: list, args: tuple) -> list:
+        # The arguments are shared by every shard: they are sent to every worker once. hash=False gives
+        # every stage its own key, otherwise a stage scattering the same context as the previous
+        # one would reuse its key and lose the data when the previous future is released
+        [context] = self.client.scatter([(preprocessor.worker_options(), preprocessor.shared_state(), args)],
+                                        broadcast=True, hash=False)
+        futures = [self.client.submit(_run_scattered_shard_task, type(preprocessor), context, task, store,
+                                      dataset, stage, shard, pure=False) for shard in shards]
+        return self.client.gather(futures)
+
+
+def make_executor(n_jobs: int = 1, scheduler: str = None):
+    """
+    The executor of the `n_jobs` and `scheduler` options: local processes when n_jobs != 1 (-1 for
+    all cores), a dask LocalCluster of n_jobs processes for scheduler "local", or the dask scheduler
+    at the address `scheduler` (e.g. "tcp://10.0.0.1:8786").
+    """
+    n_workers = os.cpu_count() if n_jobs == -1 else n_jobs
+    if scheduler is not None:
+        return DaskExecutor(scheduler, n_workers=n_workers)
+    if n_workers == 1:
+        return SerialExecutor()
+    return ProcessExecutor(n_workers)
@@ -0,0 +1,166 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from utils.copy_on_write import owned_copy
+
+
+class FoldStore:
+    """
+    Index-based storage for the cross-validation folds written by DataPreprocessor.save_data.
+
+    Each fold is a single uncompressed Arrow IPC file holding the fold's training rows
+    followed by its validation rows (features plus the target column). A shared
+    `fold_index.npz` keeps the row-index arrays of every fold. Files are memory-mapped
+    on load and the train or validation part of a fold is sliced from the mapped table
+    instead of a full pickle deserialization. The conversion to pandas still copies the
+    columns it converts (categorical columns included).
+
+    Layout under `folds_dir / "folds"`:
+        fold_{i}.arrow   - Columns of fold i, train rows first, then validation rows.
+        fold_index.npz   - train_index_{i} / val_index_{i}: index labels of fold i's rows.
+    """
+
+    def __init__(self, folds_dir: Path, target: str = "is_click"):
+        self.path = Path(folds_dir) / "folds"
+        self.target = target
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def index_path(self) -> Path:
+        return self.path / "fold_index.npz"
+
+    def fold_path(self, fold_index: int) -> Path:
+        return self.path / f"fold_{fold_index}.arrow"
+
+    def exists(self) -> bool:
+        return self.index_path.exists()
+
+    @property
+    def n_folds(self) -> int:
+        with np.load(self.index_path) as index:
+            return sum(1 for name in index.files if name.startswith("train_index_"))
+
+    def write(self, fold_datasets: list):
+        """
+        Write `fold_datasets`, a list of (X_train, y_train, X_val, y_val) tuples as returned
+        by DataPreprocessor.preprocess.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        index_arrays = {}
+
+        for i, (X_train, y_train, X_val, y_val) in enumerate(fold_datasets):
+            X_train, X_val, categories = self._unify_categories(X_train, X_val)
+
+            frame = pd.concat([
+                X_train.assign(**{self.target: y_train}),
+                X_val.assign(**{self.target: y_val}),
+            ])
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            # Categories of each part, restored on load so both parts keep their own dtype
+            table = table.replace_schema_metadata({
+                **(table.schema.metadata or {}),
+                b"fold_categories": json.dumps(categories).encode(),
+            })
+
+            with pa.OSFile(str(self.fold_path(i)), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+            index_arrays[f"train_index_{i}"] = X_train.index.to_numpy()
+            index_arrays[f"val_index_{i}"] = X_val.index.to_numpy()
+
+        np.savez(self.index_path, **index_arrays)
+        self.logger.info(f"Saved {len(fold_datasets)} indexed folds to {self.path}")
+
+    def clear(self):
+        """Remove the stored folds, e.g. before writing folds in another format."""
+        if not self.path.exists():
+            return
+        for file in list(self.path.glob("fold_*.arrow")) + [self.index_path]:
+            file.unlink(missing_ok=True)
+        self.logger.info(f"Removed indexed folds from {self.path}")
+
+    def load_fold(self, fold_index: int, columns: list = None) -> tuple:
+        """
+        Load fold `fold_index` as (X_train, y_train, X_val, y_val), optionally keeping only `columns`.
+        """
+        table, categories = self._read_table(fold_index, columns)
+        train_index, val_index = self._fold_index(fold_index)
+        n_train = len(train_index)
+
+        X_train, y_train = self._to_pandas(table.slice(0, n_train), train_index, categories, part=0)
+        X_val, y_val = self._to_pandas(table.slice(n_train), val_index, categories, part=1)
+        return X_train, y_train, X_val, y_val
+
+    def load_concatenated(self, part: str = "train", columns: list = None) -> tuple:
+        """
+        The `part` ("train" or "val") of every fold stacked into a single (X, y) pair.
+
+        The slices are concatenated on the Arrow side and converted to pandas once,
+        so the stacked frame is the only full-size allocation.
+        """
+        if part not in ("train", "val"):
+            raise ValueError("part must be either 'train' or 'val'")
+
+        tables, indexes = [], []
+        for fold_index in range(self.n_folds):
+            table, _ = self._read_table(fold_index, columns)
+            train_index, val_index = self._fold_index(fold_index)
+            n_train = len(train_index)
+            if part == "train":
+                tables.append(table.slice(0, n_train))
+                indexes.append(train_index)
+            else:
+                tables.append(table.slice(n_train))
+                indexes.append(val_index)
+
+        frame = pa.concat_tables(tables).to_pandas(split_blocks=True)
+        frame.index = pd.Index(np.concatenate(indexes))
+        return frame.drop(columns=[self.target]), frame[self.target]
+
+    def _read_table(self, fold_index: int, columns: list = None) -> tuple:
+        source = pa.memory_map(str(self.fold_path(fold_index)), "r")
+        table = pa.ipc.open_file(source).read_all()
+        categories = json.loads(table.schema.metadata.get(b"fold_categories", b"{}"))
+        if columns is not None:
+            table = table.select([col for col in columns if col != self.target] + [self.target])
+        return table, categories
+
+    def _fold_index(self, fold_index: int) -> tuple:
+        with np.load(self.index_path) as index:
+            return index[f"train_index_{fold_index}"], index[f"val_index_{fold_index}"]
+
+    def _to_pandas(self, table, index, categories, part) -> tuple:
+        frame = table.to_pandas(split_blocks=True)
+        frame.index = pd.Index(index)
+        for col, part_categories in categories.items():
+            if col in frame.columns:
+                frame[col] = frame[col].cat.set_categories(part_categories[part])
+        return frame.drop(columns=[self.target]), frame[self.target]
+
+    def _unify_categories(self, X_train: pd.DataFrame, X_val: pd.DataFrame) -> tuple:
+        """
+        Give categorical columns the same categories in both parts so they fit in one
+        Arrow dictionary. Returns the updated frames and each part's original categories.
+        """
+        categories = {}
+        cat_cols = X_train.select_dtypes(include="category").columns
+        if len(cat_cols) == 0:
+            return X_train, X_val, categories
+
+        X_train, X_val = owned_copy(X_train), owned_copy(X_val)
+        for col in cat_cols:
+            train_categories = X_train[col].cat.categories
+            val_categories = X_val[col].cat.categories if X_val[col].dtype.name == "category" \
+                else pd.Index(X_val[col].dropna().unique())
+            categories[col] = [train_categories.tolist(), val_categories.tolist()]
+
+            union = train_categories.append(val_categories.difference(train_categories, sort=False))
+            X_train[col] = X_train[col].cat.set_categories(union)
+            X_val[col] = X_val[col].astype(pd.CategoricalDtype(union))
+        return X_train, X_val, categories
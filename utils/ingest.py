@@ -0,0 +1,141 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+logger = logging.getLogger(__name__)
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M"
+
+# Dtypes of the known raw columns. Numeric columns hold missing values and stay numpy floats:
+# the pipeline runs numpy kernels (factorize, bincount, hashing, NaN masks) on their arrays,
+# which nullable integer columns would turn into object arrays of pd.NA. The ids that grow with
+# the traffic (session_id, user_id) are float64, exact up to 2**53. The catalog ids and user
+# attributes are float32, exact below 2**24. The dtypes never depend on the data: values a
+# float32 column cannot hold exactly raise an error instead of widening a single chunk.
+# Unknown columns keep the dtype pandas infers.
+RAW_SCHEMA = {
+    "session_id": "float64",
+    "DateTime": "datetime",
+    "user_id": "float64",
+    "product": "category",
+    "campaign_id": "float32",
+    "webpage_id": "float32",
+    "product_category_1": "float32",
+    "product_category_2": "float32",
+    "user_group_id": "float32",
+    "gender": "category",
+    "age_level": "float32",
+    "user_depth": "float32",
+    "city_development_index": "float32",
+    "var_1": "float32",
+    "is_click": "float32",
+}
+
+FLOAT32_EXACT_LIMIT = 2 ** 24
+DEFAULT_MEMORY_BUDGET_MB = 512
+SAMPLE_ROWS = 10_000
+
+
+def parse_datetime(values: pd.Series) -> pd.Series:
+    """
+    Parse `values` with DATETIME_FORMAT. Values in another format are parsed with per-value format
+    inference instead; the values that still cannot be parsed become NaT, with a warning.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    parsed = pd.to_datetime(values, format=DATETIME_FORMAT, errors="coerce")
+    failed = parsed.isna() & values.notna()
+    if failed.any():
+        parsed[failed] = pd.to_datetime(values[failed], format="mixed", errors="coerce")
+        n_missing = int((parsed.isna() & values.notna()).sum())
+        logger.warning(f"{int(failed.sum())} {values.name} values do not match {DATETIME_FORMAT!r}: parsed "
+                       f"{int(failed.sum()) - n_missing} with format inference, {n_missing} could not be parsed")
+    return parsed
+
+
+def apply_schema(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Cast a chunk read with `read_dtypes` to the compact dtypes of RAW_SCHEMA."""
+    for col, dtype in RAW_SCHEMA.items():
+        if col not in chunk.columns:
+            continue
+        if dtype == "datetime":
+            chunk[col] = parse_datetime(chunk[col])
+        elif dtype == "float32":
+            values = chunk[col].to_numpy()
+            if np.nanmax(np.abs(values), initial=0) >= FLOAT32_EXACT_LIMIT:
+                raise ValueError(f"Column {col} has values beyond {FLOAT32_EXACT_LIMIT}, which float32 cannot hold "
+                                 f"exactly: declare it float64 in RAW_SCHEMA")
+            chunk[col] = values.astype(np.float32)
+        elif dtype == "float64":
+            chunk[col] = chunk[col].astype(np.float64)
+        else:
+            chunk[col] = chunk[col].astype(dtype)
+    return chunk
+
+
+def read_dtypes(columns) -> dict:
+    """Parser dtypes for the schema columns present in `columns`."""
+    parse_as = {"float32": "float64", "float64": "float64", "category": "object", "datetime": "object"}
+    return {col: parse_as[RAW_SCHEMA[col]] for col in columns if col in RAW_SCHEMA}
+
+
+def chunk_rows_for_budget(path, memory_budget_mb: float) -> int:
+    """
+    Number of rows per chunk such that a chunk, while being parsed and cast, stays within
+    `memory_budget_mb`. Estimated from the parsed size of a sample of the file.
+    """
+    sample = pd.read_csv(path, nrows=SAMPLE_ROWS)
+    sample = sample.astype(read_dtypes(sample.columns))
+    if len(sample) == 0:
+        return SAMPLE_ROWS
+    # Parsed chunk plus its compact copy while casting
+    bytes_per_row = 2 * sample.memory_usage(deep=True).sum() / len(sample)
+    return max(int(memory_budget_mb * 2 ** 20 / bytes_per_row), 1)
+
+
+def iter_raw_csv(path, chunksize: int = None, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB):
+    """
+    Iterate over `path` in typed chunks of RAW_SCHEMA dtypes.
+
+    Args:
+        path: CSV file with the raw columns.
+        chunksize: Rows per chunk. Derived from `memory_budget_mb` when not given.
+        memory_budget_mb: Memory allowed for parsing a single chunk.
+    """
+    if chunksize is None:
+        chunksize = chunk_rows_for_budget(path, memory_budget_mb)
+    columns = pd.read_csv(path, nrows=0).columns
+
+    reader = pd.read_csv(path, dtype=read_dtypes(columns), chunksize=chunksize)
+    for chunk in reader:
+        yield apply_schema(chunk)
+
+
+def read_raw_csv(path, chunksize: int = None, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB) -> pd.DataFrame:
+    """
+    Read a raw CSV into a single frame with RAW_SCHEMA dtypes, parsing it chunk by chunk so
+    only one chunk is ever held in the wide parser dtypes.
+    """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"File not found: {path}")
+
+    chunks = list(iter_raw_csv(path, chunksize=chunksize, memory_budget_mb=memory_budget_mb))
+    if len(chunks) == 0:
+        return apply_schema(pd.read_csv(path))
+    if len(chunks) == 1:
+        return chunks[0]
+
+    # Chunks see different category sets, unify them so the concatenation stays categorical
+    for col in chunks[0].select_dtypes(include="category").columns:
+        categories = union_categoricals([chunk[col] for chunk in chunks]).categories
+        for chunk in chunks:
+            chunk[col] = chunk[col].cat.set_categories(categories)
+
+    df = pd.concat(chunks, ignore_index=True)
+    logger.info(f"Read {len(df)} rows from {path} in {len(chunks)} chunks "
+                f"({df.memory_usage(deep=True).sum() / 2 ** 20:.1f} MB)")
+    return df
@@ -0,0 +1,560 @@
+"""
+Out-of-core execution of DataPreprocessor.preprocess for training data larger than RAM.
+
+The raw CSVs are partitioned by user_id hash into on-disk shards (utils.shards.ShardStore) and
+every stage runs shard by shard. Stages that only need a user's own rows (per-user session
+features, the per-user modes of fill_missing_values) run on each shard alone. Stages that need
+dataset-wide statistics (deterministic fill tables, campaign aggregates, category dictionaries,
+CTR and target encoder statistics) run as two passes: a map pass computes mergeable partial
+statistics per shard, which are combined in memory, and an apply pass uses the combined
+statistics on every shard. Only per-row vectors of the row labels, targets and fold ids, and
+tables sized by the number of categories, are held in memory.
+
+The tasks are module-level functions `task(preprocessor, store, dataset, stage, shard, *args)`
+run through OutOfCorePipeline.map, which dispatches them to local processes or to a dask cluster
+(utils.executors). Tasks only share state through their arguments, results and the shards.
+"""
+import json
+import logging
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from utils.aggregates import (value_counts, group_value_counts, combine_counts, mode_of_counts, group_modes,
+                              first_appearance, combine_first_appearance)
+from utils.columnar import COLUMNAR_SUFFIX
+from utils.copy_on_write import owned_copy
+from utils.executors import SerialExecutor
+from utils.fold_store import FoldStore
+from utils.ingest import iter_raw_csv, DEFAULT_MEMORY_BUDGET_MB
+from utils.sessions import ClickHistory
+from utils.target_encoding import FactorizedTargetEncoder
+
+# Defaults of DataPreprocessor.smooth_ctr, cross_ctr and add_target_encoding
+CTR_ALPHA = 10
+N_FOLDS = 5
+FINAL_JOB = N_FOLDS
+CAMPAIGN_COLUMNS = ["campaign_id", "product", "product_category", "product_category_1", "product_category_2", "DateTime"]
+CLICK_COLUMNS = ["user_id", "DateTime", "is_click"]
+
+
+def _clean_task(preprocessor, store, dataset, stage, shard, duplicates):
+    """Drop the rows with an already seen session_id; returns the missing values per column."""
+    df = store.read(dataset, stage, shard)
+    df = df[~df.index.isin(duplicates)]
+    store.write(dataset, "clean", shard, df)
+    return df.isna().sum()
+
+
+def _fill_partials_task(preprocessor, store, dataset, stage, shard, names):
+    """Partial lookup table statistics of the deterministic fill rules `names`."""
+    rules = {rule["name"]: rule for rule in preprocessor.deterministic_fill_rules()}
+    df = store.read(dataset, stage, shard)
+    return {name: rules[name]["partial"](df) for name in names}
+
+
+def _fill_lookup_task(preprocessor, store, dataset, stage, shard, name, table):
+    """Fill the shard from the combined table of rule `name`; returns the missing values left in its targets."""
+    rule = {rule["name"]: rule for rule in preprocessor.deterministic_fill_rules()}[name]
+    df = rule["lookup"](store.read(dataset, stage, shard), table)
+    store.write(dataset, stage, shard, df)
+    return {col: int(df[col].isna().sum()) for col in rule["targets"] if col in df.columns}
+
+
+def _prepare_test_task(preprocessor, store, dataset, stage, shard, fill_mappings):
+    """The test steps of preprocess before deterministic_fill; returns the missing values per column."""
+    preprocessor.fill_mappings = fill_mappings
+    df = preprocessor.decrease_test_user_group_id(store.read(dataset, stage, shard))
+    df = preprocessor.replace_test_user_depth_to_training(df)
+    store.write(dataset, "clean", shard, df)
+    return df.isna().sum()
+
+
+def _user_mode_task(preprocessor, store, dataset, stage, shard, target_stage):
+    """
+    prepare_missing_values and the per-user level of hierarchical_mode_fill; returns the
+    (user_group_id, value) counts of the next level.
+    """
+    df = preprocessor.prepare_missing_values(store.read(dataset, stage, shard))
+    columns = preprocessor.hierarchical_fill_columns(df)
+    if columns:
+        df[columns] = preprocessor.mode_target(df, columns, "user_id")
+    store.write(dataset, target_stage, shard, df)
+    return {col: group_value_counts(df, "user_group_id", col) for col in columns}
+
+
+def _mode_fill_task(preprocessor, store, dataset, stage, shard, fill_values):
+    """
+    Fill the missing values of every column of `fill_values`, either a Series of fill values per
+    user_group_id or a single value; returns the value counts and missing values of the columns.
+    """
+    df = store.read(dataset, stage, shard)
+    for col, fill in fill_values.items():
+        if isinstance(fill, pd.Series):
+            fill = df["user_group_id"].map(fill).astype(df[col].dtype)
+        df[col] = df[col].fillna(fill)
+    store.write(dataset, stage, shard, df)
+    return {col: (value_counts(df[col]), int(df[col].isna().sum())) for col in fill_values}, len(df)
+
+
+def _targets_task(preprocessor, store, dataset, stage, shard):
+    """is_click of every row, and the user_id and DateTime of the clicks."""
+    df = store.read(dataset, stage, shard, columns=CLICK_COLUMNS)
+    return df["is_click"], df.loc[df["is_click"] > 0, ["user_id", "DateTime"]]
+
+
+def _category_labels_task(preprocessor, store, dataset, stage, shard):
+    df = store.read(dataset, stage, shard)
+    return preprocessor.category_label_sets(preprocessor.combine_product_categories(df))
+
+
+def _campaign_statistics_task(preprocessor, store, dataset, stage, shard):
+    df = store.read(dataset, stage, shard, columns=CAMPAIGN_COLUMNS)
+    return preprocessor.campaign_statistics(preprocessor.combine_product_categories(df))
+
+
+def _label_free_columns_task(preprocessor, store, dataset, stage, shard, campaign_statistics):
+    """
+    label_free_columns of the shard, stored with campaign_id until the dataset-wide fills;
+    returns the missing values per fill group.
+    """
+    df = preprocessor.combine_product_categories(store.read(dataset, stage, shard))
+    input_cols = df.columns
+    df = preprocessor.label_free_columns(df, campaign_statistics)
+    store.write(dataset, "label_free", shard, df[[col for col in df.columns if col not in input_cols] + ["campaign_id"]])
+    return preprocessor.label_free_missing(df)
+
+
+def _label_free_fill_statistics_task(preprocessor, store, dataset, stage, shard, groups):
+    return preprocessor.label_free_fill_statistics(store.read(dataset, "label_free", shard), groups)
+
+
+def _fill_label_free_task(preprocessor, store, dataset, stage, shard, fill_values):
+    df = preprocessor.fill_label_free_features(store.read(dataset, "label_free", shard), fill_values)
+    store.write(dataset, "label_free", shard, df.drop(columns=["campaign_id"]))
+
+
+def _job_rows(store, stage, shard, job, columns=None):
+    """Training rows of feature job `job` in the shard, and their cross-fitting fold ids."""
+    folds = store.read("train", "folds", shard)
+    in_job = folds[f"inner_{job}"].to_numpy() >= 0
+    df = store.read("train", stage, shard, columns=columns)
+    return df[in_job], folds[f"inner_{job}"].to_numpy()[in_job].astype(np.int64)
+
+
+def _click_history(store, stage, shard, job):
+    """ClickHistory of the training rows of feature job `job` in the shard (users never span shards)."""
+    if shard in store.shards("train", stage):
+        df, _ = _job_rows(store, stage, shard, job, columns=CLICK_COLUMNS)
+    else:
+        df = pd.DataFrame({"user_id": pd.Series(dtype="float64"), "DateTime": pd.Series(dtype="datetime64[ns]"),
+                           "is_click": pd.Series(dtype="float64")})
+    return ClickHistory(df["user_id"], df["DateTime"], df["is_click"])
+
+
+def _job_categories_task(preprocessor, store, dataset, stage, shard, job, cross_columns):
+    """
+    Categories of the job's training rows: unique values of every encoded column (CTR), their
+    first appearance with missing values (target encoder) and without (cross columns).
+    """
+    df, _ = _job_rows(store, stage, shard, job)
+    df = preprocessor.combine_product_categories(df)
+    columns = preprocessor.target_encoding_columns(df)
+    return {
+        "ctr": {col: pd.Series(pd.factorize(df[col])[1]) for col in columns},
+        "te": {col: first_appearance(df[col], dropna=False) for col in columns},
+        "cross": {col: first_appearance(df[col]) for col in cross_columns},
+    }
+
+
+def _job_statistics_task(preprocessor, store, dataset, stage, shard, job, categories):
+    """Per-fold CTR and target encoder statistics of the job's training rows, and the first appearance of cross keys."""
+    df, fold_ids = _job_rows(store, stage, shard, job)
+    df = preprocessor.combine_product_categories(df)
+    clicks = df["is_click"].fillna(0).to_numpy(dtype=np.float64)
+    has_session = df["session_id"].notna().to_numpy()
+    y = df["is_click"].to_numpy(dtype=np.float64)
+
+    statistics = {"ctr": {}, "te": {}, "cross": {}}
+    for col, uniques in categories["ctr"].items():
+        codes = uniques.get_indexer(df[col].to_numpy())
+        statistics["ctr"][col] = preprocessor.code_fold_statistics(codes, len(uniques), fold_ids, N_FOLDS, clicks, has_session)
+    for col, uniques in categories["te"].items():
+        codes = uniques.get_indexer(df[col].to_numpy())
+        statistics["te"][col] = FactorizedTargetEncoder.column_statistics(codes, len(uniques), fold_ids, N_FOLDS, y)
+    for cross in categories["crosses"]:
+        keys, valid, exact = preprocessor.cross_keys(df, {col: categories["cross"][col] for col in cross})
+        statistics["cross"]["_x_".join(cross)] = (first_appearance(pd.Series(keys[valid], index=df.index[valid])), exact)
+    return statistics
+
+
+def _cross_codes(preprocessor, df, cross_map):
+    """Code of every row in a cross_ctr table (bucket or key position), -1 for unknown keys."""
+    keys, valid, _ = preprocessor.cross_keys(df, dict(zip(cross_map["columns"], cross_map["categories"])))
+    codes = np.full(len(df), -1, dtype=np.int64)
+    if cross_map["n_buckets"]:
+        codes[valid] = preprocessor.cross_buckets(keys[valid], cross_map["n_buckets"])
+    else:
+        codes[valid] = cross_map["table"].index.get_indexer(keys[valid])
+    return codes
+
+
+def _cross_statistics_task(preprocessor, store, dataset, stage, shard, job, cross_maps):
+    """Per-fold CTR statistics of every cross of the job's training rows."""
+    df, fold_ids = _job_rows(store, stage, shard, job)
+    df = preprocessor.combine_product_categories(df)
+    clicks = df["is_click"].fillna(0).to_numpy(dtype=np.float64)
+    has_session = df["session_id"].notna().to_numpy()
+    return {
+        name: preprocessor.code_fold_statistics(_cross_codes(preprocessor, df, cross_map),
+                                                cross_map["n_buckets"] or len(cross_map["table"]),
+                                                fold_ids, N_FOLDS, clicks, has_session)
+        for name, cross_map in cross_maps.items()
+    }
+
+
+def _set_fitted_state(preprocessor, fitted, click_history):
+    preprocessor.ctr_maps = fitted["ctr_maps"]
+    preprocessor.global_ctrs = fitted["global_ctrs"]
+    preprocessor.cross_ctr_maps = fitted["cross_ctr_maps"]
+    preprocessor.te = fitted["te"]
+    preprocessor.click_history = click_history
+
+
+def _train_features(preprocessor, df, fold_ids, label_free, fitted):
+    """feature_generation(subset="train") of the job's training rows, with the out-of-fold encodings of the whole job."""
+    df = preprocessor.combine_product_categories(owned_copy(df))
+    columns = preprocessor.target_encoding_columns(df)
+
+    for col in columns:
+        codes = fitted["ctr_categories"][col].get_indexer(df[col].to_numpy())
+        oof_ctr, _ = preprocessor.smoothed_ctrs(codes, fold_ids, *fitted["ctr_statistics"][col], CTR_ALPHA,
+                                                fitted["global_ctrs"][col])
+        preprocessor.add_feature(df, f"{col}_ctrS", oof_ctr)
+    for name, cross_map in fitted["cross_ctr_maps"].items():
+        oof_ctr, _ = preprocessor.smoothed_ctrs(_cross_codes(preprocessor, df, cross_map), fold_ids,
+                                                *fitted["cross_statistics"][name], CTR_ALPHA, cross_map["global_ctr"])
+        preprocessor.add_feature(df, f"{name}_ctrS", oof_ctr)
+    for col in columns:
+        codes = fitted["te"].categories_[col].get_indexer(df[col].to_numpy())
+        df[f"{col}{fitted['te'].suffix}"] = fitted["te_encodings"][col][fold_ids, codes].astype(np.float32)
+
+    history = ClickHistory(df["user_id"], df["DateTime"], df["is_click"])
+    preprocessor.add_feature(df, "user_previous_clicks", history.previous_clicks(df["user_id"], df["DateTime"]).fillna(0))
+    return preprocessor.finish_features(df, "train", label_free)
+
+
+def _categories_of(df):
+    return {col: df[col].cat.categories.tolist() for col in df.select_dtypes(include="category").columns if col != "is_click"}
+
+
+def _job_features_task(preprocessor, store, dataset, stage, shard, job, fitted):
+    """
+    Processed training rows of feature job `job` in the shard and, for the fold jobs, its
+    validation rows. Returns the columns and categories of both parts.
+    """
+    df = store.read("train", stage, shard)
+    folds = store.read("train", "folds", shard)
+    label_free = store.read("train", "label_free", shard)
+    fold_ids = folds[f"inner_{job}"].to_numpy()
+    in_job = fold_ids >= 0
+
+    processed = {}
+    if in_job.any():
+        train_processed = _train_features(preprocessor, df[in_job], fold_ids[in_job].astype(np.int64), label_free, fitted)
+        store.write("jobs", f"job_{job}_train", shard, train_processed)
+        processed["train"] = (list(train_processed.columns), _categories_of(train_processed))
+
+    validation = folds["outer"].to_numpy() == job
+    if job != FINAL_JOB and validation.any():
+        _set_fitted_state(preprocessor, fitted, ClickHistory(df.loc[in_job, "user_id"], df.loc[in_job, "DateTime"],
+                                                             df.loc[in_job, "is_click"]))
+        val_processed = preprocessor.feature_generation(df[validation], subset="test", label_free=label_free)
+        store.write("jobs", f"job_{job}_test", shard, val_processed)
+        processed["test"] = (list(val_processed.columns), _categories_of(val_processed))
+    return processed
+
+
+def _test_features_task(preprocessor, store, dataset, stage, shard, train_stage, fitted):
+    """Processed test rows of the shard, with the encoders fitted on the entire training set."""
+    _set_fitted_state(preprocessor, fitted, _click_history(store, train_stage, shard, FINAL_JOB))
+    test_processed = preprocessor.feature_generation(store.read(dataset, stage, shard), subset="test",
+                                                     label_free=store.read(dataset, "label_free", shard))
+    store.write("jobs", f"job_{FINAL_JOB}_test", shard, test_processed)
+    return {"test": (list(test_processed.columns), _categories_of(test_processed))}
+
+
+class OutOfCorePipeline:
+    """
+    Out-of-core DataPreprocessor.preprocess followed by save_data(columnar=True): the stages of
+    `run` produce the same feature files, folds and artifact as the in-memory path, with the
+    data held in the shards of `store` instead of pandas frames.
+    """
+
+    def __init__(self, preprocessor, store, executor=None):
+        self.preprocessor = preprocessor
+        self.store = store
+        self.executor = executor or SerialExecutor()
+        self.logger = logging.getLogger(__name__)
+
+    def map(self, task, dataset: str, stage: str, *args) -> list:
+        """
+        Results of `task(preprocessor, store, dataset, stage, shard, *args)` on every shard of
+        `stage`, run by the executor (utils.executors) in this process or on workers.
+        """
+        return self.executor.map(task, self.preprocessor, self.store, dataset, stage,
+                                 self.store.shards(dataset, stage), args)
+
+    def run(self, csv_path, test_path, chunksize: int = None, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB):
+        p = self.preprocessor
+        self.partition(csv_path, test_path, chunksize, memory_budget_mb)
+
+        # Fit: fill the training data and build every inference table once from it
+        null_counts = sum(self.map(_clean_task, "train", "parts", self.store.duplicate_labels("train")))
+        self.deterministic_fill("train", "clean", null_counts.to_dict())
+        p.fill_mappings = self.fill_mappings("train", "clean")
+        p.depth_mapping = p.fill_mappings.get("user_depth <- user_id", pd.Series(dtype="float64"))
+        self.store.repartition("train", "clean", "filled")
+
+        # Apply: the test data is filled from the training tables, then from its own rules
+        null_counts = sum(self.map(_prepare_test_task, "test", "parts", p.fill_mappings))
+        self.deterministic_fill("test", "clean", null_counts.to_dict(), mappings=p.fill_mappings)
+        self.store.repartition("test", "clean", "filled")
+        for dataset in ["train", "test"]:
+            self.store.clear(dataset, "parts")
+            self.store.clear(dataset, "clean")
+
+        stage = "filled"
+        if p.fillna:
+            for dataset in ["train", "test"]:
+                self.fill_missing_values(dataset, "filled", "imputed")
+                self.store.clear(dataset, "filled")
+            stage = "imputed"
+
+        labels, y, clicks = self.targets(stage)
+        p.category_dictionaries = p.combine_category_labels(self.map(_category_labels_task, "train", stage))
+        for dataset in ["train", "test"]:
+            self.label_free_features(dataset, stage)
+
+        outer = self.write_folds(stage, labels, y)
+        self.feature_jobs(stage, labels, y, outer)
+        p.click_history = ClickHistory(clicks["user_id"], clicks["DateTime"], pd.Series(1.0, index=clicks.index))
+
+        self.save(labels, outer)
+        for dataset in ["train", "test", "jobs"]:
+            shutil.rmtree(self.store.root / dataset, ignore_errors=True)
+        if not any(self.store.root.iterdir()):
+            self.store.root.rmdir()
+
+    def partition(self, csv_path, test_path, chunksize: int = None, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB):
+        """Partition the raw CSVs, dropping the training rows preprocess drops before deterministic_fill."""
+        p = self.preprocessor
+
+        def clean_train(chunk):
+            chunk = p.drop_completely_empty(chunk)
+            return chunk.dropna(subset=["session_id", "is_click"])
+
+        self.store.partition("train", iter_raw_csv(csv_path, chunksize=chunksize, memory_budget_mb=memory_budget_mb),
+                             filter_rows=clean_train, session_col="session_id")
+        self.store.partition("test", iter_raw_csv(test_path, chunksize=chunksize, memory_budget_mb=memory_budget_mb))
+
+    def deterministic_fill(self, dataset: str, stage: str, null_counts: dict, max_iterations: int = 10,
+                           mappings: dict = None):
+        """
+        deterministic_fill of the whole dataset: every rule run is a partial pass, a combine and a
+        lookup pass, preceded by a lookup pass of the fitted table of the rule in `mappings`.
+        """
+        p = self.preprocessor
+        rules = [rule for rule in p.deterministic_fill_rules() if all(col in null_counts for col in rule["requires"])
+                 and (mappings is None or rule["name"] in mappings)]
+
+        def fill_rule(rule):
+            if mappings is not None:
+                self.map(_fill_lookup_task, dataset, stage, rule["name"], mappings[rule["name"]])
+            table = rule["combine"]([partials[rule["name"]] for partials in
+                                     self.map(_fill_partials_task, dataset, stage, [rule["name"]])])
+            missing = self.map(_fill_lookup_task, dataset, stage, rule["name"], table)
+            return {col: sum(counts[col] for counts in missing) for col in missing[0]} if missing else {}
+
+        p.run_fill_rules(rules, fill_rule, null_counts, max_iterations)
+
+    def fill_mappings(self, dataset: str, stage: str) -> dict:
+        """deterministic_fill_mappings of the filled dataset."""
+        columns = self.store.read(dataset, stage, self.store.shards(dataset, stage)[0]).columns
+        rules = [rule for rule in self.preprocessor.deterministic_fill_rules() if all(col in columns for col in rule["requires"])]
+        partials = self.map(_fill_partials_task, dataset, stage, [rule["name"] for rule in rules])
+        return {rule["name"]: rule["combine"]([part[rule["name"]] for part in partials]).sort_index() for rule in rules}
+
+    def fill_missing_values(self, dataset: str, stage: str, target_stage: str):
+        """
+        fill_missing_values of the whole dataset: the per-user steps on each shard, then the
+        user_group_id and global modes of hierarchical_mode_fill from combined counts.
+        """
+        p = self.preprocessor
+        counts = self.map(_user_mode_task, dataset, stage, target_stage)
+        columns = list(counts[0]) if counts else []
+        if not columns:
+            return
+        self.logger.info(f"Filling missing values of {dataset} with user_id -> user_group_id -> global mode for columns: {columns}")
+
+        group_fills = {col: group_modes(combine_counts([part[col] for part in counts])) for col in columns}
+        results = self.map(_mode_fill_task, dataset, target_stage, group_fills)
+        n_rows = sum(n for _, n in results)
+
+        global_fills = {}
+        for col in columns:
+            n_missing = sum(part[col][1] for part, _ in results)
+            if 0 < n_missing < n_rows:
+                global_fills[col] = mode_of_counts(combine_counts([part[col][0] for part, _ in results]))
+        if global_fills:
+            self.map(_mode_fill_task, dataset, target_stage, global_fills)
+
+    def targets(self, stage: str) -> tuple:
+        """Row labels and is_click of the training rows in row order, and the user_id and DateTime of the clicks."""
+        parts = self.map(_targets_task, "train", stage)
+        y = pd.concat([part[0] for part in parts]).sort_index()
+        clicks = pd.concat([part[1] for part in parts]).sort_index()
+        return y.index.to_numpy(), y, clicks
+
+    def label_free_features(self, dataset: str, stage: str):
+        """label_free_features of the whole dataset, stored as the shards of the "label_free" stage."""
+        p = self.preprocessor
+        statistics = p.combine_campaign_statistics(self.map(_campaign_statistics_task, dataset, stage))
+        missing = self.map(_label_free_columns_task, dataset, stage, statistics)
+        groups = [group for group in p.label_free_fill_columns() if sum(part[group] for part in missing) > 0]
+        fill_statistics = p.combine_label_free_fill_statistics(self.map(_label_free_fill_statistics_task, dataset, stage, groups)) \
+            if groups else {}
+        self.map(_fill_label_free_task, dataset, stage, p.label_free_fill_values(fill_statistics))
+
+    def write_folds(self, stage: str, labels: np.ndarray, y: pd.Series) -> np.ndarray:
+        """
+        Stratified folds of preprocess and the cross-fitting folds of every feature job, stored
+        per shard. Returns the fold of every training row.
+        """
+        p = self.preprocessor
+        outer = p.cv_fold_ids(y, cv=N_FOLDS)
+        folds = pd.DataFrame({"outer": outer.astype(np.int8)}, index=labels)
+        for job in range(N_FOLDS + 1):
+            in_job = outer != job
+            inner = np.full(len(labels), -1, dtype=np.int8)
+            inner[in_job] = p.cv_fold_ids(y[in_job], cv=N_FOLDS)
+            folds[f"inner_{job}"] = inner
+
+        for shard in self.store.shards("train", stage):
+            shard_labels = self.store.read("train", stage, shard, columns=[]).index
+            self.store.write("train", "folds", shard, folds.loc[shard_labels])
+        return outer
+
+    def feature_jobs(self, stage: str, labels: np.ndarray, y: pd.Series, outer: np.ndarray):
+        """
+        Run the 5 fold jobs and the final job of preprocess: fit the encoders on the job's training
+        rows from combined statistics, then write the processed training and test rows per shard.
+        """
+        p = self.preprocessor
+        columns = self.store.read("train", stage, self.store.shards("train", stage)[0]).columns
+        columns = p.target_encoding_columns(p.combine_product_categories(pd.DataFrame(columns=columns)))
+        crosses = p.resolve_ctr_crosses(columns)
+        cross_columns = sorted({col for cross in crosses for col in cross})
+        self.outputs = {}
+
+        for job in range(N_FOLDS + 1):
+            self.logger.info(f"Out-of-core feature job {job + 1}/{N_FOLDS + 1}")
+            fitted = self.fit_job(stage, job, y[outer != job], crosses, cross_columns)
+            outputs = self.map(_job_features_task, "train", stage, job, fitted)
+            if job == FINAL_JOB:
+                outputs += self.map(_test_features_task, "test", stage, stage, fitted)
+                for name in ["ctr_maps", "global_ctrs", "cross_ctr_maps", "te"]:
+                    setattr(p, name, fitted[name])
+            self.outputs[job] = {part: next(output[part] for output in outputs if part in output)
+                                 for part in ["train", "test"]}
+
+    def fit_job(self, stage: str, job: int, y: pd.Series, crosses: list, cross_columns: list) -> dict:
+        """The encoders of feature_generation(subset="train") fitted on the training rows of `job`."""
+        p = self.preprocessor
+        parts = self.map(_job_categories_task, "train", stage, job, cross_columns)
+        categories = {
+            "ctr": {col: pd.Index(pd.factorize(pd.concat([part["ctr"][col] for part in parts], ignore_index=True), sort=True)[1])
+                    for col in parts[0]["ctr"]},
+            "te": {col: combine_first_appearance([part["te"][col] for part in parts]) for col in parts[0]["te"]},
+            "cross": {col: combine_first_appearance([part["cross"][col] for part in parts]) for col in cross_columns},
+            "crosses": crosses,
+        }
+        statistics = self.map(_job_statistics_task, "train", stage, job, categories)
+
+        fitted = {"ctr_categories": categories["ctr"], "ctr_statistics": {}, "ctr_maps": {}, "global_ctrs": {},
+                  "cross_ctr_maps": {}, "cross_statistics": {}, "te_encodings": {}}
+        global_ctr = pd.Series(y.to_numpy()).mean()
+        no_rows = np.zeros(0, dtype=np.int64)
+        for col, uniques in categories["ctr"].items():
+            fitted["ctr_statistics"][col] = tuple(sum(part["ctr"][col][i] for part in statistics) for i in range(3))
+            _, mapping_all = p.smoothed_ctrs(no_rows, no_rows, *fitted["ctr_statistics"][col], CTR_ALPHA, global_ctr)
+            fitted["global_ctrs"][col] = global_ctr
+            fitted["ctr_maps"][col] = pd.Series(mapping_all, index=uniques).to_dict()
+
+        for cross in crosses:
+            name = "_x_".join(cross)
+            uniques = combine_first_appearance([part["cross"][name][0] for part in statistics])
+            exact = statistics[0]["cross"][name][1]
+            n_buckets = None
+            if not exact or len(uniques) > p.max_cross_categories:
+                n_buckets = 2 ** int(np.ceil(np.log2(p.max_cross_categories)))
+                self.logger.info(f"Hashing {len(uniques)} {name} crosses into {n_buckets} buckets")
+            fitted["cross_ctr_maps"][name] = {
+                "columns": cross,
+                "categories": [categories["cross"][col] for col in cross],
+                "n_buckets": n_buckets,
+                "table": np.zeros(n_buckets) if n_buckets else pd.Series(np.zeros(len(uniques)), index=uniques),
+                "global_ctr": global_ctr,
+            }
+        if crosses:
+            cross_statistics = self.map(_cross_statistics_task, "train", stage, job, fitted["cross_ctr_maps"])
+            for name, cross_map in fitted["cross_ctr_maps"].items():
+                fitted["cross_statistics"][name] = tuple(sum(part[name][i] for part in cross_statistics) for i in range(3))
+                _, mapping_all = p.smoothed_ctrs(no_rows, no_rows, *fitted["cross_statistics"][name], CTR_ALPHA, global_ctr)
+                cross_map["table"] = mapping_all if cross_map["n_buckets"] else pd.Series(mapping_all, index=cross_map["table"].index)
+
+        te = FactorizedTargetEncoder()
+        y_values = y.to_numpy(dtype=np.float64)
+        te.target_mean_ = y_values.mean()
+        _, prior, prior_variance = te.fold_priors(p.cv_fold_ids(y, cv=N_FOLDS), y_values)
+        for col, uniques in categories["te"].items():
+            counts, sums, squares = (sum(part["te"][col][i] for part in statistics) for i in range(3))
+            fitted["te_encodings"][col] = te.fit_statistics(col, uniques, counts, sums, squares, np.var(y_values),
+                                                            prior, prior_variance)
+        fitted["te"] = te
+        return fitted
+
+    def save(self, labels: np.ndarray, outer: np.ndarray):
+        """Merge the processed shards into the files of save_data(columnar=True) and save the artifact."""
+        p = self.preprocessor
+        fold_store = FoldStore(p.output_path)
+        fold_store.path.mkdir(parents=True, exist_ok=True)
+        index_arrays = {}
+        for job in range(N_FOLDS):
+            train_columns, train_categories = self.outputs[job]["train"]
+            _, val_categories = self.outputs[job]["test"]
+            features = [col for col in train_columns if col != fold_store.target]
+            categories = {col: [train_categories[col], val_categories[col]] for col in train_categories}
+            self.store.merge([self.store.files("jobs", f"job_{job}_train"), self.store.files("jobs", f"job_{job}_test")],
+                             fold_store.fold_path(job), columns=features + [fold_store.target], compression="uncompressed",
+                             preserve_index=False, schema_metadata={b"fold_categories": json.dumps(categories).encode()})
+            index_arrays[f"train_index_{job}"] = labels[outer != job]
+            index_arrays[f"val_index_{job}"] = labels[outer == job]
+        np.savez(fold_store.index_path, **index_arrays)
+
+        train_columns, _ = self.outputs[FINAL_JOB]["train"]
+        test_columns, _ = self.outputs[FINAL_JOB]["test"]
+        tables = {
+            "cleaned_data_Maor": ("train", train_columns),
+            "X_train": ("train", [col for col in train_columns if col != "is_click"]),
+            "y_train": ("train", ["is_click"]),
+            "X_test": ("test", [col for col in test_columns if col != "is_click"]),
+            "y_test": ("test", ["is_click"]),
+            "df_TEST_DoNotTouch": ("test", test_columns),
+        }
+        for name, (part, columns) in tables.items():
+            self.store.merge([self.store.files("jobs", f"job_{FINAL_JOB}_{part}")],
+                             p.output_path / f"{name}{COLUMNAR_SUFFIX}", columns=columns)
+        self.logger.info(f"Saved preprocessed data, train-test split, and folds as Arrow to {p.output_path}")
+        p.save_artifact()
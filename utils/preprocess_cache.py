@@ -0,0 +1,150 @@
+import argparse
+import hashlib
+import json
+import logging
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Under the repository root, wherever the CLI or the tasks are launched from
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent.parent / "data" / "cache"
+DEFAULT_MAX_SIZE_MB = 4096
+OUTPUTS_NAME = "outputs.pkl"
+META_NAME = "meta.json"
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path: Path) -> str:
+    """Content hash of a file, read in blocks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def code_version(source_files) -> str:
+    """Hash of the pipeline source files, so any code change invalidates the cached outputs."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(Path(p) for p in source_files):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class PreprocessCache:
+    """
+    Content-addressed on-disk cache of DataPreprocessor outputs.
+
+    An entry is keyed by the hash of the input files, the options that affect the outputs and
+    the pipeline code version. Each entry is a directory under `cache_dir` holding the pickled
+    outputs and a meta.json with their size and last use. Least recently used entries are
+    evicted once the cache exceeds `max_size_mb`.
+    """
+
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_size_mb: float = DEFAULT_MAX_SIZE_MB):
+        self.cache_dir = Path(cache_dir)
+        self.max_size_mb = max_size_mb
+
+    def key(self, input_paths, options: dict, version: str) -> str:
+        digest = hashlib.sha256()
+        for path in input_paths:
+            digest.update(file_digest(Path(path)).encode())
+        digest.update(json.dumps(options, sort_keys=True, default=str).encode())
+        digest.update(version.encode())
+        return digest.hexdigest()[:32]
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def get(self, key: str):
+        """The cached outputs of `key`, or None on a miss."""
+        entry = self.entry_path(key)
+        if not (entry / META_NAME).exists():
+            return None
+
+        with open(entry / OUTPUTS_NAME, "rb") as f:
+            outputs = pickle.load(f)
+        meta = self._read_meta(entry)
+        meta["last_used"] = time.time()
+        self._write_meta(entry, meta)
+        logger.info(f"Preprocessing cache hit: {key}")
+        return outputs
+
+    def put(self, key: str, outputs, description: dict = None) -> Path:
+        """Store `outputs` under `key`, then evict down to the size limit."""
+        entry = self.entry_path(key)
+        entry.mkdir(parents=True, exist_ok=True)
+        with open(entry / OUTPUTS_NAME, "wb") as f:
+            pickle.dump(outputs, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        now = time.time()
+        size = sum(path.stat().st_size for path in entry.iterdir())
+        # meta.json is written last: an entry without it is incomplete and treated as a miss
+        self._write_meta(entry, {"key": key, "size": size, "created": now, "last_used": now,
+                                 "description": description or {}})
+        logger.info(f"Stored preprocessing outputs in cache entry {key} ({size / 2 ** 20:.1f} MB)")
+        self.evict(keep=key)
+        return entry
+
+    def entries(self) -> list:
+        """Meta data of every complete entry, least recently used first."""
+        if not self.cache_dir.exists():
+            return []
+        entries = [self._read_meta(entry) for entry in self.cache_dir.iterdir() if (entry / META_NAME).exists()]
+        return sorted(entries, key=lambda meta: meta["last_used"])
+
+    def size(self) -> int:
+        return sum(meta["size"] for meta in self.entries())
+
+    def evict(self, keep: str = None):
+        """Remove least recently used entries until the cache fits in max_size_mb."""
+        entries = self.entries()
+        total = sum(meta["size"] for meta in entries)
+        for meta in entries:
+            if total <= self.max_size_mb * 2 ** 20:
+                break
+            if meta["key"] == keep:
+                continue
+            self.remove(meta["key"])
+            total -= meta["size"]
+
+    def remove(self, key: str):
+        shutil.rmtree(self.entry_path(key), ignore_errors=True)
+        logger.info(f"Removed cache entry {key}")
+
+    def purge(self, keys=None):
+        """Remove the given entries, or all of them."""
+        for key in keys or [meta["key"] for meta in self.entries()]:
+            self.remove(key)
+
+    def _read_meta(self, entry: Path) -> dict:
+        with open(entry / META_NAME) as f:
+            return json.load(f)
+
+    def _write_meta(self, entry: Path, meta: dict):
+        with open(entry / META_NAME, "w") as f:
+            json.dump(meta, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or purge the preprocessing cache.")
+    parser.add_argument("command", choices=["list", "purge"], help="List the entries or remove them")
+    parser.add_argument("keys", nargs="*", help="Entries to purge (all when omitted)")
+    parser.add_argument("--cache-dir", type=str, default=str(DEFAULT_CACHE_DIR), help="Cache directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    cache = PreprocessCache(Path(args.cache_dir))
+
+    if args.command == "list":
+        entries = cache.entries()
+        for meta in reversed(entries):
+            last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(meta["last_used"]))
+            print(f"{meta['key']}  {meta['size'] / 2 ** 20:9.1f} MB  last used {last_used}  {meta['description']}")
+        print(f"{len(entries)} entries, {cache.size() / 2 ** 20:.1f} MB in {cache.cache_dir}")
+    else:
+        cache.purge(args.keys)
@@ -0,0 +1,208 @@
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, peak RSS is then not reported
+    resource = None
+
+PROC_STATUS = Path("/proc/self/status")
+PROC_CLEAR_REFS = Path("/proc/self/clear_refs")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (ru_maxrss is in KB on Linux)."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb() -> tuple:
+    """
+    (current, high-water) resident set size of this process in MB, from /proc on Linux. Elsewhere
+    both are the process peak RSS (None on Windows).
+    """
+    try:
+        status = PROC_STATUS.read_text()
+    except OSError:
+        return peak_rss_mb(), peak_rss_mb()
+    values = dict(line.split(":", 1) for line in status.splitlines() if line.startswith(("VmRSS", "VmHWM")))
+    return int(values["VmRSS"].split()[0]) / 1024, int(values["VmHWM"].split()[0]) / 1024
+
+
+def reset_peak_rss() -> bool:
+    """Reset the high-water RSS of this process to its current RSS (Linux only); False when not possible."""
+    try:
+        PROC_CLEAR_REFS.write_text("5")
+    except OSError:
+        return False
+    return True
+
+
+def frame_memory_mb(df):
+    if df is None:
+        return None
+    memory = df.memory_usage(deep=True)
+    return (memory.sum() if isinstance(memory, pd.Series) else memory) / 2 ** 20
+
+
+def column_memory(df) -> dict:
+    """Dtype and memory in MB of every column of the frame `df` ({} for anything else)."""
+    if not isinstance(df, pd.DataFrame):
+        return {}
+    memory = df.memory_usage(deep=True, index=False) / 2 ** 20
+    return {col: {"dtype": str(dtype), "memory_mb": memory[col]} for col, dtype in df.dtypes.items()}
+
+
+class _StageRecord:
+    """Collects the output frame of a profiled stage."""
+
+    def __init__(self):
+        self.df_out = None
+
+    def output(self, df):
+        self.df_out = df
+        return df
+
+
+class _NullRecord:
+    def output(self, df):
+        return df
+
+
+_NULL_RECORD = _NullRecord()
+
+
+@contextmanager
+def _null_stage():
+    yield _NULL_RECORD
+
+
+class StageProfiler:
+    """
+    Per-stage timing and memory instrumentation of the preprocessing pipeline.
+
+    Each stage records wall time, CPU time, its own peak memory, the number of rows, the memory of
+    its input and output frames and the dtype and memory of every output column:
+
+        with profiler.stage("smooth_ctr[train]", df) as stage:
+            df = stage.output(self.smooth_ctr(df, ...))
+
+    The peak memory of a stage is the highest resident set size of the process while it runs
+    above the RSS when it starts. On Linux the kernel's RSS high-water mark is reset when a stage
+    starts, so every stage reports its own transient peak, not only the stages that raise the
+    process peak. Elsewhere the reset is not available and a stage reports how much it raised
+    the process peak RSS. Nothing traces allocations, so the timings are not slowed down.
+
+    When disabled, `stage` hands out a shared no-op context and nothing is measured.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.records = []
+        # [RSS at start, peak RSS so far] of the running stages, outermost first
+        self._open_stages = []
+
+    def stage(self, name: str, df_in=None):
+        if not self.enabled:
+            return _null_stage()
+        return self._profile_stage(name, df_in)
+
+    @contextmanager
+    def _profile_stage(self, name, df_in):
+        record = _StageRecord()
+        rows_in, memory_in = (len(df_in), frame_memory_mb(df_in)) if df_in is not None else (None, None)
+        memory = self._enter_memory()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+        try:
+            yield record
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            peak_memory = self._exit_memory(memory)
+        df_out = record.df_out
+        columns_out = column_memory(df_out)
+        self.records.append({
+            "stage": name,
+            "wall_s": wall,
+            "cpu_s": cpu,
+            "peak_memory_mb": peak_memory,
+            "rows_in": rows_in,
+            "rows_out": len(df_out) if df_out is not None else None,
+            "memory_in_mb": memory_in,
+            "memory_out_mb": frame_memory_mb(df_out),
+            "columns_out": columns_out,
+        })
+
+    def _enter_memory(self) -> list:
+        current, peak = rss_mb()
+        if current is None:
+            return None
+        # The peak is reset for the new stage: the running stages keep what they reached so far
+        for memory in self._open_stages:
+            memory[1] = max(memory[1], peak)
+        # Without the reset, the stage reports how much it raises the process peak
+        memory = [current, current] if reset_peak_rss() else [peak, peak]
+        self._open_stages.append(memory)
+        return memory
+
+    def _exit_memory(self, memory: list) -> float:
+        """Peak RSS of the stage of `memory` above its RSS at the start, in MB."""
+        if memory is None:
+            return None
+        peak = max(memory[1], rss_mb()[1])
+        self._open_stages.pop()
+        return peak - memory[0]
+
+    def extend(self, records: list):
+        """Add records measured elsewhere, e.g. in a worker process."""
+        self.records.extend(records)
+
+    def reset(self):
+        self.records = []
+
+    def summary(self) -> pd.DataFrame:
+        """Records aggregated per stage, slowest stage first."""
+        columns = ["stage", "calls", "wall_s", "cpu_s", "peak_memory_mb", "rows_in", "rows_out",
+                   "memory_in_mb", "memory_out_mb"]
+        if not self.records:
+            return pd.DataFrame(columns=columns)
+        records = pd.DataFrame(self.records)
+        summary = records.groupby("stage", sort=False).agg(
+            calls=("wall_s", "size"),
+            wall_s=("wall_s", "sum"),
+            cpu_s=("cpu_s", "sum"),
+            peak_memory_mb=("peak_memory_mb", "max"),
+            rows_in=("rows_in", "max"),
+            rows_out=("rows_out", "max"),
+            memory_in_mb=("memory_in_mb", "max"),
+            memory_out_mb=("memory_out_mb", "max"),
+        ).reset_index()
+        return summary.sort_values("wall_s", ascending=False, ignore_index=True)[columns]
+
+    def column_summary(self, stage: str) -> pd.DataFrame:
+        """Dtype and memory of the output columns of the last `stage` record, largest first."""
+        records = [record for record in self.records if record["stage"] == stage and record.get("columns_out")]
+        if not records:
+            return pd.DataFrame(columns=["column", "dtype", "memory_mb"])
+        columns = pd.DataFrame.from_dict(records[-1]["columns_out"], orient="index")
+        columns = columns.rename_axis("column").reset_index()
+        return columns.sort_values("memory_mb", ascending=False, ignore_index=True)
+
+    def report(self) -> dict:
+        """Structured report: the raw stage records and the per-stage summary."""
+        summary = self.summary().astype(object).where(lambda x: x.notna(), None)
+        return {"stages": self.records, "summary": summary.to_dict(orient="records")}
+
+    def summary_table(self) -> str:
+        return self.summary().to_string(index=False, float_format=lambda x: f"{x:.3f}")
+
+    def save_report(self, path: Path) -> Path:
+        path = Path(path)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2, default=float)
+        return path
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+# Categories of part_of_day, in the alphabetical order its mode ties have always been broken by
+PART_OF_DAY_DTYPE = pd.CategoricalDtype(["afternoon", "evening", "morning", "night"])
+
+# Compact dtypes of the columns generated by DataPreprocessor; the raw columns are covered by
+# utils.ingest.RAW_SCHEMA. Integer dtypes only apply to columns without missing values.
+FEATURE_SCHEMA = {
+    "Hour": "int8",
+    "Minute": "int8",
+    "weekday": "int8",
+    "part_of_day": PART_OF_DAY_DTYPE,
+    "user_total_num_of_sessions": "int32",
+    "user_session_order": "int32",
+    "is_first_session": "int8",
+    "user_num_of_days_in_webpage": "int8",
+    "campaign_num_of_products": "int16",
+    "campaign_num_of_product_categories": "int16",
+    "hours_since_last_session": "float32",
+    "campaign_duration_hours": "float32",
+    "user_previous_clicks": "int32",
+}
+
+# Families of generated columns, matched on the column name
+FEATURE_SCHEMA_PREFIXES = {
+    "user_distinct_": "int32",
+    "user_sessions_last_": "int32",
+    "campaign_sessions_last_": "int32",
+}
+FEATURE_SCHEMA_SUFFIXES = {
+    "_ctrS": "float32",
+    "_te": "float32",
+}
+
+
+def feature_dtype(col: str):
+    """Registered compact dtype of the generated column `col`, or None if it has none."""
+    if col in FEATURE_SCHEMA:
+        return FEATURE_SCHEMA[col]
+    for prefix, dtype in FEATURE_SCHEMA_PREFIXES.items():
+        if col.startswith(prefix):
+            return dtype
+    for suffix, dtype in FEATURE_SCHEMA_SUFFIXES.items():
+        if col.endswith(suffix):
+            return dtype
+    return None
+
+
+def cast_feature(values, col: str):
+    """
+    `values` of the generated column `col` in its registered dtype. Integer columns that still
+    hold missing values are kept as float32 until they are filled.
+    """
+    dtype = feature_dtype(col)
+    if dtype is None:
+        return values
+    if isinstance(dtype, str) and dtype.startswith("int") and pd.isna(values).any():
+        dtype = "float32"
+    if isinstance(values, (pd.Series, pd.Index)):
+        return values.astype(dtype)
+    if isinstance(dtype, pd.CategoricalDtype):
+        return pd.Categorical(values, dtype=dtype)
+    return np.asarray(values).astype(dtype)
+
+
+def apply_feature_schema(df: pd.DataFrame, columns=None) -> pd.DataFrame:
+    """Cast the registered columns of `df` (or of `columns`) to their compact dtypes, in place."""
+    for col in df.columns if columns is None else columns:
+        if feature_dtype(col) is not None and df[col].dtype != feature_dtype(col):
+            df[col] = cast_feature(df[col], col)
+    return df
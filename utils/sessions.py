@@ -0,0 +1,175 @@
+import numpy as np
+import pandas as pd
+
+
+class SessionIndex:
+    """
+    One stable (user_id, DateTime) sort of a frame, shared by every per-user sequential feature.
+
+    Rows are ordered by user, then by time with missing DateTime last, ties keeping their
+    original row order. Rows without a user_id are placed after all users and never belong
+    to a user sequence. Features are computed on the sorted arrays and scattered back to
+    the original row order with `to_rows`.
+
+    Attributes:
+        permutation  - Row positions of the frame in sorted order.
+        user_codes   - Factorized user_id of the sorted rows (-1 for missing user_id).
+        times        - DateTime of the sorted rows as int64 nanoseconds.
+        has_user     - Sorted rows with a user_id.
+        has_time     - Sorted rows with a user_id and a DateTime.
+        group_start  - Sorted rows that open a new user sequence.
+        position     - 0-based position of each sorted row inside its user sequence.
+
+    Any grouping column can stand in for user_id, e.g. SessionIndex(df, user_col="campaign_id").
+    """
+
+    def __init__(self, df: pd.DataFrame, user_col: str = "user_id", time_col: str = "DateTime"):
+        user_codes, _ = pd.factorize(df[user_col])
+        datetimes = df[time_col].to_numpy(dtype="datetime64[ns]")
+        valid_time = ~np.isnat(datetimes)
+        times = datetimes.view(np.int64)
+
+        # lexsort is stable and sorts by the last key first
+        sort_users = np.where(user_codes < 0, np.iinfo(np.int64).max, user_codes)
+        sort_times = np.where(valid_time, times, np.iinfo(np.int64).max)
+        self.permutation = np.lexsort((sort_times, sort_users))
+        self.n_rows = len(df)
+        self.index = df.index
+
+        self.user_codes = user_codes[self.permutation]
+        self.times = times[self.permutation]
+        self.has_user = self.user_codes >= 0
+        self.has_time = valid_time[self.permutation] & self.has_user
+
+        self.group_start = np.ones(self.n_rows, dtype=bool)
+        self.group_start[1:] = self.user_codes[1:] != self.user_codes[:-1]
+        starts = np.flatnonzero(self.group_start)
+        self.position = np.arange(self.n_rows) - np.repeat(starts, np.diff(np.append(starts, self.n_rows)))
+
+    def to_rows(self, sorted_values: np.ndarray, name: str = None) -> pd.Series:
+        """Scatter values computed in sorted order back to the original row order."""
+        values = np.empty_like(sorted_values)
+        values[self.permutation] = sorted_values
+        return pd.Series(values, index=self.index, name=name)
+
+    def session_order(self) -> pd.Series:
+        """1-based order of each session in its user's sequence; NaN without user_id or DateTime."""
+        return self.to_rows(np.where(self.has_time, self.position + 1.0, np.nan))
+
+    def first_session(self) -> pd.Series:
+        """1 for the sessions at the user's earliest DateTime, 0 otherwise."""
+        # The earliest DateTime of a user sits at the start of its sequence
+        first_times = self.times[self.group_start]
+        first_valid = self.has_time[self.group_start]
+        group_ids = np.cumsum(self.group_start) - 1
+        is_first = self.has_time & first_valid[group_ids] & (self.times == first_times[group_ids])
+        return self.to_rows(is_first.astype("int"))
+
+    def hours_since_previous(self) -> pd.Series:
+        """Hours since the user's previous session; NaN for the first session or missing values."""
+        gap = np.full(self.n_rows, np.nan)
+        previous_valid = np.zeros(self.n_rows, dtype=bool)
+        previous_valid[1:] = self.has_time[:-1] & ~self.group_start[1:]
+        both_valid = self.has_time & previous_valid
+
+        diffs = np.diff(self.times, prepend=self.times[:1])[both_valid]
+        gap[both_valid] = pd.Series(diffs.view("timedelta64[ns]")).dt.total_seconds().to_numpy() / 3600
+        return self.to_rows(gap)
+
+    def session_counts(self, session_ids: pd.Series) -> pd.Series:
+        """Number of distinct session ids per user, broadcast to the user's rows."""
+        session_codes, uniques = pd.factorize(session_ids.to_numpy()[self.permutation])
+        n_users = self.user_codes.max() + 1 if self.has_user.any() else 0
+
+        valid = self.has_user & (session_codes >= 0)
+        pairs = np.unique(self.user_codes[valid].astype(np.int64) * max(len(uniques), 1) + session_codes[valid])
+        counts = np.bincount(pairs // max(len(uniques), 1), minlength=n_users)
+
+        if self.has_user.all():
+            return self.to_rows(counts[self.user_codes])
+        return self.to_rows(np.where(self.has_user, counts[self.user_codes], np.nan))
+
+    def cumulative_distinct(self, values: pd.Series) -> pd.Series:
+        """
+        Number of distinct non-missing `values` in the user's earlier sessions (before the row,
+        in sequence order); NaN without user_id.
+        """
+        value_codes, uniques = pd.factorize(values.to_numpy()[self.permutation])
+        n_values = max(len(uniques), 1)
+
+        # First occurrence of every (user, value) pair in sequence order
+        valid = self.has_user & (value_codes >= 0)
+        positions = np.flatnonzero(valid)
+        pairs = self.user_codes[valid].astype(np.int64) * n_values + value_codes[valid]
+        _, first = np.unique(pairs, return_index=True)
+        is_first = np.zeros(self.n_rows, dtype=np.int64)
+        is_first[positions[first]] = 1
+
+        # Grouped cumulative sum, excluding the row itself
+        cumulative = np.cumsum(is_first)
+        group_ids = np.cumsum(self.group_start) - 1
+        before_group = (cumulative - is_first)[self.group_start]
+        distinct = (cumulative - is_first - before_group[group_ids]).astype(float)
+        return self.to_rows(np.where(self.has_user, distinct, np.nan))
+
+    def window_counts(self, windows: list) -> pd.DataFrame:
+        """
+        Number of the user's other sessions in the trailing window (t - window, t] of each row, for
+        every window of `windows` (pandas Timedelta strings such as "1h", "24h", "7d"). Columns are
+        named after the windows; NaN without user_id or DateTime.
+
+        Sessions are keyed by user_code * (n_times + 1) + time rank, which is non-decreasing over
+        the sorted rows, so every window costs two np.searchsorted calls on the shared keys.
+        """
+        timed = np.flatnonzero(self.has_time)
+        unique_times = np.unique(self.times[timed])
+        stride = np.int64(len(unique_times) + 1)
+        user_offsets = self.user_codes[timed].astype(np.int64) * stride
+        keys = user_offsets + np.searchsorted(unique_times, self.times[timed])
+        upper = np.searchsorted(keys, keys, side="right")
+
+        counts = {}
+        for window in windows:
+            start = self.times[timed] - pd.Timedelta(window).value
+            lower = np.searchsorted(keys, user_offsets + np.searchsorted(unique_times, start, side="right"))
+            window_count = np.full(self.n_rows, np.nan)
+            # The row itself is inside its window
+            window_count[timed] = upper - lower - 1
+            counts[window] = self.to_rows(window_count)
+        return pd.DataFrame(counts, index=self.index)
+
+
+class ClickHistory:
+    """
+    Click times per user of a training frame, to count the clicks a user had before a given time
+    in that frame. The same history serves the training rows themselves and any later frame
+    (validation fold, test set).
+
+    Clicks are stored sorted by (user, time) under the key user_rank * (n_times + 1) + time rank,
+    so a query is two np.searchsorted calls per row.
+    """
+
+    def __init__(self, user_ids: pd.Series, times: pd.Series, clicks: pd.Series):
+        datetimes = times.to_numpy(dtype="datetime64[ns]")
+        clicked = (clicks.to_numpy(dtype=float, na_value=0) > 0) & user_ids.notna().to_numpy() & ~np.isnat(datetimes)
+
+        self.users = np.unique(user_ids.to_numpy(dtype=float)[clicked])
+        self.times = np.unique(datetimes[clicked].view(np.int64))
+        self.stride = np.int64(len(self.times) + 1)
+        user_ranks = np.searchsorted(self.users, user_ids.to_numpy(dtype=float)[clicked])
+        time_ranks = np.searchsorted(self.times, datetimes[clicked].view(np.int64))
+        self.keys = np.sort(user_ranks.astype(np.int64) * self.stride + time_ranks)
+
+    def previous_clicks(self, user_ids: pd.Series, times: pd.Series) -> pd.Series:
+        """Number of the user's clicks strictly before each row's DateTime; NaN without user_id or DateTime."""
+        users = user_ids.to_numpy(dtype=float)
+        datetimes = times.to_numpy(dtype="datetime64[ns]")
+        user_ranks = np.searchsorted(self.users, users)
+        known = user_ranks < len(self.users)
+        known[known] = self.users[user_ranks[known]] == users[known]
+
+        offsets = user_ranks.astype(np.int64) * self.stride
+        before = np.searchsorted(self.keys, offsets + np.searchsorted(self.times, datetimes.view(np.int64)))
+        counts = np.where(known, before - np.searchsorted(self.keys, offsets), 0).astype(float)
+        counts[np.isnan(users) | np.isnat(datetimes)] = np.nan
+        return pd.Series(counts, index=user_ids.index)
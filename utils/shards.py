@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from utils.columnar import write_columnar
+
+DEFAULT_N_SHARDS = 16
+DEFAULT_MERGE_ROWS = 1_000_000
+# user_id of the rows without one once fill_missing_values has run; they share that user's shard
+MISSING_USER_ID = -1
+SHARD_SUFFIX = ".arrow"
+
+
+def shard_of(user_ids: pd.Series, n_shards: int) -> np.ndarray:
+    """Shard of every row, from a hash of its user_id. Rows without user_id go with user MISSING_USER_ID."""
+    values = user_ids.to_numpy(dtype=np.float64, na_value=np.nan)
+    values = np.where(np.isnan(values), MISSING_USER_ID, values)
+    return (pd.util.hash_array(values) % np.uint64(n_shards)).astype(np.int64)
+
+
+def _labelled(df: pd.DataFrame) -> pd.DataFrame:
+    """`df` with its row labels as a plain Index, so they are always stored as a column."""
+    if isinstance(df.index, pd.RangeIndex):
+        return df.set_axis(pd.Index(df.index.to_numpy()), axis=0)
+    return df
+
+
+class ShardStore:
+    """
+    On-disk partitions of the train and test data by user_id hash, for the out-of-core mode of
+    DataPreprocessor (utils.out_of_core). Every row of a user lands in the same shard, so per-user
+    features are computed shard by shard, and every shard is small enough to be processed in memory.
+
+    Shards keep the row labels of the in-memory path (the position of the row in its CSV) as
+    their index, in increasing order. Every pipeline stage writes the shards under its own name,
+    and the final tables are merged back in row order with `merge`.
+
+    Layout under `root`:
+        {dataset}/parts/shard_{i}/part_{j}.arrow   - Rows of CSV chunk j that hash to shard i.
+        {dataset}/sessions/bucket_{i}/part_{j}.arrow - session_id of the rows of chunk j, by session hash.
+        {dataset}/{stage}/shard_{i}.arrow          - Shard i after the pipeline stage `stage`.
+    """
+
+    def __init__(self, root: Path, n_shards: int = DEFAULT_N_SHARDS):
+        self.root = Path(root)
+        self.n_shards = n_shards
+        self.categories = {}
+        self.dtypes = {}
+        self.logger = logging.getLogger(__name__)
+
+    def stage_path(self, dataset: str, stage: str) -> Path:
+        return self.root / dataset / stage
+
+    def shard_path(self, dataset: str, stage: str, shard: int) -> Path:
+        return self.stage_path(dataset, stage) / f"shard_{shard:04d}{SHARD_SUFFIX}"
+
+    def shards(self, dataset: str, stage: str) -> list:
+        """Shards of `stage` that hold rows ("parts" for the partitioned raw rows)."""
+        if stage == "parts":
+            return [shard for shard in range(self.n_shards)
+                    if (self.stage_path(dataset, "parts") / f"shard_{shard:04d}").exists()]
+        return [shard for shard in range(self.n_shards) if self.shard_path(dataset, stage, shard).exists()]
+
+    def files(self, dataset: str, stage: str) -> list:
+        return [self.shard_path(dataset, stage, shard) for shard in self.shards(dataset, stage)]
+
+    def partition(self, dataset: str, chunks, filter_rows=None, session_col: str = None) -> int:
+        """
+        Write the typed CSV `chunks` (see utils.ingest.iter_raw_csv) into per-shard part files.
+        `filter_rows(chunk)` drops rows before partitioning. With `session_col`, the column is also
+        bucketed by its own hash for `duplicate_labels`. Returns the number of rows kept.
+
+        The categories of categorical columns are accumulated in chunk order, which gives the
+        same categories as read_raw_csv's union_categoricals over all chunks.
+        """
+        shutil.rmtree(self.root / dataset, ignore_errors=True)
+        categories, dtypes = {}, {}
+        n_rows = 0
+
+        for part, chunk in enumerate(chunks):
+            for col in chunk.columns:
+                dtype = chunk[col].dtype
+                if isinstance(dtype, pd.CategoricalDtype):
+                    known = categories.get(col, pd.Index([], dtype=dtype.categories.dtype))
+                    categories[col] = known.append(dtype.categories.difference(known, sort=False))
+                    dtypes[col] = "category"
+                elif col not in dtypes:
+                    dtypes[col] = dtype
+                elif dtypes[col] != dtype:
+                    dtypes[col] = np.result_type(dtypes[col], dtype)
+
+            if filter_rows is not None:
+                chunk = filter_rows(chunk)
+            n_rows += len(chunk)
+            chunk = _labelled(chunk)
+
+            shards = shard_of(chunk["user_id"], self.n_shards)
+            for shard in np.unique(shards):
+                self._write_part(self.stage_path(dataset, "parts") / f"shard_{shard:04d}", part, chunk[shards == shard])
+            if session_col is not None:
+                sessions = chunk[session_col]
+                buckets = pd.util.hash_array(sessions.to_numpy(dtype=np.float64)) % np.uint64(self.n_shards)
+                for bucket in np.unique(buckets):
+                    self._write_part(self.stage_path(dataset, "sessions") / f"bucket_{bucket:04d}", part,
+                                     sessions[buckets == bucket])
+
+        self.categories[dataset] = categories
+        self.dtypes[dataset] = {col: str(dtype) for col, dtype in dtypes.items()}
+        self.logger.info(f"Partitioned {n_rows} {dataset} rows into {self.n_shards} shards under {self.root / dataset}")
+        return n_rows
+
+    def _write_part(self, directory: Path, part: int, data):
+        directory.mkdir(parents=True, exist_ok=True)
+        write_columnar(data, directory / f"part_{part:06d}{SHARD_SUFFIX}", compression="uncompressed")
+
+    def duplicate_labels(self, dataset: str) -> pd.Index:
+        """
+        Row labels of the rows whose session_id already appeared on an earlier row (the rows
+        drop_duplicates(subset=["session_id"]) removes), found bucket by bucket.
+        """
+        duplicates = []
+        for bucket in sorted(self.stage_path(dataset, "sessions").glob("bucket_*")):
+            sessions = pd.concat([self._read_file(path) for path in sorted(bucket.glob("part_*"))]).iloc[:, 0]
+            sessions = sessions.sort_index(kind="stable")
+            duplicates.append(sessions.index[sessions.duplicated().to_numpy()])
+        shutil.rmtree(self.stage_path(dataset, "sessions"), ignore_errors=True)
+        return pd.Index(np.concatenate(duplicates)) if duplicates else pd.Index([], dtype="int64")
+
+    def read(self, dataset: str, stage: str, shard: int, columns: list = None) -> pd.DataFrame:
+        """
+        Shard `shard` of `dataset` after `stage`. The partitioned raw rows ("parts") are read with
+        the categories and dtypes of the whole dataset.
+        """
+        if stage != "parts":
+            return self._read_file(self.shard_path(dataset, stage, shard), columns)
+
+        paths = sorted((self.stage_path(dataset, "parts") / f"shard_{shard:04d}").glob(f"part_*{SHARD_SUFFIX}"))
+        frame = pd.concat([self._read_file(path, columns) for path in paths])
+        for col, categories in self.categories.get(dataset, {}).items():
+            if col in frame.columns:
+                frame[col] = frame[col].astype(pd.CategoricalDtype(categories))
+        for col, dtype in self.dtypes.get(dataset, {}).items():
+            if col in frame.columns and dtype != "category" and str(frame[col].dtype) != dtype:
+                frame[col] = frame[col].astype(dtype)
+        return frame
+
+    def write(self, dataset: str, stage: str, shard: int, df: pd.DataFrame):
+        """
+        Write shard `shard` of `stage`, replacing the file atomically so a stage can be rewritten
+        while its previous version is still memory-mapped. Shards without rows are not stored.
+        """
+        path = self.shard_path(dataset, stage, shard)
+        if len(df) == 0:
+            path.unlink(missing_ok=True)
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Uncompressed, shards are rewritten by every stage
+        write_columnar(_labelled(df), path.with_suffix(".tmp"), compression="uncompressed")
+        os.replace(path.with_suffix(".tmp"), path)
+
+    def repartition(self, dataset: str, stage: str, target_stage: str):
+        """
+        Move the rows of `stage` whose user_id changed since partitioning (e.g. filled by
+        deterministic_fill) to the shard of their new user_id, as `target_stage`.
+        """
+        moved = self.stage_path(dataset, f"{target_stage}.moved")
+        for shard in self.shards(dataset, stage):
+            df = self.read(dataset, stage, shard)
+            shards = shard_of(df["user_id"], self.n_shards)
+            for target in np.unique(shards[shards != shard]):
+                self._write_part(moved / f"shard_{target:04d}", shard, df[shards == target])
+            self.write(dataset, target_stage, shard, df[shards == shard])
+
+        for directory in sorted(moved.glob("shard_*")) if moved.exists() else []:
+            shard = int(directory.name.split("_")[1])
+            parts = [self._read_file(path) for path in sorted(directory.glob(f"part_*{SHARD_SUFFIX}"))]
+            if self.shard_path(dataset, target_stage, shard).exists():
+                parts.append(self.read(dataset, target_stage, shard))
+            self.write(dataset, target_stage, shard, pd.concat(parts).sort_index(kind="stable"))
+        shutil.rmtree(moved, ignore_errors=True)
+
+    def clear(self, dataset: str, stage: str):
+        """Remove the shards of `stage`, once no later stage reads them."""
+        shutil.rmtree(self.stage_path(dataset, stage), ignore_errors=True)
+
+    def _read_file(self, path: Path, columns: list = None) -> pd.DataFrame:
+        table = feather.read_table(str(path), memory_map=True)
+        if columns is not None:
+            index_columns = [col for col in table.schema.pandas_metadata["index_columns"] if isinstance(col, str)]
+            table = table.select([col for col in columns if col in table.column_names] + index_columns)
+        frame = table.to_pandas()
+        # Arrow reads the missing values of object columns back as None, pandas holds them as NaN
+        for col in frame.select_dtypes(include="object").columns:
+            if frame[col].isna().any():
+                frame[col] = frame[col].where(frame[col].notna(), np.nan)
+        return frame
+
+    def merge(self, sources: list, path: Path, columns: list = None, compression: str = "zstd",
+              preserve_index: bool = True, schema_metadata: dict = None, block_rows: int = DEFAULT_MERGE_ROWS) -> int:
+        """
+        Merge shard files, each sorted by row label, into a single Arrow IPC (Feather v2) file at
+        `path` in increasing row label order. `sources` is a list of lists of files: the files of
+        each inner list are merged together, and the inner lists are written one after the other
+        (e.g. the training rows of a fold, then its validation rows). Only `columns` are kept, in
+        that order, when given.
+
+        Only the row labels of the files are held in memory; the rows are copied in blocks of
+        `block_rows` from the memory-mapped files. Returns the number of rows written.
+        """
+        n_rows = 0
+        writer, sink, schema = None, None, None
+        try:
+            for files in sources:
+                tables = [feather.read_table(str(file), memory_map=True) for file in files]
+                if not tables:
+                    continue
+                index_column = tables[0].schema.pandas_metadata["index_columns"][0]
+                selected = (columns if columns is not None else
+                            [name for name in tables[0].column_names if name != index_column]) + [index_column]
+                tables = [table.select(selected) for table in tables]
+                labels = np.concatenate([table.column(index_column).to_numpy() for table in tables])
+                offsets = np.cumsum([0] + [table.num_rows for table in tables])
+                order = np.argsort(labels, kind="stable")
+
+                if writer is None:
+                    schema = self._merged_schema(tables, index_column, preserve_index, schema_metadata)
+                    sink = pa.OSFile(str(path), "wb")
+                    writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(
+                        compression=None if compression == "uncompressed" else compression))
+
+                for start in range(0, len(order), block_rows):
+                    rows = order[start:start + block_rows]
+                    table_ids = np.searchsorted(offsets, rows, side="right") - 1
+                    pieces, positions = [], []
+                    for table_id in np.unique(table_ids):
+                        in_table = table_ids == table_id
+                        pieces.append(tables[table_id].take(rows[in_table] - offsets[table_id]))
+                        positions.append(np.flatnonzero(in_table))
+                    block = pa.concat_tables(pieces, promote_options="permissive")
+                    block = block.take(np.argsort(np.concatenate(positions), kind="stable"))
+                    writer.write_table(block.select(schema.names).cast(schema))
+                n_rows += len(order)
+        finally:
+            if writer is not None:
+                writer.close()
+                sink.close()
+        return n_rows
+
+    def _merged_schema(self, tables: list, index_column: str, preserve_index: bool, schema_metadata: dict = None) -> pa.Schema:
+        """Unified schema of the merged tables, with pandas metadata restricted to the kept columns."""
+        schema = pa.unify_schemas([table.schema for table in tables], promote_options="permissive")
+        metadata = dict(tables[0].schema.metadata or {})
+        pandas_metadata = json.loads(metadata[b"pandas"])
+        if not preserve_index:
+            schema = schema.remove(schema.get_field_index(index_column))
+            pandas_metadata["index_columns"] = []
+        pandas_metadata["columns"] = [col for col in pandas_metadata["columns"] if col["field_name"] in schema.names]
+        metadata[b"pandas"] = json.dumps(pandas_metadata).encode()
+        metadata.update(schema_metadata or {})
+        return schema.with_metadata(metadata)
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+
+def _auto_smooth_encoding(counts, sums, squares, prior, prior_variance):
+    """
+    Empirical Bayes target encoding of categories with `counts` rows, target sum `sums` and
+    target sum of squares `squares` (Micci-Barreca eq. 5 and 6, as sklearn's smooth="auto").
+    Categories without rows, or without any variance, get the prior.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts
+        within_variance = (squares - sums * means) / counts
+        shrinkage = prior_variance * counts / (prior_variance * counts + within_variance)
+        encoding = shrinkage * means + (1 - shrinkage) * prior
+    return np.where(np.isnan(shrinkage), prior, encoding)
+
+
+class FactorizedTargetEncoder:
+    """
+    Target encoder with sklearn TargetEncoder's auto smoothing and cross fitting, for frames
+    with high-cardinality columns such as user_id.
+
+    Every column is factorized once (missing values are a category of their own) and all
+    statistics are np.bincount tables over fold_id * n_categories + code, so memory grows with
+    the number of categories rather than with a dense multi-column transform. The folds are
+    passed in by the caller, which lets every column and encoder share the same fold indices.
+    Encoded values are written straight into the frame as float32 `<col>_te` columns.
+
+    Fitted attributes:
+        categories_    - Per column, the pd.Index of the categories seen in training.
+        encodings_     - Per column, the float32 encoding of each category.
+        target_mean_   - Training target mean, the encoding of unseen categories.
+    """
+
+    def __init__(self, suffix: str = "_te"):
+        self.suffix = suffix
+        self.categories_ = {}
+        self.encodings_ = {}
+        self.target_mean_ = None
+
+    @staticmethod
+    def column_statistics(codes, n_categories, fold_ids, n_folds, y) -> tuple:
+        """(n_folds, n_categories) tables of the rows, target sums and target sums of squares of `codes`."""
+        keys = fold_ids * n_categories + codes
+        size = n_folds * n_categories
+        counts = np.bincount(keys, minlength=size).reshape(n_folds, n_categories)
+        sums = np.bincount(keys, weights=y, minlength=size).reshape(n_folds, n_categories)
+        squares = np.bincount(keys, weights=y * y, minlength=size).reshape(n_folds, n_categories)
+        return counts, sums, squares
+
+    @staticmethod
+    def fold_priors(fold_ids, y) -> tuple:
+        """Number of folds, and target mean and variance of the training part of every fold."""
+        n_folds = fold_ids.max() + 1
+        fold_rows = np.bincount(fold_ids, minlength=n_folds)
+        fold_sums = np.bincount(fold_ids, weights=y, minlength=n_folds)
+        fold_squares = np.bincount(fold_ids, weights=y * y, minlength=n_folds)
+        train_rows = len(y) - fold_rows
+        prior = (fold_sums.sum() - fold_sums) / train_rows
+        prior_variance = (fold_squares.sum() - fold_squares) / train_rows - prior ** 2
+        return n_folds, prior, prior_variance
+
+    def fit_statistics(self, col, categories, counts, sums, squares, target_variance, prior, prior_variance):
+        """
+        Fit the encodings of `col` from its column_statistics over the pd.Index `categories` and
+        return its (n_folds, n_categories) out-of-fold encodings. target_mean_ must be set. The
+        statistics may be summed over several parts of the training data.
+        """
+        self.categories_[col] = categories
+        self.encodings_[col] = _auto_smooth_encoding(
+            counts.sum(axis=0), sums.sum(axis=0), squares.sum(axis=0), self.target_mean_, target_variance
+        ).astype(np.float32)
+
+        # Out-of-fold statistics are the totals minus the row's own fold
+        return _auto_smooth_encoding(
+            counts.sum(axis=0) - counts, sums.sum(axis=0) - sums, squares.sum(axis=0) - squares,
+            prior[:, None], prior_variance[:, None])
+
+    def _fit_column(self, col, values, n_folds, fold_ids, y, prior, prior_variance):
+        """Category codes of `values` and their (n_folds, n_categories) encodings fitted out of fold."""
+        codes, uniques = pd.factorize(values.to_numpy(), use_na_sentinel=False)
+        counts, sums, squares = self.column_statistics(codes, len(uniques), fold_ids, n_folds, y)
+        oof_encodings = self.fit_statistics(col, pd.Index(uniques), counts, sums, squares, np.var(y), prior, prior_variance)
+        return codes, oof_encodings
+
+    def fit(self, df: pd.DataFrame, columns: list, y: pd.Series):
+        """Fit the encodings of `columns` on all rows of `df`."""
+        y = np.asarray(y, dtype=np.float64)
+        self.target_mean_ = y.mean()
+        no_folds = np.zeros(len(df), dtype=np.int64)
+        for col in columns:
+            self._fit_column(col, df[col], 1, no_folds, y, np.array([self.target_mean_]), np.array([np.var(y)]))
+        return self
+
+    def fit_transform(self, df: pd.DataFrame, columns: list, y: pd.Series, fold_ids: np.ndarray) -> pd.DataFrame:
+        """
+        Fit the encodings of `columns` on all rows of `df` and add the cross-fitted `<col>_te`
+        columns: each row is encoded with the statistics of the other folds of `fold_ids`.
+        """
+        y = np.asarray(y, dtype=np.float64)
+        self.target_mean_ = y.mean()
+
+        # Target mean and variance of the training part of every fold, shared by all columns
+        n_folds, prior, prior_variance = self.fold_priors(fold_ids, y)
+
+        for col in columns:
+            codes, oof_encodings = self._fit_column(col, df[col], n_folds, fold_ids, y, prior, prior_variance)
+            df[f"{col}{self.suffix}"] = oof_encodings[fold_ids, codes].astype(np.float32)
+        return df
+
+    def transform(self, df: pd.DataFrame, columns: list = None) -> pd.DataFrame:
+        """Add the `<col>_te` columns with the fitted encodings; unseen categories get target_mean_."""
+        if self.target_mean_ is None:
+            raise ValueError("Target Encoder has not been trained! Run on training data first.")
+
+        for col in columns if columns is not None else self.categories_:
+            codes = self.categories_[col].get_indexer(df[col].to_numpy())
+            encoded = np.full(len(df), self.target_mean_, dtype=np.float32)
+            known = codes >= 0
+            encoded[known] = self.encodings_[col][codes[known]]
+            df[f"{col}{self.suffix}"] = encoded
+        return df